@@ -1,58 +1,198 @@
 """Export cleaned and engineered datasets to human-readable text files.
 
 Usage:
-    python scripts/export_data_view.py
+    python scripts/export_data_view.py [--data PATH] [--chunksize N] [--format csv|parquet|feather]
+                                       [--incremental [--refresh]]
+                                       [--deduplicate [--bloom-capacity N]]
+                                       [--delay-flagging global|route|route_hour]
+                                       [--stops PATH [--stop-tolerance M]] [--validate]
+                                       [--route-history] [--compact] [--no-feature-store]
+
+The raw dataset is --data, else dirty_transport_dataset.csv in the project
+root, else in the working directory (data_loader.find_dataset).
+With --chunksize the dataset is streamed in chunks of N rows (bounded memory);
+the files written are the same as in the default in-memory mode.
+With --incremental only rows appended to the dataset since the last run are
+cleaned (with the imputation medians saved in results/cleaner_state.json) and
+added to the cleaned file; the engineered file is rebuilt from it. --refresh
+recomputes the medians over the full history.
+--deduplicate drops re-sent trips (same normalized route and scheduled time)
+before cleaning statistics are taken; --bloom-capacity N keeps the seen trips
+in a Bloom filter sized for N trips (bounded memory, rare false drops).
+--delay-flagging route (or route_hour) also flags delays far from their
+route's (and hour's) median, measured in median absolute deviations.
+--stops PATH reads a stops table (stop_id, latitude, longitude): coordinates
+outside the service area are flagged and cleared, the others are snapped to
+the nearest stop within --stop-tolerance metres (100 by default).
+--validate checks the raw data before cleaning and the cleaned data after it
+(columns, types, ranges, null rates) and stops with a report on failure.
+--route-history adds per-route delay history features (previous trip's delay,
+rolling mean and 90th percentile over the route's last 10 trips and last 24
+hours); it needs the whole dataset, so not with --chunksize alone.
+--compact stores the engineered numeric columns in the smallest lossless
+integer types and float32 (within a 1e-6 relative error); not with
+--chunksize alone either.
+Engineered frames are kept in a content-addressed feature store
+(.feature_store/, keyed by the cleaned data, the feature options and the
+feature code): unchanged cleaned data is not engineered again.
+--no-feature-store always recomputes.
+The fitted feature state (vocabularies, route frequencies, winsor bounds,
+column order) is saved to results/feature_state.json, so new trips can be
+engineered alone: FeatureEngineer.from_state(FeatureEngineer.load_state(path)).transform(batch).
+--format parquet/feather writes columnar files that keep dtypes and can be read
+back column by column (requires pyarrow).
 
 Creates:
 - results/cleaned_data_view.txt  (preview of cleaned data)
 - results/engineered_data_view.txt  (preview of engineered data)
-- results/cleaned_transport_data.csv (full cleaned CSV)
-- results/engineered_transport_data.csv (full engineered CSV)
+- results/cleaned_transport_data.<format> (full cleaned data, csv by default)
+- results/engineered_transport_data.<format> (full engineered data)
+- results/feature_state.json (fitted feature engineering state)
 """
 from pathlib import Path
+import argparse
 import sys
-import os
 
 # allow imports from project root
 sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
 
-import pandas as pd
-from transport_analysis.data_loader import DataLoader
-from transport_analysis.data_cleaner import DataCleaner
-from transport_analysis.feature_engineer import FeatureEngineer
+from transport_analysis.data_loader import DataLoader, save_data, find_dataset  # noqa: E402
+from transport_analysis.data_cleaner import DataCleaner  # noqa: E402
+from transport_analysis.feature_engineer import FeatureEngineer  # noqa: E402
+from transport_analysis.feature_store import FeatureStore, DEFAULT_MAX_BYTES  # noqa: E402
+from transport_analysis.deduplication import TripDeduplicator  # noqa: E402
+from transport_analysis.spatial import StopIndex  # noqa: E402
+from transport_analysis.validation import ValidationError  # noqa: E402
+from transport_analysis.streaming import stream_clean_and_engineer, clean_incremental  # noqa: E402
 
-# locate dataset (same logic as notebook)
-project_root = Path(__file__).resolve().parents[1]
-possible_paths = [project_root / 'dirty_transport_dataset.csv', Path('dirty_transport_dataset.csv')]
-for p in possible_paths:
-    if p.exists():
-        data_path = str(p)
-        break
-else:
-    raise FileNotFoundError('dirty_transport_dataset.csv not found in project root')
 
-print(f"Using dataset: {data_path}")
+def engineer_features(cleaned, store=None, copy=True, **options):
+    """``FeatureEngineer(cleaned).fit(**options)``, from ``store`` when it has been built before."""
+    if store is None:
+        return FeatureEngineer(cleaned, copy=copy).fit(**options)
+    return store.fit(cleaned, copy=copy, **options)
 
-loader = DataLoader(data_path)
-raw = loader.load_data()
 
-cleaner = DataCleaner(raw)
-cleaned = cleaner.run_full_cleaning_pipeline()
+parser = argparse.ArgumentParser(description='Export cleaned and engineered datasets')
+parser.add_argument('--data', default=None,
+                    help='Raw dataset (default: dirty_transport_dataset.csv)')
+parser.add_argument('--chunksize', type=int, default=None,
+                    help='Stream the dataset in chunks of this many rows')
+parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], default='csv',
+                    help='Output file format')
+parser.add_argument('--incremental', action='store_true',
+                    help='Clean only rows appended since the last run')
+parser.add_argument('--refresh', action='store_true',
+                    help='With --incremental: recompute the saved statistics over all rows')
+parser.add_argument('--deduplicate', action='store_true',
+                    help='Drop repeated trips (same route and scheduled time)')
+parser.add_argument('--bloom-capacity', type=int, default=None,
+                    help='With --deduplicate: keep seen trips in a Bloom filter sized for '
+                         'this many trips')
+parser.add_argument('--delay-flagging', choices=['global', 'route', 'route_hour'], default='global',
+                    help='Also flag per-route (per-route and hour) delay outliers')
+parser.add_argument('--stops', default=None,
+                    help='Stops table to validate and snap coordinates against')
+parser.add_argument('--stop-tolerance', type=float, default=100.0,
+                    help='With --stops: snapping distance in metres')
+parser.add_argument('--validate', action='store_true',
+                    help='Check the raw and cleaned data and stop on failure')
+parser.add_argument('--route-history', action='store_true',
+                    help="Add per-route rolling and previous-trip delay features")
+parser.add_argument('--no-feature-store', dest='feature_store', action='store_false',
+                    help='Always recompute the engineered features instead of reusing stored ones')
+parser.add_argument('--compact', action='store_true',
+                    help='Downcast engineered numeric columns (int8.., float32)')
+args = parser.parse_args()
+if args.route_history and args.chunksize and not args.incremental:
+    parser.error('--route-history needs the whole dataset and cannot be streamed with --chunksize')
+if args.compact and args.chunksize and not args.incremental:
+    parser.error('--compact is not supported with --chunksize')
+deduplicator = TripDeduplicator(bloom_capacity=args.bloom_capacity) if args.deduplicate else None
+stops = StopIndex.load(args.stops, tolerance_m=args.stop_tolerance) if args.stops else None
 
-engineer = FeatureEngineer(cleaned)
-# Enable winsorization by default for exported engineered dataset so downstream
+# locate dataset (same logic as notebook)
+project_root = Path(__file__).resolve().parents[1]
+store = None
+if args.feature_store:
+    store = FeatureStore(project_root / '.feature_store', max_bytes=DEFAULT_MAX_BYTES)
+# winsorization is on for the exported engineered dataset so downstream
 # scripts/rebuild_outputs.py and reports use stable numeric features
-engineered = engineer.run_full_feature_engineering(winsorize=True)
+feature_options = {'winsorize': True, 'route_history': args.route_history, 'compact': args.compact}
+data_path = args.data or str(find_dataset(project_root))
+
+print(f"Using dataset: {data_path}")
 
 # Ensure results dir
 results_dir = project_root / 'results'
 results_dir.mkdir(exist_ok=True)
 
-# Save full CSVs
-cleaned_csv = results_dir / 'cleaned_transport_data.csv'
-engineered_csv = results_dir / 'engineered_transport_data.csv'
-cleaned.to_csv(cleaned_csv, index=False)
-engineered.to_csv(engineered_csv, index=False)
+cleaned_out = results_dir / f'cleaned_transport_data.{args.format}'
+engineered_out = results_dir / f'engineered_transport_data.{args.format}'
+feature_state_out = results_dir / 'feature_state.json'
+
+try:
+    if args.incremental:
+        summary = clean_incremental(data_path, cleaned_out, results_dir / 'cleaner_state.json',
+                                    chunksize=args.chunksize or 100_000, refresh=args.refresh,
+                                    deduplicator=deduplicator,
+                                    delay_flagging=args.delay_flagging, stops=stops,
+                                    validate=args.validate)
+        print(f"Cleaned {summary['n_new_rows']} new rows ({summary['n_rows']} in total)")
+        for name, values in summary['drift'].items():
+            print(f"  {name}: saved {values['saved']:.3f}, new rows {values['new_rows']:.3f}")
+        cleaned = DataLoader(cleaned_out).load_data()
+        engineer = engineer_features(cleaned, store, **feature_options)
+        engineered = engineer.df
+        save_data(engineered, engineered_out)
+        engineer.save_state(feature_state_out)
+        cleaned_shape = cleaned.shape
+        engineered_shape = engineered.shape
+    elif args.chunksize:
+        # Enable winsorization by default for exported engineered dataset (see below)
+        summary = stream_clean_and_engineer(data_path, results_dir, chunksize=args.chunksize,
+                                            winsorize=True, cleaned_name=cleaned_out.name,
+                                            engineered_name=engineered_out.name,
+                                            deduplicator=deduplicator,
+                                            delay_flagging=args.delay_flagging,
+                                            stops=stops, validate=args.validate)
+        # previews only need the head of each file
+        cleaned = next(DataLoader(cleaned_out).iter_chunks(chunksize=200))
+        engineered = next(DataLoader(engineered_out).iter_chunks(chunksize=200))
+        state = {'statistics': summary['feature_statistics'], 'winsorize': True,
+                 'columns': list(engineered.columns)}
+        FeatureEngineer.from_state(state).save_state(feature_state_out)
+        cleaned_shape = (summary['n_rows'], cleaned.shape[1])
+        engineered_shape = (summary['n_rows'], engineered.shape[1])
+    else:
+        loader = DataLoader(data_path)
+        raw = loader.load_data()
+
+        # each stage works on the previous stage's frame in place (no defensive copies)
+        cleaner = DataCleaner(raw, copy=False, deduplicator=deduplicator,
+                              delay_flagging=args.delay_flagging, stops=stops,
+                              validate=args.validate)
+        cleaned = cleaner.run_full_cleaning_pipeline()
+        summary = cleaner.get_cleaning_summary()
+        save_data(cleaned, cleaned_out)
+        cleaned_shape = cleaned.shape
+        # feature engineering adds its columns to the cleaned frame: keep the preview rows first
+        cleaned_preview = cleaned.head(200).copy()
+
+        engineer = engineer_features(cleaned, store, copy=False, **feature_options)
+        engineered = engineer.df
+        save_data(engineered, engineered_out)
+        engineer.save_state(feature_state_out)
+        cleaned = cleaned_preview
+        engineered_shape = engineered.shape
+except ValidationError as e:
+    # a concise report instead of a traceback; nothing downstream should run
+    sys.exit(str(e))
+
+if store is not None and store.hits:
+    print('Reused stored engineered features (feature store hit)')
+if args.deduplicate:
+    print(f"Dropped {summary['duplicates_dropped']} duplicate trips")
 
 # Save human-readable previews (first 200 rows)
 cleaned_txt = results_dir / 'cleaned_data_view.txt'
@@ -61,16 +201,17 @@ engineered_txt = results_dir / 'engineered_data_view.txt'
 with cleaned_txt.open('w', encoding='utf-8') as f:
     f.write('CLEANED DATA PREVIEW\n')
     f.write('='*40 + '\n')
-    f.write(f'Shape: {cleaned.shape}\n\n')
+    f.write(f'Shape: {cleaned_shape}\n\n')
     f.write(cleaned.head(200).to_string())
 
 with engineered_txt.open('w', encoding='utf-8') as f:
     f.write('ENGINEERED DATA PREVIEW\n')
     f.write('='*40 + '\n')
-    f.write(f'Shape: {engineered.shape}\n\n')
+    f.write(f'Shape: {engineered_shape}\n\n')
     f.write(engineered.head(200).to_string())
 
-print(f"Saved cleaned CSV to: {cleaned_csv}")
-print(f"Saved engineered CSV to: {engineered_csv}")
+print(f"Saved cleaned data to: {cleaned_out}")
+print(f"Saved engineered data to: {engineered_out}")
+print(f"Saved feature state to: {feature_state_out}")
 print(f"Saved cleaned preview to: {cleaned_txt}")
-print(f"Saved engineered preview to: {engineered_txt}")
\ No newline at end of file
+print(f"Saved engineered preview to: {engineered_txt}")
@@ -6,21 +6,43 @@ import sys
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, os.path.join(ROOT, 'src'))
 
-import pandas as pd
-from transport_analysis.model_builder import ModelBuilder
-from transport_analysis.feature_engineer import FeatureEngineer
-from transport_analysis.explainer import generate_full_shap_for_best_model
+from transport_analysis.model_builder import ModelBuilder  # noqa: E402
+from transport_analysis.explainer import generate_full_shap_for_best_model  # noqa: E402
+from transport_analysis.data_loader import DataLoader, save_data  # noqa: E402
+from transport_analysis.feature_store import FeatureStore, DEFAULT_MAX_BYTES  # noqa: E402
 
-DATA = os.path.join(ROOT, 'results', 'engineered_transport_data.csv')
 OUT_DIR = os.path.join(ROOT, 'results')
+FORMATS = ('csv', 'parquet', 'feather')
+
+
+def latest_export(name):
+    """The newest results/<name>.<format>, so a stale export in another format is not
+    read; the CSV path when there is none."""
+    paths = [os.path.join(OUT_DIR, f'{name}.{ext}') for ext in FORMATS]
+    return max((p for p in paths if os.path.exists(p)), key=os.path.getmtime, default=paths[0])
+
+
+DATA = latest_export('engineered_transport_data')
 
 if __name__ == '__main__':
+    cleaned_path = latest_export('cleaned_transport_data')
+    if not os.path.exists(DATA) and os.path.exists(cleaned_path):
+        # engineer the cleaned export (or reuse the stored result) instead of a full rebuild
+        print('Engineered data not found, engineering features from', cleaned_path)
+        store = FeatureStore(os.path.join(ROOT, '.feature_store'), max_bytes=DEFAULT_MAX_BYTES)
+        engineer = store.fit(DataLoader(cleaned_path).load_data(), copy=False, winsorize=True)
+        ext = os.path.splitext(cleaned_path)[1]
+        DATA = os.path.join(OUT_DIR, 'engineered_transport_data' + ext)
+        save_data(engineer.df, DATA)
     if not os.path.exists(DATA):
         print('Engineered data not found, running rebuild_outputs.py first...')
         import subprocess
         subprocess.check_call([sys.executable, os.path.join(ROOT, 'scripts', 'rebuild_outputs.py')])
+        DATA = latest_export('engineered_transport_data')
 
-    df = pd.read_csv(DATA)
+    loader = DataLoader(DATA)
+    # only the numeric columns are used, whatever the format
+    df = loader.load_data(columns=loader.get_numeric_columns())
     # pick numeric feature columns as feature_names
     X = df.select_dtypes(include=[float, int]).copy()
     # remove target if present
@@ -34,7 +56,8 @@ if __name__ == '__main__':
     generated = []
     for mname in mb.models.keys():
         try:
-            imgs = generate_full_shap_for_best_model(mb.models, X, feature_names=feature_names, out_dir=OUT_DIR, best_model_name=mname)
+            imgs = generate_full_shap_for_best_model(mb.models, X, feature_names=feature_names,
+                                                     out_dir=OUT_DIR, best_model_name=mname)
             if imgs:
                 for im in imgs:
                     if os.path.exists(im):
@@ -1,41 +1,111 @@
 """Rebuild generated outputs by cleaning then running export_data_view.py
 
 Usage:
-    python scripts/rebuild_outputs.py
+    python scripts/rebuild_outputs.py [--no-winsor] [--format csv|parquet|feather]
+                                      [--incremental [--refresh]] [--deduplicate]
+                                      [--no-validate] [--one-hot]
+
+Intermediate datasets are exchanged as the CSV files in results/ (the tracked
+deliverables analysis_notebook.ipynb reads). --format parquet/feather exchanges
+them as columnar files instead (dtypes preserved, only the needed columns are
+read back; needs pyarrow).
+--incremental keeps the cleaned dataset and cleaner state from the previous
+run and only cleans newly appended rows (see export_data_view.py).
+--deduplicate drops re-sent trips before cleaning (see export_data_view.py).
+
+The raw dataset is located once (data_loader.find_dataset: the project root,
+then the working directory) and handed to export_data_view.py with --data, so
+the file validated is the file cleaned.
+
+The raw dataset is validated (columns, types, ranges, null rates) before
+anything is cleaned or removed, the cleaned data before it is written, and the
+engineered data before any model is trained; the first failure stops the
+rebuild with a short report. --no-validate skips the checks.
+
+The models train on the numeric features; --one-hot adds the one-hot
+indicators (ModelBuilder(one_hot=True)).
 """
 import subprocess
 from pathlib import Path
+import argparse
 import sys
 
 ROOT = Path(__file__).resolve().parents[1]
 PY = sys.executable
 
-print('Cleaning existing outputs...')
-subprocess.check_call([PY, str(ROOT / 'scripts' / 'clean_outputs.py')])
+parser = argparse.ArgumentParser(
+    description='Rebuild outputs and optionally force winsorized features for modeling')
+parser.add_argument('--no-winsor', dest='winsorize', action='store_false',
+                    help='Do not apply winsorization to engineered features (default: enabled)')
+parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], default='csv',
+                    help='Format of the intermediate cleaned/engineered datasets')
+parser.add_argument('--incremental', action='store_true',
+                    help='Only clean rows appended since the last run')
+parser.add_argument('--refresh', action='store_true',
+                    help='With --incremental: recompute the saved cleaning statistics')
+parser.add_argument('--deduplicate', action='store_true',
+                    help='Drop repeated trips before cleaning')
+parser.add_argument('--no-validate', dest='validate', action='store_false',
+                    help='Skip the data validation checks')
+parser.add_argument('--no-feature-store', dest='feature_store', action='store_false',
+                    help='Always recompute engineered features')
+parser.add_argument('--compact', action='store_true',
+                    help='Compact engineered dtypes and train on one float32 matrix')
+parser.add_argument('--one-hot', dest='one_hot', action='store_true',
+                    help='Also train on the one-hot indicator columns')
+args = parser.parse_args()
+
+sys.path.insert(0, str(ROOT / 'src'))
+from transport_analysis.validation import ValidationError, check_frame  # noqa: E402
+from transport_analysis.data_loader import DataLoader, find_dataset  # noqa: E402
+
+try:
+    data_path = find_dataset(ROOT)
+except FileNotFoundError as e:
+    sys.exit(f'{e}\nNothing was rebuilt.')
+
+if args.validate:
+    from transport_analysis.data_cleaner import INPUT_RULES
+    # header first, then the ruled columns only: cheap next to the rebuild
+    try:
+        DataLoader(data_path).validate(INPUT_RULES)
+    except ValidationError as e:
+        sys.exit(f'{e}\nNothing was rebuilt.')
+
+export_args = ['--data', str(data_path), '--format', args.format]
+export_args += ['--deduplicate'] if args.deduplicate else []
+export_args += ['--validate'] if args.validate else []
+export_args += [] if args.feature_store else ['--no-feature-store']
+export_args += ['--compact'] if args.compact else []
+if args.incremental:
+    # the cleaned dataset and cleaner state are reused, so results/ is not wiped
+    export_args += ['--incremental'] + (['--refresh'] if args.refresh else [])
+else:
+    print('Cleaning existing outputs...')
+    subprocess.check_call([PY, str(ROOT / 'scripts' / 'clean_outputs.py')])
 print('Re-running export_data_view to regenerate outputs...')
-subprocess.check_call([PY, str(ROOT / 'scripts' / 'export_data_view.py')])
+returncode = subprocess.call([PY, str(ROOT / 'scripts' / 'export_data_view.py')] + export_args)
+if returncode:
+    sys.exit(f'export_data_view.py failed (exit code {returncode}); no model was trained.')
 
 # After data is regenerated, train a model, save artifacts, and generate reports
 print('Training models and generating reports...')
-import pandas as pd
-import matplotlib.pyplot as plt
-import joblib
-import argparse
-# ensure src is on path for local imports
-import sys
-sys.path.insert(0, str(ROOT / 'src'))
-from transport_analysis.model_builder import ModelBuilder
-from transport_analysis.explainer import ModelExplainer
-from transport_analysis.feature_engineer import FeatureEngineer
+import pandas as pd  # noqa: E402
+import matplotlib.pyplot as plt  # noqa: E402
+import joblib  # noqa: E402
+from transport_analysis.model_builder import ModelBuilder, MODEL_INPUT_RULES  # noqa: E402
+from transport_analysis.feature_engineer import FeatureEngineer  # noqa: E402
+from transport_analysis.feature_store import FeatureStore, DEFAULT_MAX_BYTES  # noqa: E402
 
-parser = argparse.ArgumentParser(description='Rebuild outputs and optionally force winsorized features for modeling')
-parser.add_argument('--no-winsor', dest='winsorize', action='store_false', help='Do not apply winsorization to engineered features (default: enabled)')
-args = parser.parse_args()
-
-engineered_path = ROOT / 'results' / 'engineered_transport_data.csv'
+engineered_path = ROOT / 'results' / f'engineered_transport_data.{args.format}'
+cleaned_path = ROOT / 'results' / f'cleaned_transport_data.{args.format}'
 df = None
 if engineered_path.exists():
-    df = pd.read_csv(engineered_path)
+    loader = DataLoader(engineered_path)
+    # without --one-hot modelling only uses the numeric columns, whatever the
+    # format (columnar files skip the rest on read); the indicators are bools
+    columns = None if args.one_hot else loader.get_numeric_columns()
+    df = loader.load_data(columns=columns)
 
 # If winsorization is requested (default) ensure the dataframe used for modeling
 # contains winsorized columns. If not present, recompute engineered features
@@ -47,24 +117,34 @@ if args.winsorize:
             need_recompute = False
     if need_recompute:
         # Load cleaned data (export_data_view.py already regenerated it above)
-        cleaned_path = ROOT / 'results' / 'cleaned_transport_data.csv'
         if cleaned_path.exists():
-            cleaned_df = pd.read_csv(cleaned_path)
+            cleaned_df = DataLoader(cleaned_path).load_data()
         elif df is not None:
             # fallback to engineered df (best effort)
             cleaned_df = df.copy()
         else:
             cleaned_df = pd.DataFrame()
-        fe = FeatureEngineer(cleaned_df)
-        df = fe.run_full_feature_engineering(winsorize=True)
+        if args.feature_store:
+            # built once per distinct cleaned dataset, even across rebuilds
+            store = FeatureStore(ROOT / '.feature_store', max_bytes=DEFAULT_MAX_BYTES)
+            df = store.fit(cleaned_df, copy=False, winsorize=True, compact=args.compact).df
+        else:
+            engineer = FeatureEngineer(cleaned_df, copy=False)
+            df = engineer.fit(winsorize=True, compact=args.compact).df
 # if winsorization disabled and we didn't load engineered file, try to load cleaned
 if df is None:
-    cleaned_path = ROOT / 'results' / 'cleaned_transport_data.csv'
     if cleaned_path.exists():
-        df = pd.read_csv(cleaned_path)
+        df = DataLoader(cleaned_path).load_data()
+
+# fail before RandomForest training, cross-validation and SHAP on a malformed file
+if args.validate:
+    try:
+        check_frame(df, MODEL_INPUT_RULES, 'model input')
+    except ValidationError as e:
+        sys.exit(f'{e}\nNo model was trained.')
 
 # proceed to build models
-mb = ModelBuilder(df)
+mb = ModelBuilder(df, copy=False, compact=args.compact, one_hot=args.one_hot)
 mb.run_all_models()
 comp = mb.get_model_comparison()
 # save a simple performance bar chart
@@ -114,7 +194,7 @@ if not comp.empty:
         # create explainability report (including CV summaries)
         try:
             # Create multi-model explainability report for all trained models
-            from transport_analysis.explainer import create_multi_model_explainability_report, ModelExplainer
+            from transport_analysis.explainer import create_multi_model_explainability_report
             feature_names = mb.prepare_data()[-1]
             # Prepare CV summaries for each model (use full X,y)
             X_train, X_test, y_train, y_test, fnames = mb._prepared_data
@@ -129,7 +209,10 @@ if not comp.empty:
                     cv_results[mname] = {}
 
             report_path = ROOT / 'results' / 'model_explainability_report.html'
-            create_multi_model_explainability_report(mb.models, df[feature_names], feature_names=feature_names, output_path=str(report_path), cv_results=cv_results)
+            create_multi_model_explainability_report(mb.models, df[feature_names],
+                                                     feature_names=feature_names,
+                                                     output_path=str(report_path),
+                                                     cv_results=cv_results)
             print(f'Multi-model explainability report saved to: {report_path}')
 
             # compute time-series CV per model and save per-model fold plots
@@ -165,7 +248,9 @@ if not comp.empty:
                 shap_images_by_model = {}
                 for mname in mb.models.keys():
                     try:
-                        imgs = generate_full_shap_for_best_model(mb.models, df[feature_names], feature_names=feature_names, out_dir=str(ROOT / 'results'), best_model_name=mname)
+                        imgs = generate_full_shap_for_best_model(
+                            mb.models, df[feature_names], feature_names=feature_names,
+                            out_dir=str(ROOT / 'results'), best_model_name=mname)
                         if imgs:
                             shap_images_by_model[mname] = imgs
                     except Exception:
@@ -177,18 +262,20 @@ if not comp.empty:
                         for mname in mb.models.keys():
                             rf.write(f'<h3>{mname}</h3>')
                             # tscv plot
-                            tscv_p = cv_results.get(mname, {}).get('tscv_plot') if cv_results.get(mname) else None
+                            tscv_p = (cv_results.get(mname) or {}).get('tscv_plot')
                             if not tscv_p:
                                 # fallback to file if exists
                                 candidate = ROOT / 'results' / f'{mname}_tscv_plot.png'
                                 if candidate.exists():
                                     tscv_p = str(candidate.name)
                             if tscv_p:
-                                rf.write(f'<p>Time-series CV:</p><img src="{Path(tscv_p).name}" style="max-width:600px;"></img>')
+                                rf.write(f'<p>Time-series CV:</p><img src="{Path(tscv_p).name}"'
+                                         ' style="max-width:600px;"></img>')
                             # shap images
                             imgs = shap_images_by_model.get(mname, [])
                             for im in imgs:
-                                rf.write(f'<p>SHAP plot:</p><img src="{Path(im).name}" style="max-width:700px;"></img>')
+                                rf.write(f'<p>SHAP plot:</p><img src="{Path(im).name}"'
+                                         ' style="max-width:700px;"></img>')
                 except Exception:
                     pass
             except Exception:
@@ -214,7 +301,8 @@ if not comp.empty:
                     # fallback to df from get_feature_impact_summary
                     df_shap = best_expl.get_feature_impact_summary(df[feature_names])
                     fig, ax = plt.subplots(figsize=(6, 4))
-                    ax.barh(df_shap['feature'].head(10)[::-1], df_shap['mean_abs_shap'].head(10)[::-1])
+                    top = df_shap.head(10)[::-1]
+                    ax.barh(top['feature'], top['mean_abs_shap'])
                     plt.tight_layout()
                     fig.savefig(shap_plot, dpi=100, bbox_inches='tight')
                     plt.close(fig)
@@ -222,4 +310,4 @@ if not comp.empty:
         except Exception as e:
             print('Could not save SHAP plot:', e)
 
-print('Rebuild complete.')
\ No newline at end of file
+print('Rebuild complete.')
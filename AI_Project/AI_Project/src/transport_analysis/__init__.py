@@ -1,6 +1,13 @@
 from .data_loader import DataLoader
 from .data_cleaner import DataCleaner
-from .feature_engineer import FeatureEngineer
+from .cleaning_plan import CleaningStatistics
+from .feature_engineer import FeatureEngineer, FeatureStatistics
+from .feature_store import FeatureStore
 from .model_builder import ModelBuilder
 from .explainer import ModelExplainer
-from .utils import align_shap_with_features
+from .utils import align_shap_with_features, ValueCache
+from .quantile_sketch import QuantileSketch
+from .deduplication import TripDeduplicator
+from .spatial import StopIndex
+from .validation import ColumnRule, ValidationError, Validator
+from .streaming import stream_clean_and_engineer, clean_incremental
@@ -0,0 +1,353 @@
+"""The cleaning plan machinery: steps, passes, statistics and step reports.
+
+``CleaningStep`` describes one step of a plan (the cleaner's own is
+data_cleaner.CLEANING_PLAN) and ``compile_plan`` groups a plan into the
+passes DataCleaner runs, phase by phase. ``CleaningStatistics`` gathers the
+dataset-wide values the statistics phase imputes with, mergeable across
+chunks and processes; ``merge_steps`` and ``merge_step_reports`` combine
+what several chunks recorded.
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+
+from .quantile_sketch import QuantileSketch
+
+# Columns added by nearest-stop snapping that are never median-imputed
+STOP_COLUMNS = ('snapped_stop_id', 'stop_distance_m')
+
+# Delay flagging modes: the columns whose groups get their own robust delay
+# statistics ('global' keeps only the fixed +/- 720 minute rule)
+DELAY_FLAGGING = {'global': None, 'route': ('route_id',), 'route_hour': ('route_id', 'hour')}
+# modified z-score (0.6745 * (x - median) / MAD) above which a delay is an outlier
+ROBUST_THRESHOLD = 3.5
+# groups with fewer delays than this are not judged
+ROBUST_MIN_COUNT = 10
+
+
+def _delay_groups(df: pd.DataFrame, by) -> pd.DataFrame:
+    """Group keys of every row (missing where a key is unknown) for per-group delay statistics."""
+    keys = pd.DataFrame(index=df.index)
+    for key in by:
+        if key == 'hour':
+            dt = df['_scheduled_dt'] if '_scheduled_dt' in df.columns else None
+            if dt is not None and pd.api.types.is_datetime64_dtype(dt.dtype):
+                # float, so hours from chunks with and without missing times match
+                keys['hour'] = dt.dt.hour.astype(float)
+            else:
+                keys['hour'] = np.nan
+        elif key in df.columns:
+            keys[key] = df[key].astype(object)
+        else:
+            keys[key] = np.nan
+    return keys
+
+
+def _robust_outlier_mask(delays, median, mad, count, threshold: float) -> np.ndarray:
+    # |0.6745 * (delay - group median) / group MAD| > threshold, in groups large enough to judge
+    judged = (count >= ROBUST_MIN_COUNT) & (mad > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return judged & (np.abs(0.6745 * (delays - median) / mad) > threshold)
+
+
+def _robust_outliers(groups: dict, rows: pd.DataFrame, delays: np.ndarray,
+                     threshold: float) -> np.ndarray:
+    """Delays far from their group's median (``groups``: the statistics' 'delay_groups')."""
+    by = groups['by']
+    table = pd.MultiIndex.from_tuples([tuple(k) for k in groups['keys']], names=by) \
+        if groups['keys'] else pd.MultiIndex.from_arrays([[]] * len(by), names=by)
+    # rows of an unknown group (or with a missing key) are not judged
+    idx = table.get_indexer(pd.MultiIndex.from_frame(rows[by]))
+    median = np.append(np.asarray(groups['median'], dtype=float), np.nan)[idx]
+    mad = np.append(np.asarray(groups['mad'], dtype=float), np.nan)[idx]
+    count = np.append(np.asarray(groups['count']), 0)[idx]
+    return _robust_outlier_mask(delays, median, mad, count, threshold)
+
+
+class CleaningStatistics:
+    """Accumulate the dataset-wide values the cleaner imputes with.
+
+    The cleaner needs a few global statistics (median of non-negative
+    passenger counts, per-column medians for numeric NaN fills and the median
+    of unflagged delays). Feed ``update`` the row-local output of
+    ``DataCleaner.run_row_local_steps`` one chunk at a time and call
+    ``result`` once every chunk has been seen; the medians are exact and equal
+    to what a single in-memory run computes.
+
+    With ``sketch_error`` the values are summarized in mergeable quantile
+    sketches (see QuantileSketch) instead of being kept: memory stays bounded
+    and the medians are approximate, within that rank error.
+
+    With a ``delay_flagging`` mode other than 'global' (see DELAY_FLAGGING)
+    the unflagged delays are kept per route (and hour) instead, for the
+    per-group median and MAD the robust outlier flags are judged against;
+    the delay median then leaves out the delays those flags (with
+    ``robust_threshold``) will catch, so it is the median of the delays
+    neither rule flags.
+    """
+
+    def __init__(self, sketch_error: float = None, delay_flagging: str = 'global',
+                 robust_threshold: float = ROBUST_THRESHOLD):
+        self.sketch_error = sketch_error
+        self.delay_flagging = delay_flagging
+        self.robust_threshold = robust_threshold
+        self._numeric = {}   # column -> list of float arrays (or a QuantileSketch)
+        self._non_numeric = set()
+        self._negative_passengers = 0
+        self._delays = self._new_store()    # unflagged delay values ('global' mode)
+        # per-group delays: list of key/delay frames, rows without a complete key
+        # included (or group key -> QuantileSketch, plus one for the keyless rows)
+        self._group_delays = {} if sketch_error else []
+        self._keyless_delays = self._new_store()
+
+    def _new_store(self):
+        return QuantileSketch(self.sketch_error) if self.sketch_error else []
+
+    def _add(self, store, values):
+        if isinstance(store, QuantileSketch):
+            store.update(values)
+        else:
+            # copied: the cleaner goes on to fill these columns in place
+            store.append(np.array(values, dtype=float, copy=True))
+
+    def update(self, df: pd.DataFrame):
+        num_cols = [c for c in df.select_dtypes(include=[np.number]).columns
+                    if c != 'delay_minutes' and c not in STOP_COLUMNS]
+        for c in num_cols:
+            values = df[c].to_numpy(dtype=float, na_value=np.nan)
+            if c == 'passenger_count':
+                # negatives are replaced by the median of the rest before the column median is taken
+                neg = values < 0
+                self._negative_passengers += int(neg.sum())
+                values = values[~neg]
+            self._add(self._numeric.setdefault(c, self._new_store()), values)
+        # a text column whose chunk happens to be all missing comes out as float;
+        # the full column is not numeric, so it gets no median fill
+        self._non_numeric.update(c for c in df.columns if c not in num_cols)
+        if 'delay_minutes' in df.columns:
+            delays = pd.to_numeric(df.loc[~df['delay_flagged'], 'delay_minutes'], errors='coerce')
+            if DELAY_FLAGGING[self.delay_flagging]:
+                # the delay median waits for the robust flags (see result)
+                self._add_group_delays(df, delays)
+            else:
+                self._add(self._delays, delays.to_numpy(dtype=float, na_value=np.nan))
+        return self
+
+    def _add_group_delays(self, df, delays):
+        groups = _delay_groups(df, DELAY_FLAGGING[self.delay_flagging])
+        groups = groups[~df['delay_flagged'].to_numpy()]
+        groups['delay'] = delays.to_numpy(dtype=float, na_value=np.nan)
+        groups = groups.dropna(subset=['delay'])
+        if isinstance(self._group_delays, list):
+            self._group_delays.append(groups)
+            return
+        keyed = groups.notna().all(axis=1).to_numpy()
+        self._keyless_delays.update(groups['delay'].to_numpy()[~keyed])
+        groups = groups[keyed]
+        # one sketch per group: the loop runs over this chunk's groups, not its rows
+        for key, values in groups.groupby(list(groups.columns[:-1]), sort=False)['delay']:
+            sketch = self._group_delays.get(key)
+            if sketch is None:
+                sketch = self._group_delays[key] = QuantileSketch(self.sketch_error)
+            sketch.update(values.to_numpy())
+
+    def merge(self, other: 'CleaningStatistics'):
+        for c, part in other._numeric.items():
+            mine = self._numeric.setdefault(c, self._new_store())
+            if isinstance(mine, QuantileSketch):
+                mine.merge(part)
+            else:
+                mine.extend(part)
+        self._non_numeric.update(other._non_numeric)
+        self._negative_passengers += other._negative_passengers
+        if isinstance(self._delays, QuantileSketch):
+            self._delays.merge(other._delays)
+        else:
+            self._delays.extend(other._delays)
+        if isinstance(self._group_delays, list):
+            self._group_delays.extend(other._group_delays)
+        else:
+            self._keyless_delays.merge(other._keyless_delays)
+            for key, sketch in other._group_delays.items():
+                if key in self._group_delays:
+                    self._group_delays[key].merge(sketch)
+                else:
+                    self._group_delays[key] = copy.deepcopy(sketch)
+        return self
+
+    def _group_delay_frame(self) -> pd.DataFrame:
+        by = list(DELAY_FLAGGING[self.delay_flagging])
+        if self._group_delays:
+            return pd.concat(self._group_delays, ignore_index=True)
+        return pd.DataFrame(columns=by + ['delay'], dtype=float)
+
+    def _group_delay_statistics(self) -> dict:
+        by = list(DELAY_FLAGGING[self.delay_flagging])
+        if isinstance(self._group_delays, list):
+            groups = self._group_delay_frame().dropna()
+            grouped = groups.groupby(by)['delay']
+            agg = grouped.agg(['median', 'count'])
+            # MAD: median absolute deviation from each row's group median
+            groups['delay'] = (groups['delay'] - grouped.transform('median')).abs()
+            agg['mad'] = groups.groupby(by)['delay'].median()
+            keys = [list(k) if isinstance(k, tuple) else [k] for k in agg.index]
+            median, mad, count = agg['median'].tolist(), agg['mad'].tolist(), agg['count'].tolist()
+        else:
+            keys = sorted(self._group_delays, key=lambda k: tuple(map(str, k)))
+            sketches = [self._group_delays[k] for k in keys]
+            keys = [list(k) for k in keys]
+            median = [sk.median() for sk in sketches]
+            mad = [sk.median_abs_deviation(med) for sk, med in zip(sketches, median)]
+            count = [len(sk) for sk in sketches]
+        # plain Python values, so the statistics stay JSON-serializable (see save_state)
+        keys = [[v.item() if isinstance(v, np.generic) else v for v in k] for k in keys]
+        return {'by': by, 'keys': keys, 'median': [float(v) for v in median],
+                'mad': [float(v) for v in mad], 'count': [int(v) for v in count]}
+
+    def _robust_inliers(self, groups: dict):
+        # the unflagged delays the robust rule keeps, as a store for the median
+        if isinstance(self._group_delays, list):
+            frame = self._group_delay_frame()
+            delays = frame['delay'].to_numpy(dtype=float)
+            return [delays[~_robust_outliers(groups, frame, delays, self.robust_threshold)]]
+        inliers = copy.deepcopy(self._keyless_delays)
+        for sketch in self._group_delays.values():
+            # the same median and MAD as _group_delay_statistics
+            median = sketch.median()
+            mad = sketch.median_abs_deviation(median)
+            inliers.merge(sketch.select(lambda v: ~_robust_outlier_mask(
+                v, median, mad, len(sketch), self.robust_threshold)))
+        return inliers
+
+    def result(self) -> dict:
+        def _median(store, repeat=None, count=0):
+            # ``count`` extra copies of ``repeat`` join the values
+            if isinstance(store, QuantileSketch):
+                if count:
+                    store = copy.deepcopy(store).add_repeated(repeat, count)
+                med = store.median()
+            else:
+                parts = list(store) + ([np.full(count, repeat)] if count else [])
+                med = pd.Series(np.concatenate(parts) if parts else [], dtype=float).median()
+            return 0.0 if pd.isna(med) else float(med)
+
+        stats = {'passenger_count_median': 0.0, 'fill_medians': {}, 'delay_median': 0.0}
+        for c, store in self._numeric.items():
+            if c in self._non_numeric:
+                continue
+            if c == 'passenger_count':
+                med = stats['passenger_count_median'] = _median(store)
+                stats['fill_medians'][c] = _median(store, med, self._negative_passengers)
+            else:
+                stats['fill_medians'][c] = _median(store)
+        if DELAY_FLAGGING[self.delay_flagging]:
+            groups = stats['delay_groups'] = self._group_delay_statistics()
+            stats['delay_median'] = _median(self._robust_inliers(groups))
+        else:
+            stats['delay_median'] = _median(self._delays)
+        return stats
+
+
+# Every step DataCleaner can record, in pipeline order
+PIPELINE_STEPS = [
+    'created_delay_minutes_default_0', 'computed_delay_from_times', 'flagged_extreme_delays',
+    'cleaned_latitude_sentinel', 'cleaned_longitude_sentinel', 'flagged_out_of_bounds_coordinates',
+    'snapped_coordinates_to_stops', 'dropped_duplicate_trips',
+    'fixed_negative_passenger_count', 'flagged_delay_outliers',
+    'normalized_weather', 'standardized_scheduled_time', 'standardized_actual_time',
+    'standardized_passenger_count', 'standardized_latitude', 'standardized_longitude',
+    'normalized_route_id', 'filled_from_raw_where_possible',
+]
+
+
+def merge_steps(step_lists):
+    """Combine the ``cleaning_steps`` of several chunks into one list.
+
+    Each chunk only records the steps that applied to it; the union is put
+    back in pipeline order, as an unsplit run would have recorded it.
+    """
+    merged = []
+    for steps in step_lists:
+        merged.extend(step for step in steps if step not in merged)
+    order = {step: i for i, step in enumerate(PIPELINE_STEPS)}
+    return sorted(merged, key=lambda step: order.get(step, len(order)))
+
+
+def merge_step_reports(reports):
+    """Combine the per-step reports of several chunks: times and rows add up, peaks take the max."""
+    merged = {}
+    for report in reports:
+        for entry in report:
+            mine = merged.setdefault(entry['step'], dict(entry, seconds=0.0, rows_affected=0))
+            mine['seconds'] += entry['seconds']
+            mine['rows_affected'] += entry['rows_affected']
+            if entry['peak_memory_delta'] is not None:
+                mine['peak_memory_delta'] = max(mine['peak_memory_delta'] or 0,
+                                                entry['peak_memory_delta'])
+    return list(merged.values())
+
+
+class CleaningStep:
+    """One entry of a cleaning plan (see data_cleaner.CLEANING_PLAN).
+
+    Frame steps run ``func(cleaner, df, stats)``, which edits ``df`` in place
+    and returns the number of rows it changed. Per-value steps instead name a
+    ``normalizer`` (see data_cleaner.NORMALIZERS) applied to the
+    ``columns(df)`` it selects; consecutive per-value steps are fused so every
+    column is mapped once with the composed normalizers. ``vectorized``, if
+    given, maps a whole list of values at once with the normalizer's results
+    (see utils.map_values). ``prepare`` converts a column before a pass that
+    starts with the step (such a step always starts a new pass).
+
+    A ``defer_missing`` step belongs after the statistics phase but is fused
+    into the pass before it: present values are normalized there, while
+    missing ones wait until the statistics phase has imputed what it imputes
+    (the normalizer must not return missing values for present ones). On
+    columns the earlier pass does not touch it runs after the statistics phase.
+    ``record`` is the name added to ``cleaning_steps`` when the step runs;
+    ``required`` steps cannot be skipped.
+    """
+
+    def __init__(self, name, phase, func=None, normalizer=None, columns=None, prepare=None,
+                 record=None, defer_missing=False, required=False, vectorized=None):
+        self.name = name
+        self.phase = phase
+        self.func = func
+        self.normalizer = normalizer
+        self.vectorized = vectorized
+        self.columns = columns
+        self.prepare = prepare
+        self.record = record
+        self.defer_missing = defer_missing
+        self.required = required
+
+    def __repr__(self):
+        return f'CleaningStep({self.name!r}, {self.phase!r})'
+
+
+def compile_plan(plan, skip_steps=()):
+    """Group ``plan`` (a list of CleaningStep) into passes, by phase.
+
+    Returns ``{phase: [pass, ...]}`` where a pass is a list of steps run
+    together: a frame step alone, or consecutive per-value steps fused into one
+    mapping per column. Steps named in ``skip_steps`` are left out.
+    """
+    names = {step.name for step in plan}
+    unknown = set(skip_steps) - names
+    if unknown:
+        raise ValueError(f'unknown cleaning steps: {sorted(unknown)}')
+    required = [step.name for step in plan if step.required and step.name in skip_steps]
+    if required:
+        raise ValueError(f'cleaning steps cannot be skipped: {required}')
+    passes = {'row_local': [], 'statistics': [], 'standardize': []}
+    for step in plan:
+        if step.name in skip_steps:
+            continue
+        phase = passes[step.phase]
+        fusable = step.normalizer is not None and step.prepare is None
+        if fusable and phase and phase[-1][-1].normalizer is not None:
+            phase[-1].append(step)
+        else:
+            phase.append([step])
+    return passes
@@ -1,311 +1,1101 @@
 import pandas as pd
 import numpy as np
+import copy
+import json
+import os
+import time
+import tracemalloc
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import re
 
+from .cleaning_plan import (CleaningStatistics, CleaningStep, compile_plan, merge_steps,
+                            merge_step_reports, DELAY_FLAGGING, ROBUST_THRESHOLD, STOP_COLUMNS,
+                            _delay_groups, _robust_outliers)
+from .deduplication import TripDeduplicator
+from .spatial import StopIndex
+from .utils import map_values, concat_chunks, ValueCache
+from .validation import ColumnRule, check_frame
+
+
+# Coordinate values treated as missing (sentinels)
+COORDINATE_SENTINELS = [999, 0]
+
+# Bumped whenever a change to the cleaning rules invalidates saved cleaner state
+STATE_VERSION = 3
+
+# Accepted scheduled_time / actual_time formats, tried in this order
+TIME_FORMATS = [
+    '%m/%d/%Y %H:%M', '%m/%d/%Y %I:%M%p', '%m/%d/%Y %I:%M %p',
+    '%m/%d/%Y %H:%M:%S', '%H:%M', '%I:%M%p', '%I:%M %p'
+]
+
+
+# Parse scheduled_time and actual_time into datetimes where possible
+def _parse_time(val):
+    if pd.isna(val):
+        return np.nan
+    s = str(val).strip()
+    # Try common formats
+    for f in TIME_FORMATS:
+        try:
+            return datetime.strptime(s, f)
+        except Exception:
+            continue
+    # Try to extract digits if it's a plain number like '1245' -> HHMM
+    m = re.match(r'^(\d{1,4})$', s)
+    if m:
+        t = m.group(1).zfill(4)
+        try:
+            return datetime.strptime(t, '%H%M')
+        except Exception:
+            return np.nan
+    return np.nan
+
+
+def _parse_times(values: pd.Series) -> pd.Series:
+    """Vectorized ``_parse_time`` over a whole column.
+
+    Each format is tried, in ``TIME_FORMATS`` order, with one
+    ``pd.to_datetime(format=...)`` call over the rows no earlier format matched,
+    so every row gets the first format that parses it (pandas uses the same
+    strptime patterns). Remaining 1-4 digit values are read as HHMM. Columns
+    of strings are parsed once per distinct value.
+    """
+    present = values.notna().to_numpy()
+    if not present.any():
+        # matches the all-NaN float column the row-wise parser produces
+        return values.apply(_parse_time)
+    out = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+    if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) == 'string':
+        codes, uniques = pd.factorize(values)
+        out[present] = _parse_time_strings(pd.Series(uniques, dtype=object))[codes[present]]
+    else:
+        # mixed values (e.g. 1 and 1.0) must not be collapsed by factorize
+        out[present] = _parse_time_strings(pd.Series(values.to_numpy()[present]))
+    result = pd.Series(out, index=values.index)
+    if result.isna().all():
+        return pd.Series(np.nan, index=values.index)
+    return result
+
+
+def _parse_time_strings(values: pd.Series) -> np.ndarray:
+    # the format cascade of _parse_times over non-missing values (default index)
+    remaining = values.astype(str).str.strip()
+    out = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+
+    def _take(strings, fmt):
+        parsed = pd.to_datetime(strings, format=fmt, errors='coerce')
+        hit = parsed.notna().to_numpy()
+        if '%S' in fmt:
+            # pandas rolls seconds 60/61 over into the next minute; strptime rejects them
+            secs = pd.to_numeric(strings.str.rsplit(':', n=1).str[-1], errors='coerce')
+            hit &= (secs < 60).to_numpy()
+        out[strings.index[hit]] = parsed[hit].to_numpy()
+        return strings[~hit]
+
+    for fmt in TIME_FORMATS:
+        if remaining.empty:
+            break
+        remaining = _take(remaining, fmt)
+    # Plain numbers like '1245' -> HHMM
+    digits = remaining[remaining.str.fullmatch(r'\d{1,4}')]
+    if not digits.empty:
+        _take(digits.str.zfill(4), '%H%M')
+    return out
+
+
+def _compute_delays(scheduled: pd.Series, actual: pd.Series) -> pd.Series:
+    """Delay in minutes (actual - scheduled) for whole columns of parsed times.
+
+    Robust alignment for time-only datetimes (year==1900): if one side has no
+    date but the other has a real date, the time-only side is placed on that
+    date and both same-day and next-day alignments are considered; the one
+    with the smallest absolute delta wins (same-day on ties) and is kept only
+    if it lies within a sensible window (+/- 12 hours = 720 minutes),
+    otherwise the delay is NaN (ambiguous / implausible, imputed later).
+    Everything else is the plain difference.
+    """
+    if not (pd.api.types.is_datetime64_dtype(scheduled)
+            and pd.api.types.is_datetime64_dtype(actual)):
+        # a column without a single parsed value: nothing to compute
+        return pd.Series(np.nan, index=scheduled.index, dtype=float)
+    s = scheduled.to_numpy(dtype='datetime64[ns]')
+    a = actual.to_numpy(dtype='datetime64[ns]')
+    minute = np.timedelta64(60, 's')
+    day = np.timedelta64(1, 'D')
+
+    delay = (a - s) / minute
+    s_day = s.astype('datetime64[D]')
+    a_day = a.astype('datetime64[D]')
+    s_undated = s_day.astype('datetime64[Y]') == np.datetime64('1900', 'Y')
+    a_undated = a_day.astype('datetime64[Y]') == np.datetime64('1900', 'Y')
+    # time-of-day difference, i.e. the delta when both sit on the same day
+    same = ((a - a_day) - (s - s_day)) / minute
+    actual_next_day = ((a - a_day) + day - (s - s_day)) / minute
+    scheduled_next_day = ((a - a_day) - day - (s - s_day)) / minute
+
+    # actual is time-only, scheduled has a date: actual on scheduled's day or the day after
+    chosen = np.where(np.abs(same) <= np.abs(actual_next_day), same, actual_next_day)
+    mask = a_undated & ~s_undated
+    delay[mask] = np.where(np.abs(chosen) <= 720, chosen, np.nan)[mask]
+
+    # Symmetric case: scheduled is time-only but actual has a date; scheduled on
+    # actual's day or the day after
+    chosen = np.where(np.abs(same) <= np.abs(scheduled_next_day), same, scheduled_next_day)
+    mask = s_undated & ~a_undated
+    delay[mask] = np.where(np.abs(chosen) <= 720, chosen, np.nan)[mask]
+    return pd.Series(delay, index=scheduled.index, dtype=float)
+
+
+# Trimmed strings that stand for a missing value
+TRIM_PLACEHOLDERS = ('nan', 'None', 'none', '')
+
+
+# Unicode-normalize and trim a string value; common placeholders become NaN.
+# NFKC leaves ASCII text unchanged, so it only runs on non-ASCII strings.
+def _trim_value(v):
+    s = str(v)
+    if not s.isascii():
+        s = unicodedata.normalize('NFKC', s)
+    s = s.strip()
+    return np.nan if s in TRIM_PLACEHOLDERS else s
+
+
+def _trim_values(values):
+    """``_trim_value`` over a list of (distinct) values in one pass, without a call per value."""
+    normalize, placeholders = unicodedata.normalize, TRIM_PLACEHOLDERS
+    stripped = (s.strip() if s.isascii() else normalize('NFKC', s).strip()
+                for s in (v if type(v) is str else str(v) for v in values))
+    return [np.nan if s in placeholders else s for s in stripped]
+
+
+def _to_numeric(values):
+    # nullable extension dtypes (e.g. Int32 from a declared schema) become plain floats
+    values = pd.to_numeric(values, errors='coerce')
+    if pd.api.types.is_extension_array_dtype(values.dtype):
+        values = values.astype('float64')
+    return values
+
+
+# Weather normalization and typo fixes
+def _norm_weather(x):
+    if pd.isna(x):
+        return 'Unknown'
+    s = str(x).strip().lower()
+    if s in ('nan', '', 'none'):
+        return 'Unknown'
+    typos = {
+        'clody': 'cloudy',
+        'suny': 'sunny',
+        'sun': 'sunny',
+        'rain': 'rainy'
+    }
+    s = typos.get(s, s)
+    return s.title()
+
+
+def _format_dt_for_output(dt):
+    if pd.isna(dt):
+        return np.nan
+    try:
+        # Format as ISO date + 12-hour time with AM/PM (international-friendly)
+        if hasattr(dt, 'year') and dt.year != 1900:
+            date_part = f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}"
+            time_part = dt.strftime('%I:%M %p')
+            # remove leading zero from hour for readability e.g. 01:05 -> 1:05
+            if time_part.startswith('0'):
+                time_part = time_part[1:]
+            return f"{date_part} {time_part}"
+        time_part = dt.strftime('%I:%M %p')
+        if time_part.startswith('0'):
+            time_part = time_part[1:]
+        return time_part
+    except Exception:
+        return np.nan
+
+
+# strptime format of the date-time values written by the cleaner (time-only values omit the date)
+OUTPUT_DATETIME_FORMAT = '%Y-%m-%d %I:%M %p'
+
+# '12:00 AM' ... '11:59 PM', indexed by minute of the day
+_CLOCK_TIMES = np.array([f'{(m // 60 + 11) % 12 + 1}:{m % 60:02d} {"AM" if m < 720 else "PM"}'
+                         for m in range(24 * 60)], dtype=object)
+
+
+def _format_times_for_output(values: pd.Series) -> pd.Series:
+    """``_format_dt_for_output`` for a whole datetime64 column, without a call per value.
+
+    The 12-hour time is looked up by minute of the day and the ISO date comes
+    from numpy's day-resolution string conversion; time-only values (year
+    1900) get no date part.
+    """
+    dt = values.to_numpy()
+    missing = np.isnat(dt)
+    days = dt.astype('datetime64[D]')
+    minutes = (dt - days).astype('timedelta64[m]').astype(np.int64)
+    minutes[missing] = 0
+    out = _CLOCK_TIMES[minutes]
+    with_date = ~missing & (days.astype('datetime64[Y]').astype(np.int64) != 1900 - 1970)
+    out[with_date] = days[with_date].astype(str).astype(object) + ' ' + out[with_date]
+    out[missing] = np.nan
+    return pd.Series(out, index=values.index, name=values.name)
+
+
+# Normalize route ids: R03 or 03 -> Route-3; keep existing Route-4
+def _norm_route(x):
+    if pd.isna(x):
+        return 'Unknown'
+    s = str(x).strip()
+    # match R03, r3, 03 etc
+    m = re.match(r'^[rR]?(0*)(\d+)$', s)
+    if m:
+        return f'Route-{int(m.group(2))}'
+    # if already contains 'route' keep title-style
+    if 'route' in s.lower():
+        return s.title()
+    return s
+
+
+# Raw fill-back: which cleaned cells are undefined, which raw values are usable
+RAW_PLACEHOLDERS = ('nan', 'none', '', 'na', 'n/a')
+
+
+def _strings_equal(values: pd.Series, target: str) -> np.ndarray:
+    """Mask of string cells equal to ``target`` after strip + lower; other cells are False."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        cats = values.cat.categories
+        hits = [isinstance(v, str) and v.strip().lower() == target for v in cats]
+        codes = values.cat.codes.to_numpy()
+        return np.asarray(hits, dtype=bool)[codes] & (codes >= 0)
+    if values.dtype != object:
+        return np.zeros(len(values), dtype=bool)
+    # compared once per distinct value; the last slot (False) is picked by missing cells (code -1)
+    codes, uniques = pd.factorize(values)
+    hits = [type(v) is str and v.strip().lower() == target for v in uniques]
+    return np.asarray(hits + [False], dtype=bool)[codes]
+
+
+def _undefined_mask(values: pd.Series) -> np.ndarray:
+    # missing, or the 'Unknown' the normalizers produce
+    return values.isna().to_numpy() | _strings_equal(values, 'unknown')
+
+
+def _placeholder_mask(values: pd.Series) -> np.ndarray:
+    text = values.astype(str).str.strip().str.lower()
+    return values.isna().to_numpy() | text.isin(RAW_PLACEHOLDERS).to_numpy()
+
+
+# Standardize a raw value restored by the fill-back, per target column
+def _restore_time(v):
+    # the row-wise parser also covers dates outside the pandas Timestamp range
+    parsed = _parse_time(v)
+    return str(v).strip() if pd.isna(parsed) else _format_dt_for_output(parsed)
+
+
+def _restore_coordinate(v):
+    try:
+        return round(float(v), 8)
+    except Exception:
+        return v
+
+
+def _restore_count(v):
+    try:
+        return int(round(float(v)))
+    except Exception:
+        return v
+
+
+def _restore_route(v):
+    # raw route ids are restored verbatim (only stripped)
+    return str(v).strip()
+
+
+# Per-value normalizers, run once per distinct value through DataCleaner.normalize
+NORMALIZERS = {
+    'trim': _trim_value,
+    'weather': _norm_weather,
+    'route_id': _norm_route,
+    'time_output': _format_dt_for_output,
+    'restore_time': _restore_time,
+    'restore_coordinate': _restore_coordinate,
+    'restore_count': _restore_count,
+    'restore_route': _restore_route,
+}
+
+# Columns coerced to numbers by the cleaner (non-numeric text becomes NaN)
+NUMERIC_COLUMNS = ('passenger_count', 'latitude', 'longitude')
+
+# Columns rewritten in the standardize phase from a helper column of parsed values
+FORMATTED_FROM = {'scheduled_time': '_scheduled_dt', 'actual_time': '_actual_dt'}
+
+# Normalizer applied to raw values restored into each column (others are restored as-is)
+RAW_RESTORERS = {
+    'scheduled_time': 'restore_time',
+    'actual_time': 'restore_time',
+    'latitude': 'restore_coordinate',
+    'longitude': 'restore_coordinate',
+    'passenger_count': 'restore_count',
+    'weather': 'weather',
+    'route_id': 'restore_route',
+}
+
+
+# Checked by DataCleaner(validate=True) before and after cleaning (see
+# validation.ColumnRule). The input may be as dirty as the cleaner can repair
+# (sentinels, negative counts, a few unparseable cells), not worse.
+INPUT_RULES = {
+    'route_id': ColumnRule(max_null_rate=0.5),
+    'scheduled_time': ColumnRule(max_null_rate=0.5),
+    'actual_time': ColumnRule(max_null_rate=0.5),
+    'weather': ColumnRule(required=False, max_null_rate=0.5),
+    'passenger_count': ColumnRule('number', max_null_rate=0.5, max_invalid_rate=0.1),
+    'latitude': ColumnRule('number', -90, 90, max_null_rate=0.5, max_invalid_rate=0.1,
+                           sentinels=COORDINATE_SENTINELS),
+    'longitude': ColumnRule('number', -180, 180, max_null_rate=0.5, max_invalid_rate=0.1,
+                            sentinels=COORDINATE_SENTINELS),
+}
+OUTPUT_RULES = {
+    'route_id': ColumnRule(max_null_rate=0.5),
+    'passenger_count': ColumnRule('number', 0, max_null_rate=0.0),
+    # coordinates flagged out of bounds by a stops index stay missing
+    'latitude': ColumnRule('number', -90, 90, max_null_rate=0.1),
+    'longitude': ColumnRule('number', -180, 180, max_null_rate=0.1),
+    # delays flagged by the robust rule stay missing
+    'delay_minutes': ColumnRule('number', -720, 720, max_null_rate=0.1),
+    'delay_flagged': ColumnRule('bool', max_null_rate=0.0),
+    'delay_imputed': ColumnRule('bool', max_null_rate=0.0),
+}
+
+
+def _changed_rows(before: pd.Series, after: pd.Series) -> np.ndarray:
+    """Mask of rows whose value differs between ``before`` and ``after`` (missing == missing)."""
+    if before.dtype.kind in 'iufb' and after.dtype.kind in 'iufb':
+        a = before.to_numpy(dtype=float, na_value=np.nan)
+        b = after.to_numpy(dtype=float, na_value=np.nan)
+        return (a != b) & ~(np.isnan(a) & np.isnan(b))
+    a = before.to_numpy(dtype=object)
+    b = after.to_numpy(dtype=object)
+    return (a != b) & ~(pd.isna(a) & pd.isna(b))
+
+
+def _as_text(values: pd.Series) -> pd.Series:
+    # cast to str to avoid errors on mixed object columns; categoricals are mapped per category
+    return values.astype(str) if values.dtype == object else values
+
+
+def _text_columns(df):
+    return list(df.select_dtypes(include=['object', 'category']).columns)
+
+
+def _map_many(func, many, values):
+    return list(many(values)) if many is not None else [func(v) for v in values]
+
+
+def _fused(funcs, defer_from, vectorized):
+    # funcs run in order; from ``defer_from`` on, a missing value is left as it is.
+    # Returns the composed function and its list version (``vectorized``: the
+    # list version of each func, or None) for map_values.
+    def run(v):
+        for i, func in enumerate(funcs):
+            if i >= defer_from and pd.isna(v):
+                return v
+            v = func(v)
+        return v
+
+    def many(values):
+        # the same, one function at a time over all values (see map_values)
+        values = list(values)
+        for i, (func, func_many) in enumerate(zip(funcs, vectorized)):
+            if i < defer_from:
+                values = _map_many(func, func_many, values)
+                continue
+            todo = [j for j, v in enumerate(values) if not pd.isna(v)]
+            for j, result in zip(todo, _map_many(func, func_many, [values[j] for j in todo])):
+                values[j] = result
+        return values
+
+    return run, many
+
+
+# --- cleaning steps: func(cleaner, df, stats) edits df in place, returns the rows it changed
+
+def _step_default_delay(cleaner, df, stats):
+    # Try to create a numeric target 'delay_minutes' if missing
+    if 'delay_minutes' in df.columns:
+        return 0
+    df['delay_minutes'] = 0.0
+    cleaner.cleaning_steps.append('created_delay_minutes_default_0')
+    return len(df)
+
+
+def _step_parse_times(cleaner, df, stats):
+    parsed = np.zeros(len(df), dtype=bool)
+    for src, dst in (('scheduled_time', '_scheduled_dt'), ('actual_time', '_actual_dt')):
+        if src in df.columns:
+            df[dst] = _parse_times(df[src])
+            parsed |= df[dst].notna().to_numpy()
+    return parsed.sum()
+
+
+def _step_compute_delays(cleaner, df, stats):
+    # Compute delay_minutes if possible: actual - scheduled in minutes
+    if '_scheduled_dt' not in df.columns or '_actual_dt' not in df.columns:
+        return 0
+    df['delay_minutes'] = _compute_delays(df['_scheduled_dt'], df['_actual_dt'])
+    cleaner.cleaning_steps.append('computed_delay_from_times')
+
+    # flag rows where delay could not be computed (NaN) so we can impute later
+    df['delay_computed'] = df['delay_minutes'].notna()
+
+    # After finishing computations, if any delays are extremely large (>|12 hours|)
+    # mark them for review
+    df['delay_flagged'] = df['delay_minutes'].abs().gt(720).fillna(False)
+    # Set flagged extremes to NaN to avoid silently poisoning downstream models
+    df.loc[df['delay_flagged'], 'delay_minutes'] = np.nan
+    if df['delay_flagged'].any():
+        cleaner.cleaning_steps.append('flagged_extreme_delays')
+    return df['delay_computed'].sum()
+
+
+def _step_coerce_numeric(cleaner, df, stats):
+    # Negative passenger counts are fixed in the statistics phase (needs the global median)
+    lost = np.zeros(len(df), dtype=bool)
+    for c in NUMERIC_COLUMNS:
+        if c in df.columns:
+            values = _to_numeric(df[c])
+            lost |= df[c].notna().to_numpy() & values.isna().to_numpy()
+            df[c] = values
+    return lost.sum()
+
+
+def _step_coordinate_sentinels(cleaner, df, stats):
+    # Clean coordinates: treat sentinel values like 999 or 0.0 as NaN
+    hit = np.zeros(len(df), dtype=bool)
+    for coord in ('latitude', 'longitude'):
+        if coord in df.columns:
+            mask_bad = df[coord].isin(COORDINATE_SENTINELS)
+            if mask_bad.any():
+                # assigned as a new column: never written into the raw values (see copy=False)
+                df[coord] = df[coord].mask(mask_bad)
+                cleaner.cleaning_steps.append(f'cleaned_{coord}_sentinel')
+                hit |= mask_bad.to_numpy()
+    return hit.sum()
+
+
+def _step_snap_to_stops(cleaner, df, stats):
+    # With a stops reference table (see StopIndex): coordinates outside the
+    # service area are cleared and flagged (they stay missing, see
+    # _unflagged_coordinates); the others are snapped to the nearest stop
+    # within the tolerance
+    stops = cleaner.stops
+    if stops is None or 'latitude' not in df.columns or 'longitude' not in df.columns:
+        return 0
+    lat = pd.to_numeric(df['latitude'], errors='coerce')
+    lon = pd.to_numeric(df['longitude'], errors='coerce')
+    match = stops.snap(lat.to_numpy(dtype=float, na_value=np.nan),
+                       lon.to_numpy(dtype=float, na_value=np.nan))
+    stop = match['stop'].to_numpy()
+    hit = stop >= 0
+    out = match['out_of_bounds'].to_numpy()
+    ids = np.full(len(df), np.nan, dtype=object)
+    ids[hit] = stops.stop_ids[stop[hit]]
+    for coord, values in (('latitude', stops.latitude), ('longitude', stops.longitude)):
+        snapped = pd.Series(values[np.where(hit, stop, 0)], index=df.index)
+        # assigned as a new column, not in place: copy=False shares the raw columns
+        df[coord] = df[coord].where(~hit, snapped).mask(out)
+    df['snapped_stop_id'] = ids
+    df['stop_distance_m'] = match['distance_m'].to_numpy()
+    df['coordinate_flagged'] = out
+    if out.any():
+        cleaner.cleaning_steps.append('flagged_out_of_bounds_coordinates')
+    if hit.any():
+        cleaner.cleaning_steps.append('snapped_coordinates_to_stops')
+    return (hit | out).sum()
+
+
+def _step_delay_columns(cleaner, df, stats):
+    # Ensure delay-related flags exist even if no time columns were present
+    if 'delay_minutes' not in df.columns:
+        df['delay_minutes'] = np.nan
+    if 'delay_flagged' not in df.columns:
+        df['delay_flagged'] = False
+    if 'delay_computed' not in df.columns:
+        df['delay_computed'] = df['delay_minutes'].notna()
+    if 'delay_imputed' not in df.columns:
+        df['delay_imputed'] = False
+    return 0
+
+
+def _step_fix_negative_passengers(cleaner, df, stats):
+    # Fix negative passenger counts (set to median of non-negative values)
+    if 'passenger_count' not in df.columns:
+        return 0
+    mask_neg = df['passenger_count'] < 0
+    if mask_neg.any():
+        df.loc[mask_neg, 'passenger_count'] = stats['passenger_count_median']
+        cleaner.cleaning_steps.append('fixed_negative_passenger_count')
+    return mask_neg.sum()
+
+
+def _unflagged_coordinates(df: pd.DataFrame, column: str) -> np.ndarray:
+    # rows whose ``column`` may be filled in: not a coordinate flagged out of bounds
+    if column not in ('latitude', 'longitude') or 'coordinate_flagged' not in df.columns:
+        return np.ones(len(df), dtype=bool)
+    return ~df['coordinate_flagged'].to_numpy(dtype=bool)
+
+
+def _step_impute_medians(cleaner, df, stats):
+    # Fill NaNs for numeric columns with sensible defaults (median)
+    # NOTE: exclude 'delay_minutes' from generic fill so we can handle imputation policy explicitly
+    filled = np.zeros(len(df), dtype=bool)
+    num_cols = [c for c in df.select_dtypes(include=[np.number]).columns
+                if c != 'delay_minutes' and c not in STOP_COLUMNS]
+    for c in num_cols:
+        # out-of-bounds coordinates are left missing, not moved to the median point
+        missing = df[c].isna().to_numpy() & _unflagged_coordinates(df, c)
+        if missing.any() and c in stats['fill_medians']:
+            df[c] = df[c].mask(missing, stats['fill_medians'][c])
+            filled |= missing
+    return filled.sum()
+
+
+def _step_flag_delay_outliers(cleaner, df, stats):
+    # Per-group robust flags: |0.6745 * (delay - group median) / group MAD| > threshold
+    by = DELAY_FLAGGING[cleaner.delay_flagging]
+    if by is None or 'delay_minutes' not in df.columns:
+        return 0
+    if 'delay_groups' not in stats:
+        raise ValueError(f'statistics have no per-group delay statistics for '
+                         f'delay_flagging={cleaner.delay_flagging!r}')
+    delays = pd.to_numeric(df['delay_minutes'], errors='coerce')
+    delays = delays.to_numpy(dtype=float, na_value=np.nan)
+    outlier = _robust_outliers(stats['delay_groups'], _delay_groups(df, by), delays,
+                               cleaner.robust_threshold)
+    outlier &= ~df['delay_flagged'].to_numpy()
+    if outlier.any():
+        df['delay_flagged'] = df['delay_flagged'].to_numpy() | outlier
+        # flagged delays are set to NaN and not imputed, like the extreme ones
+        df['delay_minutes'] = df['delay_minutes'].mask(outlier)
+        cleaner.cleaning_steps.append('flagged_delay_outliers')
+    return outlier.sum()
+
+
+def _step_impute_delays(cleaner, df, stats):
+    # Handle delay_minutes imputation policy:
+    # - Rows where delay_flagged==True should remain NaN for manual review
+    # - Other NaN delays will be imputed with the median of non-NaN, non-flagged delays
+    if 'delay_minutes' not in df.columns:
+        return 0
+    med = stats['delay_median']
+    # mark rows that will be imputed
+    mask_impute = df['delay_minutes'].isna() & (~df['delay_flagged'])
+    df.loc[mask_impute, 'delay_minutes'] = med
+    df['delay_imputed'] = mask_impute
+    # for flagged rows, ensure delay_imputed is False (they remain NaN)
+    df.loc[df['delay_flagged'], 'delay_imputed'] = False
+    return mask_impute.sum()
+
+
+def _step_format_times(cleaner, df, stats):
+    # scheduled_time/actual_time -> consistent string format
+    formatted = np.zeros(len(df), dtype=bool)
+    for src, dst in (('_scheduled_dt', 'scheduled_time'), ('_actual_dt', 'actual_time')):
+        if src in df.columns:
+            if pd.api.types.is_datetime64_dtype(df[src].dtype):
+                df[dst] = _format_times_for_output(df[src])
+            else:
+                # e.g. datetimes outside the pandas Timestamp range
+                df[dst] = cleaner.normalize(df[src], 'time_output')
+            cleaner.cleaning_steps.append(f'standardized_{dst}')
+            formatted |= df[dst].notna().to_numpy()
+    return formatted.sum()
+
+
+def _step_round_passenger_count(cleaner, df, stats):
+    # Passenger counts should be integer-like
+    if 'passenger_count' not in df.columns:
+        return 0
+    # Round and convert to int (counts)
+    before = df['passenger_count']
+    df['passenger_count'] = before.round().fillna(0).astype(int)
+    cleaner.cleaning_steps.append('standardized_passenger_count')
+    return _changed_rows(before, df['passenger_count']).sum()
+
+
+def _step_round_coordinates(cleaner, df, stats):
+    # Coordinates: ensure floats and consistent precision
+    changed = np.zeros(len(df), dtype=bool)
+    for coord in ('latitude', 'longitude'):
+        if coord in df.columns:
+            before = df[coord]
+            # round to 8 decimals for consistency
+            df[coord] = pd.to_numeric(before, errors='coerce').round(8)
+            cleaner.cleaning_steps.append(f'standardized_{coord}')
+            changed |= _changed_rows(before, df[coord])
+    return changed.sum()
+
+
+def _step_fill_from_raw(cleaner, df, stats):
+    # Fill undefined values from the original raw dataset when possible.
+    # Rows are never dropped, so df and the raw data line up position by position.
+    restored = np.zeros(len(df), dtype=bool)
+    for c in df.columns:
+        if c not in cleaner.raw_columns:
+            continue
+        # the raw value of a coordinate flagged out of bounds is the one rejected
+        pos = np.flatnonzero(_undefined_mask(df[c]) & _unflagged_coordinates(df, c))
+        if not len(pos):
+            continue
+        pos, raw = cleaner.raw_values(c, pos)
+        if not len(pos):
+            continue
+        name = RAW_RESTORERS.get(c)
+        if name is None:
+            values = raw.to_numpy()
+        else:
+            values = cleaner.normalize(raw, name)
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # let a column of plain numbers keep a numeric dtype
+                values = values.astype(object).infer_objects()
+            values = values.to_numpy()
+        # categorical columns only accept known categories
+        if isinstance(df[c].dtype, pd.CategoricalDtype):
+            known = df[c].cat.categories
+            new = [v for v in pd.unique(values) if v not in known]
+            if new:
+                df[c] = df[c].cat.add_categories(new)
+        elif values.dtype == object and df[c].dtype != object:
+            # e.g. an unparseable raw coordinate restored as text
+            df[c] = df[c].astype(object)
+        df.iloc[pos, df.columns.get_loc(c)] = values
+        restored[pos] = True
+    cleaner.cleaning_steps.append('filled_from_raw_where_possible')
+    return restored.sum()
+
+
+# The cleaning plan, in run order. Phases: 'row_local' (safe per chunk),
+# 'statistics' (needs the dataset-wide CleaningStatistics) and 'standardize'.
+CLEANING_PLAN = [
+    CleaningStep('trim', 'row_local', normalizer='trim', vectorized=_trim_values,
+                 columns=_text_columns, prepare=_as_text),
+    CleaningStep('normalize_weather', 'row_local', normalizer='weather',
+                 record='normalized_weather', defer_missing=True,
+                 columns=lambda df: ['weather'] if 'weather' in df.columns else []),
+    CleaningStep('normalize_route_id', 'row_local', normalizer='route_id',
+                 record='normalized_route_id', defer_missing=True,
+                 columns=lambda df: ['route_id'] if 'route_id' in df.columns else []),
+    CleaningStep('default_delay', 'row_local', _step_default_delay),
+    CleaningStep('parse_times', 'row_local', _step_parse_times),
+    CleaningStep('compute_delays', 'row_local', _step_compute_delays),
+    CleaningStep('coerce_numeric', 'row_local', _step_coerce_numeric),
+    CleaningStep('coordinate_sentinels', 'row_local', _step_coordinate_sentinels),
+    CleaningStep('snap_to_stops', 'row_local', _step_snap_to_stops),
+    CleaningStep('delay_columns', 'row_local', _step_delay_columns, required=True),
+    CleaningStep('fix_negative_passengers', 'statistics', _step_fix_negative_passengers),
+    CleaningStep('impute_medians', 'statistics', _step_impute_medians),
+    CleaningStep('flag_delay_outliers', 'statistics', _step_flag_delay_outliers),
+    CleaningStep('impute_delays', 'statistics', _step_impute_delays),
+    CleaningStep('format_times', 'standardize', _step_format_times),
+    CleaningStep('round_passenger_count', 'standardize', _step_round_passenger_count),
+    CleaningStep('round_coordinates', 'standardize', _step_round_coordinates),
+    CleaningStep('fill_from_raw', 'standardize', _step_fill_from_raw),
+]
+
+
+# Process-pool workers for DataCleaner.run_full_cleaning_pipeline(n_jobs=...)
+# (the chunks are private to the worker, so they are cleaned without copies)
+def _check_rules(df, rules, where):
+    check_frame(df, rules, where)
+    return 0
+
+
+def _chunk_statistics(chunk, value_cache, sketch_error=None, options=None):
+    cleaner = DataCleaner(chunk, value_cache=value_cache, copy=False, **(options or {}))
+    acc = CleaningStatistics(sketch_error, cleaner.delay_flagging, cleaner.robust_threshold)
+    return acc.update(cleaner.run_row_local_steps(cleaner.df))
+
+
+def _chunk_trip_keys(chunk, value_cache, deduplicator, options=None):
+    cleaner = DataCleaner(chunk, value_cache=value_cache, copy=False, **(options or {}))
+    return deduplicator.key_hashes(cleaner.run_row_local_steps(cleaner.df))
+
+
+def _clean_chunk(chunk, statistics, value_cache, options=None):
+    cleaner = DataCleaner(chunk, statistics=statistics, value_cache=value_cache, copy=False,
+                          **(options or {}))
+    return cleaner.run_full_cleaning_pipeline(), cleaner.cleaning_steps, cleaner.step_report
+
+
+def cleaning_options(delay_flagging: str = 'global', robust_threshold: float = ROBUST_THRESHOLD,
+                     stops: StopIndex = None, deduplicator: TripDeduplicator = None,
+                     skip_steps=()) -> dict:
+    """The DataCleaner options a saved state's statistics depend on (JSON-serializable)."""
+    return {
+        'delay_flagging': delay_flagging,
+        'robust_threshold': float(robust_threshold),
+        'skip_steps': sorted(skip_steps),
+        'stops': None if stops is None else stops.digest(),
+        # the trip key only: how the seen keys are stored does not change the output
+        'deduplicator': None if deduplicator is None else {
+            'coordinates': bool(deduplicator.coordinates),
+            'coordinate_decimals': int(deduplicator.coordinate_decimals)},
+    }
+
 
 class DataCleaner:
-    def __init__(self, df: pd.DataFrame):
-        self.df = df.copy()
-        # keep a copy of original raw data for possible fill-back
-        self.raw_df = df.copy()
+    def __init__(self, df: pd.DataFrame, statistics: dict = None, value_cache: ValueCache = None,
+                 skip_steps=(), profile_memory: bool = False, copy: bool = True,
+                 deduplicator: TripDeduplicator = None, delay_flagging: str = 'global',
+                 robust_threshold: float = ROBUST_THRESHOLD, stops: StopIndex = None,
+                 validate: bool = False):
+        self.copy = copy
+        self.raw_columns = list(df.columns)
+        if copy:
+            self.df = df.copy()
+            # keep a copy of original raw data for possible fill-back
+            self.raw_df = df.copy()
+            self._raw_ref = None
+        else:
+            # clean ``df`` itself. The raw columns are only referenced until the
+            # row-local steps have replaced them; then the cells the fill-back
+            # may still need are kept in ``raw_cells`` and the rest is released.
+            self.df = df
+            self.raw_df = None
+            self._raw_ref = df.copy(deep=False)
+        # column -> (row positions, raw values) of fill-back candidates (copy=False)
+        self.raw_cells = None
         self.cleaning_steps = []
+        # precomputed dataset-wide statistics (see CleaningStatistics); computed
+        # from this frame when not supplied
+        self.statistics = statistics
+        # optional normalizer results shared across runs / chunks
+        self.value_cache = value_cache
+        # names of CLEANING_PLAN steps to leave out
+        self.skip_steps = list(skip_steps)
+        self.passes = compile_plan(CLEANING_PLAN, self.skip_steps)
+        # tracemalloc slows the run down several times, so peak memory is opt-in
+        # (it is also reported when tracemalloc is already tracing)
+        self.profile_memory = profile_memory
+        # one entry per executed pass: step, phase, seconds, peak_memory_delta, rows_affected
+        self.step_report = []
+        # per-value steps waiting for the statistics phase: column -> (row positions, steps)
+        self._deferred = {}
+        # optional TripDeduplicator: repeated trips are dropped after the row-local
+        # steps (before any statistics are taken); share one across chunks
+        self.deduplicator = deduplicator
+        self.duplicates_dropped = 0
+        self._duplicates = None
+        # 'global': only the fixed +/- 720 minute rule; 'route' / 'route_hour' also
+        # flag delays far from their route's (and hour's) median, in MADs
+        if delay_flagging not in DELAY_FLAGGING:
+            raise ValueError(f'unknown delay_flagging {delay_flagging!r}; '
+                             f'use one of {sorted(DELAY_FLAGGING)}')
+        self.delay_flagging = delay_flagging
+        self.robust_threshold = robust_threshold
+        # optional StopIndex: coordinates are validated against it and snapped to stops
+        self.stops = stops
+        # check INPUT_RULES / OUTPUT_RULES around the pipeline (timed in step_report)
+        self.validate = validate
+
+    def _options(self):
+        return {'skip_steps': self.skip_steps, 'profile_memory': self.profile_memory,
+                'delay_flagging': self.delay_flagging, 'robust_threshold': self.robust_threshold,
+                'stops': self.stops}
+
+    def normalize(self, values: pd.Series, name: str, many=None) -> pd.Series:
+        """Run the ``NORMALIZERS[name]`` function over ``values``, once per distinct value.
+
+        ``many`` is its list version, if it has one (see utils.map_values).
+        """
+        cache = self.value_cache.table(name) if self.value_cache is not None else None
+        return map_values(values, NORMALIZERS[name], cache, many)
+
+    def _normalize_chain(self, values: pd.Series, steps, defer_from: int) -> pd.Series:
+        # one mapping with the composed normalizers (cached under the joined names)
+        names = [step.normalizer for step in steps]
+        if len(names) == 1 and defer_from:
+            return self.normalize(values, names[0], steps[0].vectorized)
+        name = '+'.join(names) + (f'@{defer_from}' if defer_from < len(names) else '')
+        cache = self.value_cache.table(name) if self.value_cache is not None else None
+        func, many = _fused([NORMALIZERS[n] for n in names], defer_from,
+                            [step.vectorized for step in steps])
+        return map_values(values, func, cache, many)
+
+    def run_full_cleaning_pipeline(self, n_jobs: int = 1, chunksize: int = None,
+                                   sketch_error: float = None):
+        """Clean ``self.df``; ``n_jobs`` > 1 (or None for every core) cleans in parallel.
+
+        The parallel mode splits the rows into chunks of ``chunksize`` (default:
+        one per worker) and runs two passes over a process pool: the row-local
+        steps to gather each chunk's CleaningStatistics, which are merged into
+        the global medians, then the full pipeline per chunk with those medians.
+        The result equals the single-process output. ``sketch_error`` takes the
+        medians from quantile sketches instead (see CleaningStatistics).
+
+        With ``validate=True`` the input is checked against ``INPUT_RULES``
+        before anything runs and the result against ``OUTPUT_RULES``; a failure
+        raises ValidationError.
+        """
+        if n_jobs is None:
+            n_jobs = os.cpu_count() or 1
+        if self.validate:
+            self._profile('validate_input', 'validation', _check_rules, self.df, INPUT_RULES,
+                          'cleaner input')
+        if n_jobs > 1 and len(self.df) > 1:
+            df = self._run_parallel(n_jobs, chunksize, sketch_error)
+        else:
+            df = self.run_row_local_steps(self.df)
+            if self.statistics is None:
+                acc = CleaningStatistics(sketch_error, self.delay_flagging, self.robust_threshold)
+                self.statistics = acc.update(df).result()
+            df = self.apply_statistics(df, self.statistics)
+            df = self.run_standardization_steps(df)
+            # fused steps record out of plan order; report them in pipeline order
+            self.cleaning_steps = merge_steps([self.cleaning_steps])
+            self.df = df
+        if self.validate:
+            self._profile('validate_output', 'validation', _check_rules, df, OUTPUT_RULES,
+                          'cleaned data')
+        return df
 
-    def run_full_cleaning_pipeline(self):
-        # Basic cleaning that keeps things simple and reproducible
-        df = self.df
-        # Trim whitespace and normalize unicode for string columns
-        for c in df.select_dtypes(include=['object']).columns:
-            # Cast to str to avoid errors, then normalize and strip
-            df[c] = (
-                df[c]
-                .astype(str)
-                .apply(lambda s: unicodedata.normalize('NFKC', s).strip() if pd.notna(s) else s)
-            )
-            # Convert common string placeholders to real NaN
-            df[c] = df[c].replace({'nan': np.nan, 'None': np.nan, 'none': np.nan, '': np.nan})
-
-        # Try to create a numeric target 'delay_minutes' if missing
-        if 'delay_minutes' not in df.columns:
-            df['delay_minutes'] = 0.0
-            self.cleaning_steps.append('created_delay_minutes_default_0')
-
-        # Parse scheduled_time and actual_time into datetimes where possible
-        def _parse_time(val):
-            if pd.isna(val):
-                return np.nan
-            s = str(val).strip()
-            # Try common formats
-            fmts = [
-                '%m/%d/%Y %H:%M', '%m/%d/%Y %I:%M%p', '%m/%d/%Y %I:%M %p',
-                '%m/%d/%Y %H:%M:%S', '%H:%M', '%I:%M%p', '%I:%M %p'
-            ]
-            for f in fmts:
-                try:
-                    return datetime.strptime(s, f)
-                except Exception:
+    def _run_parallel(self, n_jobs: int, chunksize: int = None, sketch_error: float = None):
+        if chunksize is None:
+            chunksize = -(-len(self.df) // n_jobs)
+        chunks = [self.df.iloc[i:i + chunksize] for i in range(0, len(self.df), chunksize)]
+        caches = [self.value_cache] * len(chunks)
+        options = [self._options()] * len(chunks)
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks))) as pool:
+            if self.deduplicator is not None:
+                # keys are hashed in parallel and checked in row order; the repeats
+                # are dropped from the raw chunks before they are cleaned
+                keys = list(pool.map(_chunk_trip_keys, chunks, caches,
+                                     [copy.copy(self.deduplicator).reset()] * len(chunks), options))
+                for i, (hashes, valid) in enumerate(keys):
+                    dup = self.deduplicator.mark(hashes, valid)
+                    self.duplicates_dropped += int(dup.sum())
+                    chunks[i] = chunks[i].take(np.flatnonzero(~dup))
+                chunks = [chunk for chunk in chunks if len(chunk)] or chunks[:1]
+                caches, options = caches[:len(chunks)], options[:len(chunks)]
+            if self.statistics is None:
+                acc = CleaningStatistics(sketch_error, self.delay_flagging, self.robust_threshold)
+                errors = [sketch_error] * len(chunks)
+                for part in pool.map(_chunk_statistics, chunks, caches, errors, options):
+                    acc.merge(part)
+                self.statistics = acc.result()
+            statistics = [self.statistics] * len(chunks)
+            results = list(pool.map(_clean_chunk, chunks, statistics, caches, options))
+        step_lists = [steps for _, steps, _ in results]
+        if self.duplicates_dropped:
+            step_lists.append(['dropped_duplicate_trips'])
+        self.cleaning_steps = merge_steps(step_lists)
+        self.step_report += merge_step_reports(report for _, _, report in results)
+        self.df = concat_chunks([df for df, _, _ in results])
+        return self.df
+
+    def _run_phase(self, phase: str, df: pd.DataFrame, stats: dict = None):
+        for steps in self.passes[phase]:
+            label = '+'.join(step.name for step in steps)
+            if steps[0].func is not None:
+                self._profile(label, phase, steps[0].func, self, df, stats)
+            else:
+                self._profile(label, phase, self._run_value_pass, steps, df)
+        return df
+
+    def _profile(self, label, phase, func, *args):
+        started = self.profile_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        rows = func(*args)
+        seconds = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] - base if tracing else None
+        if started:
+            tracemalloc.stop()
+        self.step_report.append({'step': label, 'phase': phase, 'seconds': seconds,
+                                 'peak_memory_delta': peak, 'rows_affected': int(rows)})
+
+    def _run_value_pass(self, steps, df):
+        chains = {}
+        for step in steps:
+            for c in step.columns(df):
+                # a deferred step never starts a column's chain: it waits for its phase
+                if step.defer_missing and c not in chains:
+                    self._deferred.setdefault(c, (None, []))[1].append(step)
                     continue
-            # Try to extract digits if it's a plain number like '1245' -> HHMM
-            m = re.match(r'^(\d{1,4})$', s)
-            if m:
-                t = m.group(1).zfill(4)
-                try:
-                    return datetime.strptime(t, '%H%M')
-                except Exception:
-                    return np.nan
-            return np.nan
+                chains.setdefault(c, []).append(step)
+        changed = np.zeros(len(df), dtype=bool)
+        for c, chain in chains.items():
+            before = df[c]
+            values = chain[0].prepare(before) if chain[0].prepare is not None else before
+            deferred = [i for i, step in enumerate(chain) if step.defer_missing]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # categories are mapped one by one anyway; the statistics phase never fills them
+                for step in chain:
+                    values = self.normalize(values, step.normalizer, step.vectorized)
+            else:
+                defer_from = deferred[0] if deferred else len(chain)
+                values = self._normalize_chain(values, chain, defer_from)
+                if deferred:
+                    self._deferred[c] = (np.flatnonzero(values.isna().to_numpy()),
+                                         chain[defer_from:])
+            changed |= _changed_rows(before, values)
+            df[c] = values
+        for step in steps:
+            if step.record and (any(step in chain for chain in chains.values())
+                                or any(step in rest for _, rest in self._deferred.values())):
+                self.cleaning_steps.append(step.record)
+        return changed.sum()
 
-        if 'scheduled_time' in df.columns:
-            df['_scheduled_dt'] = df['scheduled_time'].apply(_parse_time)
-        if 'actual_time' in df.columns:
-            df['_actual_dt'] = df['actual_time'].apply(_parse_time)
-
-        # Compute delay_minutes if possible: actual - scheduled in minutes
-        if '_scheduled_dt' in df.columns and '_actual_dt' in df.columns:
-            def _compute_delay(row):
-                s = row['_scheduled_dt']
-                a = row['_actual_dt']
-                if pd.isna(s) or pd.isna(a):
-                    return np.nan
-                try:
-                    # Robust alignment for time-only datetimes (year==1900):
-                    # If actual has no date (year==1900) but scheduled has a real date,
-                    # consider both same-day and next-day alignments and pick the smallest
-                    # absolute delta that is within a sensible window (12 hours).
-                    if hasattr(a, 'year') and a.year == 1900 and hasattr(s, 'year') and s.year != 1900:
-                        base = a.replace(year=s.year, month=s.month, day=s.day)
-                        cand_same = base
-                        cand_next = base + pd.Timedelta(days=1)
-                        delta_same = (cand_same - s).total_seconds() / 60.0
-                        delta_next = (cand_next - s).total_seconds() / 60.0
-                        # choose the candidate with the smaller absolute delta, but prefer
-                        # deltas within +/- 12 hours (720 minutes)
-                        candidates = [(abs(delta_same), delta_same), (abs(delta_next), delta_next)]
-                        candidates.sort(key=lambda x: x[0])
-                        chosen = candidates[0][1]
-                        if abs(chosen) <= 720:
-                            return float(chosen)
-                        else:
-                            # ambiguous / implausible -> mark as nan (to be imputed later)
-                            return np.nan
-
-                    # Symmetric case: scheduled is time-only but actual has a date
-                    if hasattr(s, 'year') and s.year == 1900 and hasattr(a, 'year') and a.year != 1900:
-                        base = s.replace(year=a.year, month=a.month, day=a.day)
-                        cand_same = base
-                        cand_next = base + pd.Timedelta(days=1)
-                        delta_same = (a - cand_same).total_seconds() / 60.0
-                        delta_next = (a - cand_next).total_seconds() / 60.0
-                        candidates = [(abs(delta_same), delta_same), (abs(delta_next), delta_next)]
-                        candidates.sort(key=lambda x: x[0])
-                        chosen = candidates[0][1]
-                        if abs(chosen) <= 720:
-                            return float(chosen)
-                        else:
-                            return np.nan
-
-                    # Default: both have dates or compatible times
-                    delta = (a - s).total_seconds() / 60.0
-                    return float(delta)
-                except Exception:
-                    return np.nan
-
-            df['delay_minutes'] = df.apply(_compute_delay, axis=1)
-            self.cleaning_steps.append('computed_delay_from_times')
-
-            # flag rows where delay could not be computed (NaN) so we can impute later
-            df['delay_computed'] = df['delay_minutes'].notna()
-
-            # After finishing computations, if any delays are extremely large (>|12 hours|) mark them for review
-            df['delay_flagged'] = df['delay_minutes'].abs().gt(720).fillna(False)
-            # Set flagged extremes to NaN to avoid silently poisoning downstream models
-            df.loc[df['delay_flagged'], 'delay_minutes'] = np.nan
-            if df['delay_flagged'].any():
-                self.cleaning_steps.append('flagged_extreme_delays')
-
-        # Fix negative passenger counts (set to median of non-negative values)
-        if 'passenger_count' in df.columns:
-            df['passenger_count'] = pd.to_numeric(df['passenger_count'], errors='coerce')
-            mask_neg = df['passenger_count'] < 0
-            if mask_neg.any():
-                median_val = df.loc[~mask_neg, 'passenger_count'].median()
-                if pd.isna(median_val):
-                    median_val = 0.0
-                df.loc[mask_neg, 'passenger_count'] = median_val
-                self.cleaning_steps.append('fixed_negative_passenger_count')
-
-        # Clean coordinates: treat sentinel values like 999 or 0.0 as NaN
-        for coord in ('latitude', 'longitude'):
-            if coord in df.columns:
-                df[coord] = pd.to_numeric(df[coord], errors='coerce')
-                mask_bad = df[coord].isin([999, 0])
-                if mask_bad.any():
-                    df.loc[mask_bad, coord] = np.nan
-                    self.cleaning_steps.append(f'cleaned_{coord}_sentinel')
-
-        # Ensure delay-related flags exist even if no time columns were present
-        if 'delay_minutes' not in df.columns:
-            df['delay_minutes'] = np.nan
-        if 'delay_flagged' not in df.columns:
-            df['delay_flagged'] = False
-        if 'delay_computed' not in df.columns:
-            df['delay_computed'] = df['delay_minutes'].notna()
-        if 'delay_imputed' not in df.columns:
-            df['delay_imputed'] = False
-
-        # Fill NaNs for numeric columns with sensible defaults (median)
-        # NOTE: exclude 'delay_minutes' from generic fill so we can handle imputation policy explicitly
-        num_cols = [c for c in df.select_dtypes(include=[np.number]).columns if c != 'delay_minutes']
-        for c in num_cols:
-            if df[c].isna().any():
-                med = df[c].median()
-                if pd.isna(med):
-                    med = 0.0
-                df[c] = df[c].fillna(med)
-
-        # Handle delay_minutes imputation policy:
-        # - Rows where delay_flagged==True should remain NaN for manual review
-        # - Other NaN delays will be imputed with the median of non-NaN, non-flagged delays
-        if 'delay_minutes' in df.columns:
-            # compute median excluding NaNs and flagged rows
-            med = df.loc[~df['delay_flagged'], 'delay_minutes'].median()
-            if pd.isna(med):
-                med = 0.0
-            # mark rows that will be imputed
-            mask_impute = df['delay_minutes'].isna() & (~df['delay_flagged'])
-            df.loc[mask_impute, 'delay_minutes'] = med
-            df['delay_imputed'] = mask_impute
-            # for flagged rows, ensure delay_imputed is False (they remain NaN)
-            df.loc[df['delay_flagged'], 'delay_imputed'] = False
-        # Weather normalization and typo fixes
-        if 'weather' in df.columns:
-            def _norm_weather(x):
-                if pd.isna(x):
-                    return 'Unknown'
-                s = str(x).strip().lower()
-                if s in ('nan', '', 'none'):
-                    return 'Unknown'
-                typos = {
-                    'clody': 'cloudy',
-                    'suny': 'sunny',
-                    'sun': 'sunny',
-                    'rain': 'rainy'
-                }
-                s = typos.get(s, s)
-                return s.title()
-
-            df['weather'] = df['weather'].apply(_norm_weather)
-            self.cleaning_steps.append('normalized_weather')
-
-        # Consolidate column formats to consistent representations
-        #  - scheduled_time/actual_time -> consistent string format
-        #  - passenger_count -> integer counts
-        #  - latitude/longitude -> floats with fixed precision
-        #  - route_id -> normalized 'Route-<n>' or Title-cased string
-        def _format_dt_for_output(dt):
-            if pd.isna(dt):
-                return np.nan
-            try:
-                # Format as ISO date + 12-hour time with AM/PM (international-friendly)
-                if hasattr(dt, 'year') and dt.year != 1900:
-                    date_part = f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}"
-                    time_part = dt.strftime('%I:%M %p')
-                    # remove leading zero from hour for readability e.g. 01:05 -> 1:05
-                    if time_part.startswith('0'):
-                        time_part = time_part[1:]
-                    return f"{date_part} {time_part}"
-                time_part = dt.strftime('%I:%M %p')
-                if time_part.startswith('0'):
-                    time_part = time_part[1:]
-                return time_part
-            except Exception:
-                return np.nan
-
-        if '_scheduled_dt' in df.columns:
-            df['scheduled_time'] = df['_scheduled_dt'].apply(_format_dt_for_output)
-            self.cleaning_steps.append('standardized_scheduled_time')
-        if '_actual_dt' in df.columns:
-            df['actual_time'] = df['_actual_dt'].apply(_format_dt_for_output)
-            self.cleaning_steps.append('standardized_actual_time')
-
-        # Passenger counts should be integer-like
-        if 'passenger_count' in df.columns:
-            # Round and convert to int (counts)
-            df['passenger_count'] = df['passenger_count'].round().fillna(0).astype(int)
-            self.cleaning_steps.append('standardized_passenger_count')
-
-        # Coordinates: ensure floats and consistent precision
-        for coord in ('latitude', 'longitude'):
-            if coord in df.columns:
-                df[coord] = pd.to_numeric(df[coord], errors='coerce')
-                # round to 8 decimals for consistency
-                df[coord] = df[coord].round(8)
-                self.cleaning_steps.append(f'standardized_{coord}')
-
-        # Normalize route ids: R03 or 03 -> Route-3; keep existing Route-4
-        if 'route_id' in df.columns:
-            def _norm_route(x):
-                if pd.isna(x):
-                    return 'Unknown'
-                s = str(x).strip()
-                # match R03, r3, 03 etc
-                m = re.match(r'^[rR]?(0*)(\d+)$', s)
-                if m:
-                    return f'Route-{int(m.group(2))}'
-                # if already contains 'route' keep title-style
-                if 'route' in s.lower():
-                    return s.title()
-                return s
-
-            df['route_id'] = df['route_id'].apply(_norm_route)
-            self.cleaning_steps.append('normalized_route_id')
-
-        # Fill undefined values from the original raw dataset when possible
-        placeholders = set(['nan', 'none', '', 'na', 'n/a'])
-        def _is_placeholder(v):
-            return pd.isna(v) or str(v).strip().lower() in placeholders
-
-        for c in df.columns:
-            for i, val in df[c].items():
-                if (pd.isna(val) or (isinstance(val, str) and val.strip().lower() == 'unknown')):
-                    # check raw original
-                    if c in self.raw_df.columns:
-                        raw_val = self.raw_df.at[i, c]
-                        if not _is_placeholder(raw_val):
-                            # standardize raw_val depending on column
-                            if c in ('scheduled_time', 'actual_time'):
-                                parsed = _parse_time(raw_val)
-                                if not pd.isna(parsed):
-                                    df.at[i, c] = _format_dt_for_output(parsed)
-                                else:
-                                    df.at[i, c] = str(raw_val).strip()
-                            elif c in ('latitude', 'longitude'):
-                                try:
-                                    v = float(raw_val)
-                                    df.at[i, c] = round(v, 8)
-                                except Exception:
-                                    df.at[i, c] = raw_val
-                            elif c == 'passenger_count':
-                                try:
-                                    v = float(raw_val)
-                                    df.at[i, c] = int(round(v))
-                                except Exception:
-                                    df.at[i, c] = raw_val
-                            elif c == 'weather':
-                                df.at[i, c] = _norm_weather(raw_val)
-                            elif c == 'route_id':
-                                df.at[i, c] = _norm_route(raw_val) if 'route' in locals() else str(raw_val).strip()
-                            else:
-                                df.at[i, c] = raw_val
-        self.cleaning_steps.append('filled_from_raw_where_possible')
-
-        self.df = df
+    def _run_deferred(self, df):
+        changed = np.zeros(len(df), dtype=bool)
+        for c, (pos, steps) in self._deferred.items():
+            before = df[c]
+            if pos is None:
+                values = before
+                for step in steps:
+                    values = self.normalize(values, step.normalizer, step.vectorized)
+            else:
+                values = before.iloc[pos]
+                for step in steps:
+                    values = self.normalize(values, step.normalizer, step.vectorized)
+                out = before.to_numpy(dtype=object, copy=True)
+                out[pos] = values.to_numpy(dtype=object)
+                values = pd.Series(out, index=before.index, name=c).infer_objects()
+            changed |= _changed_rows(before, values)
+            df[c] = values
+        self._deferred = {}
+        return changed.sum()
+
+    def run_row_local_steps(self, df: pd.DataFrame):
+        """Cleaning steps that only look at the row itself (safe to run per chunk)."""
+        self._deferred = {}
+        df = self._run_phase('row_local', df)
+        if self.deduplicator is not None:
+            self._profile('deduplicate', 'row_local', self._mark_duplicates, df)
+            if self._duplicates.any():
+                df = self._drop_rows(df, ~self._duplicates)
+                self.cleaning_steps.append('dropped_duplicate_trips')
+        if not self.copy and self.raw_cells is None:
+            self._keep_raw_cells(df)
         return df
 
+    def _mark_duplicates(self, df: pd.DataFrame):
+        self._duplicates = self.deduplicator.duplicated(df)
+        n = int(self._duplicates.sum())
+        self.duplicates_dropped += n
+        return n
+
+    def _drop_rows(self, df: pd.DataFrame, keep: np.ndarray):
+        # the raw data and the deferred row positions follow, so rows stay aligned
+        rows = np.flatnonzero(keep)
+        if self.raw_df is not None:
+            self.raw_df = self.raw_df.take(rows)
+        if self._raw_ref is not None:
+            self._raw_ref = self._raw_ref.take(rows)
+        new_pos = np.cumsum(keep) - 1
+        for c, (pos, steps) in self._deferred.items():
+            if pos is not None:
+                self._deferred[c] = (new_pos[pos[keep[pos]]], steps)
+        # take() gives a new frame (not a view flagged as a slice) to go on cleaning
+        return df.take(rows)
+
+    def _keep_raw_cells(self, df: pd.DataFrame):
+        # After the row-local steps, a cell can only end up undefined if it is
+        # undefined now, its column is re-formatted from a parsed value that is
+        # missing, or it holds text in a column coerced to numbers. Only those
+        # raw values (minus placeholders) are kept for the fill-back.
+        raw, self._raw_ref = self._raw_ref, None
+        self.raw_cells = {}
+        for c in raw.columns:
+            if c not in df.columns:
+                continue
+            candidates = _undefined_mask(df[c])
+            if FORMATTED_FROM.get(c) in df.columns:
+                candidates |= df[FORMATTED_FROM[c]].isna().to_numpy()
+            if c in NUMERIC_COLUMNS:
+                candidates |= pd.to_numeric(raw[c], errors='coerce').isna().to_numpy()
+            pos = np.flatnonzero(candidates)
+            values = raw[c].iloc[pos]
+            keep = ~_placeholder_mask(values)
+            self.raw_cells[c] = (pos[keep], values[keep])
+
+    def raw_values(self, column: str, pos: np.ndarray):
+        """Raw values of ``column`` at row positions ``pos`` that can be restored.
+
+        Placeholders ('nan', 'n/a', ...) are left out. Returns the kept
+        positions and their raw values.
+        """
+        if self.raw_cells is None:
+            raw = self.raw_df[column].iloc[pos]
+            keep = ~_placeholder_mask(raw)
+            return pos[keep], raw[keep]
+        cand, values = self.raw_cells[column]
+        idx = np.searchsorted(cand, pos)
+        hit = idx < len(cand)
+        hit[hit] = cand[idx[hit]] == pos[hit]
+        return pos[hit], values.iloc[idx[hit]]
+
+    def apply_statistics(self, df: pd.DataFrame, stats: dict):
+        """Imputation steps driven by dataset-wide statistics."""
+        return self._run_phase('statistics', df, stats)
+
+    def run_standardization_steps(self, df: pd.DataFrame):
+        """Deferred normalization, output formatting and raw fill-back."""
+        if self._deferred:
+            names = {step.name for _, steps in self._deferred.values() for step in steps}
+            label = '+'.join(step.name for step in CLEANING_PLAN if step.name in names)
+            self._profile(f'{label} (missing values)', 'standardize', self._run_deferred, df)
+        return self._run_phase('standardize', df)
+
+    def get_state(self) -> dict:
+        """Fitted state needed to clean more rows the same way (JSON-serializable)."""
+        if self.statistics is None:
+            raise ValueError('cleaner has no statistics yet; run the pipeline first')
+        return {
+            'version': STATE_VERSION,
+            'coordinate_sentinels': list(COORDINATE_SENTINELS),
+            'options': cleaning_options(self.delay_flagging, self.robust_threshold, self.stops,
+                                        self.deduplicator, self.skip_steps),
+            'statistics': self.statistics,
+            'cleaning_steps': list(self.cleaning_steps),
+        }
+
+    def save_state(self, path, **extra):
+        """Write ``get_state()`` (plus any ``extra`` keys) to ``path`` as JSON."""
+        state = self.get_state()
+        state.update(extra)
+        with open(path, 'w', encoding='utf-8') as fh:
+            json.dump(state, fh, indent=2)
+        return path
+
+    @staticmethod
+    def load_state(path):
+        """Read a state saved by ``save_state``; None if it is missing or from other rules."""
+        try:
+            with open(path, encoding='utf-8') as fh:
+                state = json.load(fh)
+        except FileNotFoundError:
+            return None
+        if (state.get('version') != STATE_VERSION
+                or state.get('coordinate_sentinels') != list(COORDINATE_SENTINELS)):
+            return None
+        return state
+
     def get_cleaning_summary(self):
         return {
             'cleaning_steps': self.cleaning_steps,
             'n_rows': len(self.df),
-            'n_cols': len(self.df.columns)
+            'n_cols': len(self.df.columns),
+            'skipped_steps': self.skip_steps,
+            'duplicates_dropped': self.duplicates_dropped,
+            # per executed pass: wall time, peak memory delta (bytes, None unless
+            # profiled) and rows affected
+            'step_report': self.step_report,
         }
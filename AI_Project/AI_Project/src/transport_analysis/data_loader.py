@@ -1,10 +1,246 @@
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 
+from .utils import common_dtype
+from .validation import Validator
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None
+
+# Declared dtypes for the transport columns, applied at read time with
+# DataLoader(path, schema=TRANSPORT_SCHEMA): low-cardinality strings become
+# categoricals, counts nullable compact integers and coordinates float32.
+# Time columns stay plain strings so values like '0150' are never read as numbers.
+TRANSPORT_SCHEMA = {
+    'route_id': 'category',
+    'weather': 'category',
+    'scheduled_time': 'object',
+    'actual_time': 'object',
+    'passenger_count': 'Int32',
+    'latitude': 'float32',
+    'longitude': 'float32',
+}
+
+# Raw dataset the project scripts read (see find_dataset)
+DATASET_NAME = 'dirty_transport_dataset.csv'
+
+PARQUET_SUFFIXES = ('.parquet', '.pq')
+FEATHER_SUFFIXES = ('.feather', '.arrow', '.ipc')
+
+
+def detect_format(path):
+    """Return 'parquet', 'feather' (Arrow IPC) or 'csv' based on the file suffix."""
+    suffix = Path(path).suffix.lower()
+    if suffix in PARQUET_SUFFIXES:
+        return 'parquet'
+    if suffix in FEATHER_SUFFIXES:
+        return 'feather'
+    return 'csv'
+
+
+def find_dataset(project_root) -> Path:
+    """The raw dataset: DATASET_NAME in ``project_root``, else in the working directory."""
+    for path in (Path(project_root) / DATASET_NAME, Path(DATASET_NAME)):
+        if path.exists():
+            return path.resolve()
+    raise FileNotFoundError(f'{DATASET_NAME} not found in project root')
+
+
+def _require_pyarrow(fmt):
+    if pa is None:
+        raise ImportError(f"pyarrow is required to read/write {fmt} files (pip install pyarrow)")
+
+
+def to_arrow_table(df: pd.DataFrame):
+    """Convert ``df`` to an Arrow table, keeping dtypes wherever Arrow can represent them.
+
+    Object columns mixing strings and numbers (e.g. raw values restored by the
+    cleaner's fill-back) cannot be stored as one Arrow type; those columns are
+    stored as strings.
+    """
+    _require_pyarrow('Arrow')
+    mixed = [c for c in df.select_dtypes(include=['object']).columns
+             if pd.api.types.infer_dtype(df[c], skipna=True) in ('mixed', 'mixed-integer')]
+    if mixed:
+        df = df.copy()
+        for c in mixed:
+            df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _is_numeric_dtype(dtype):
+    return pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype))
+
+
+def apply_schema(df: pd.DataFrame, schema: dict):
+    """Cast the columns of ``df`` listed in ``schema``.
+
+    Numeric columns are coerced with ``pd.to_numeric`` first, so malformed
+    values become missing instead of failing the load; values that do not fit
+    an integer type are rounded (counts) or dropped to missing (out of range).
+    """
+    for c, dtype in schema.items():
+        if c not in df.columns or df[c].dtype == dtype:
+            continue
+        if _is_numeric_dtype(dtype):
+            values = pd.to_numeric(df[c], errors='coerce')
+            target = pd.api.types.pandas_dtype(dtype)
+            if pd.api.types.is_integer_dtype(target):
+                info = np.iinfo(target.numpy_dtype if hasattr(target, 'numpy_dtype') else target)
+                values = values.round().where(values.between(info.min, info.max))
+            df[c] = values.astype(dtype)
+        else:
+            df[c] = df[c].astype(dtype)
+    return df
+
+
+def save_data(df: pd.DataFrame, path):
+    """Write ``df`` to ``path`` in the format implied by its suffix (CSV, Parquet or Feather)."""
+    fmt = detect_format(path)
+    if fmt == 'csv':
+        df.to_csv(path, index=False)
+    elif fmt == 'parquet':
+        pq.write_table(to_arrow_table(df), path)
+    else:
+        feather.write_feather(to_arrow_table(df), path)
+    return path
+
 
 class DataLoader:
-    def __init__(self, path):
+    def __init__(self, path, schema: dict = None):
         self.path = path
+        self.format = detect_format(path)
+        # optional declared dtypes (e.g. TRANSPORT_SCHEMA); None lets pandas infer
+        self.schema = schema
+
+    def _csv_dtypes(self):
+        # non-numeric declared types can be handed to the CSV parser directly;
+        # numeric ones are coerced after the read so malformed cells don't abort it
+        if not self.schema:
+            return None
+        return {c: dt for c, dt in self.schema.items() if not _is_numeric_dtype(dt)}
+
+    def load_data(self, columns=None):
+        """Load the data file (CSV, Parquet or Feather) and return a DataFrame.
+
+        ``columns`` restricts the read to those columns; for the columnar formats
+        the other columns are never read from disk.
+        """
+        if self.format == 'parquet':
+            _require_pyarrow(self.format)
+            df = pd.read_parquet(self.path, columns=columns)
+        elif self.format == 'feather':
+            _require_pyarrow(self.format)
+            df = pd.read_feather(self.path, columns=columns)
+        else:
+            df = pd.read_csv(self.path, usecols=columns, dtype=self._csv_dtypes())
+        return apply_schema(df, self.schema) if self.schema else df
+
+    def get_columns(self):
+        """Return the column names without reading any rows."""
+        if self.format == 'parquet':
+            _require_pyarrow(self.format)
+            return pq.read_schema(self.path).names
+        if self.format == 'feather':
+            _require_pyarrow(self.format)
+            return feather.read_table(self.path, memory_map=True).schema.names
+        return pd.read_csv(self.path, nrows=0).columns.tolist()
+
+    def get_numeric_columns(self):
+        """Return the numeric (int/float) column names.
+
+        Columnar files answer this from their schema without reading any rows;
+        CSV files need a full (chunked) dtype scan.
+        """
+        if self.format == 'csv':
+            dtypes = self.infer_dtypes()
+            return [c for c, dt in dtypes.items() if dt.kind in 'iuf']
+        _require_pyarrow(self.format)
+        if self.format == 'parquet':
+            schema = pq.read_schema(self.path)
+        else:
+            schema = feather.read_table(self.path, memory_map=True).schema
+        return [f.name for f in schema
+                if pa.types.is_integer(f.type) or pa.types.is_floating(f.type)]
+
+    def iter_chunks(self, chunksize: int = 100_000, dtype=None, columns=None, start: int = 0):
+        """Yield the data as DataFrames of at most ``chunksize`` rows.
+
+        Only one chunk is held in memory at a time. Row labels continue across
+        chunks, exactly as in ``load_data``. Pass ``dtype`` (e.g. from
+        ``infer_dtypes``) so every chunk gets the same column types; a declared
+        ``schema`` is applied to every chunk. ``start`` skips that many data
+        rows (e.g. rows already processed in an earlier run); labels still
+        count from the top of the file.
+        """
+        if self.format == 'csv':
+            if dtype is None:
+                dtype = self._csv_dtypes()
+            skip = range(1, start + 1) if start else None
+            with pd.read_csv(self.path, chunksize=chunksize, dtype=dtype, usecols=columns,
+                             skiprows=skip) as reader:
+                for chunk in reader:
+                    chunk.index = chunk.index + start
+                    yield apply_schema(chunk, self.schema) if self.schema else chunk
+            return
+        _require_pyarrow(self.format)
+        if self.format == 'parquet':
+            batches = pq.ParquetFile(self.path).iter_batches(batch_size=chunksize, columns=columns)
+        else:
+            table = feather.read_table(self.path, columns=columns, memory_map=True)
+            batches = table.to_batches(max_chunksize=chunksize)
+        pos = 0
+        for batch in batches:
+            end = pos + batch.num_rows
+            if end <= start:
+                pos = end
+                continue
+            if pos < start:
+                batch = batch.slice(start - pos)
+                pos = start
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(pos, pos + len(chunk))
+            pos += len(chunk)
+            if dtype:
+                chunk = chunk.astype(dtype)
+            yield apply_schema(chunk, self.schema) if self.schema else chunk
+
+    def validate(self, rules: dict, chunksize: int = 100_000, max_rows: int = None):
+        """Check the file against ``rules`` (column -> ColumnRule, see validation).
+
+        The header is checked first, so a missing column fails without reading
+        any rows; then only the ruled columns are streamed chunk by chunk. With
+        ``max_rows`` only the first rows are checked. Raises ValidationError
+        listing the failed checks; returns the Validator otherwise.
+        """
+        validator = Validator(rules, where=str(self.path)).observe_columns(self.get_columns())
+        columns = [c for c in rules if c in validator.columns]
+        if max_rows is not None:
+            chunksize = min(chunksize, max_rows)
+        for chunk in self.iter_chunks(chunksize, columns=columns):
+            if max_rows is not None:
+                chunk = chunk.iloc[:max_rows - validator.n_rows]
+            validator.update(chunk)
+            if max_rows is not None and validator.n_rows >= max_rows:
+                break
+        return validator.check()
+
+    def infer_dtypes(self, chunksize: int = 100_000, start: int = 0):
+        """Scan the file once and return the column dtypes a full ``load_data`` would infer.
 
-    def load_data(self):
-        """Load CSV data path and return a DataFrame."""
-        return pd.read_csv(self.path)
+        pandas infers dtypes per chunk, so a column can be int in one chunk and
+        float or object in another. The per-chunk dtypes are combined here the
+        same way a single read resolves them. ``start`` limits the scan to the
+        rows from there on.
+        """
+        seen = {}
+        for chunk in self.iter_chunks(chunksize, start=start):
+            for c, dt in chunk.dtypes.items():
+                seen.setdefault(c, set()).add(dt)
+        return {c: common_dtype(kinds) for c, kinds in seen.items()}
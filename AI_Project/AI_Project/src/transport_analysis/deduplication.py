@@ -0,0 +1,184 @@
+"""De-duplication of re-sent trip records, across chunks and runs.
+
+A trip is identified by a normalized key: the normalized route id and the
+parsed scheduled time, optionally with the coordinates rounded to a fixed
+precision. A scheduled time given without a date (parsed on 1900-01-01) is
+placed on the day the cleaner resolved from the actual time; without such a
+day the trip has no key. Every key is reduced to a 64-bit hash; ``TripDeduplicator``
+remembers the hashes it has seen, so the first occurrence of a trip is kept
+and its repeats are dropped, whichever chunk they arrive in.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+# columns of the cleaner's row-local output that make up a trip key
+ROUTE_COLUMN = 'route_id'
+TIME_COLUMN = '_scheduled_dt'
+COORDINATE_COLUMNS = ('latitude', 'longitude')
+# used to date time-only scheduled times: scheduled = actual - delay
+ACTUAL_COLUMN = '_actual_dt'
+DELAY_COLUMN = 'delay_minutes'
+# year of the placeholder date of times parsed without one
+UNDATED_YEAR = np.datetime64('1900', 'Y')
+
+
+def _as_datetimes(values: pd.Series) -> np.ndarray:
+    if not pd.api.types.is_datetime64_dtype(values.dtype):
+        values = pd.to_datetime(values, errors='coerce')
+    # one time unit, so chunks parsed at different resolutions hash alike
+    return values.to_numpy().astype('datetime64[ns]')
+
+
+def _undated(times: np.ndarray) -> np.ndarray:
+    return times.astype('datetime64[Y]') == UNDATED_YEAR
+
+
+def _trip_times(df: pd.DataFrame) -> np.ndarray:
+    """Scheduled times, with time-only ones dated by the cleaner's delay alignment (else NaT)."""
+    times = _as_datetimes(df[TIME_COLUMN])
+    undated = _undated(times)
+    if not undated.any():
+        return times
+    times[undated] = np.datetime64('NaT')
+    if ACTUAL_COLUMN not in df.columns or DELAY_COLUMN not in df.columns:
+        return times
+    actual = _as_datetimes(df[ACTUAL_COLUMN])
+    delay = pd.to_numeric(df[DELAY_COLUMN], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    # the delay of a time-only scheduled time was aligned with a dated actual time
+    dated = undated & ~np.isnat(actual) & ~_undated(actual) & ~np.isnan(delay)
+    seconds = np.round(delay[dated] * 60).astype(np.int64)
+    times[dated] = actual[dated] - seconds * np.timedelta64(1, 's')
+    return times
+
+
+class TripDeduplicator:
+    """Remember trip keys and flag the rows whose trip has been seen before.
+
+    Keys are built from the cleaner's row-local output (see ``key_hashes``);
+    rows missing a key value (or the date of their scheduled time) are never
+    treated as duplicates. By default the
+    seen hashes are kept in a sorted ``uint64`` array (8 bytes per distinct
+    trip; exact up to 64-bit hash collisions). With ``bloom_capacity`` they go
+    into a Bloom filter sized for that many trips instead: memory is fixed,
+    and once that many trips have been added a new trip is wrongly taken for
+    a duplicate with probability ``bloom_error``.
+    """
+
+    def __init__(self, coordinates: bool = False, coordinate_decimals: int = 5,
+                 bloom_capacity: int = None, bloom_error: float = 0.001):
+        self.coordinates = coordinates
+        self.coordinate_decimals = coordinate_decimals
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error = bloom_error
+        if bloom_capacity:
+            # standard sizing: m = -n ln p / (ln 2)^2 bits, k = m / n ln 2 hash functions
+            bits = -bloom_capacity * math.log(bloom_error) / math.log(2) ** 2
+            self.n_bits = max(8, math.ceil(bits))
+            self.n_hashes = max(1, round(self.n_bits / bloom_capacity * math.log(2)))
+        self.reset()
+
+    def reset(self):
+        """Forget every trip seen so far."""
+        if self.bloom_capacity:
+            self._bits = np.zeros(-(-self.n_bits // 8), dtype=np.uint8)
+        else:
+            self._seen = np.empty(0, dtype=np.uint64)
+        self.n_seen = 0
+        self.n_duplicates = 0
+        return self
+
+    def key_hashes(self, df: pd.DataFrame):
+        """64-bit hash of every row's trip key, and the mask of rows with a complete key."""
+        if TIME_COLUMN not in df.columns or ROUTE_COLUMN not in df.columns:
+            return np.zeros(len(df), dtype=np.uint64), np.zeros(len(df), dtype=bool)
+        times = _trip_times(df)
+        key = pd.DataFrame({
+            # route ids as plain values, so categorical and object chunks hash alike
+            'route': df[ROUTE_COLUMN].astype(object).to_numpy(),
+            'time': times.view(np.int64),
+        })
+        valid = df[ROUTE_COLUMN].notna().to_numpy() & ~np.isnat(times)
+        if self.coordinates:
+            for c in COORDINATE_COLUMNS:
+                if c not in df.columns:
+                    return np.zeros(len(df), dtype=np.uint64), np.zeros(len(df), dtype=bool)
+                values = pd.to_numeric(df[c], errors='coerce')
+                values = values.to_numpy(dtype=float, na_value=np.nan)
+                # + 0.0 turns -0.0 into 0.0, which hashes differently
+                key[c] = np.round(values, self.coordinate_decimals) + 0.0
+                valid &= ~np.isnan(values)
+        hashes = pd.util.hash_pandas_object(key, index=False).to_numpy()
+        return hashes, valid
+
+    def mark(self, hashes: np.ndarray, valid: np.ndarray) -> np.ndarray:
+        """Flag the rows whose key was seen earlier (in this call or before); remember the rest."""
+        duplicated = np.zeros(len(hashes), dtype=bool)
+        pos = np.flatnonzero(valid)
+        h = hashes[pos]
+        # repeats within the chunk, then trips seen in earlier chunks
+        dup = pd.Series(h).duplicated().to_numpy() | self._contains(h)
+        duplicated[pos[dup]] = True
+        new = np.unique(h[~dup])
+        self._add(new)
+        self.n_seen += len(new)
+        self.n_duplicates += int(dup.sum())
+        return duplicated
+
+    def duplicated(self, df: pd.DataFrame) -> np.ndarray:
+        """``mark`` the trip keys of ``df``: True for the rows to drop."""
+        return self.mark(*self.key_hashes(df))
+
+    def _bit_positions(self, h):
+        # double hashing: the i-th position is h1 + i * h2 (mod number of bits)
+        h1 = h & np.uint64(0xFFFFFFFF)
+        h2 = (h >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.n_hashes, dtype=np.uint64)
+        return (h1[:, None] + steps * h2[:, None]) % np.uint64(self.n_bits)
+
+    def _contains(self, h):
+        if self.bloom_capacity:
+            bits = self._bit_positions(h)
+            hit = (self._bits[bits >> np.uint64(3)] >> (bits & np.uint64(7)).astype(np.uint8)) & 1
+            return hit.all(axis=1)
+        idx = np.searchsorted(self._seen, h)
+        found = idx < len(self._seen)
+        found[found] = self._seen[idx[found]] == h[found]
+        return found
+
+    def _add(self, new):
+        if not len(new):
+            return
+        if self.bloom_capacity:
+            bits = self._bit_positions(new).ravel()
+            np.bitwise_or.at(self._bits, bits >> np.uint64(3),
+                             np.left_shift(1, bits & np.uint64(7)).astype(np.uint8))
+        else:
+            self._seen = np.insert(self._seen, np.searchsorted(self._seen, new), new)
+
+    @property
+    def nbytes(self):
+        """Memory held by the seen keys."""
+        return self._bits.nbytes if self.bloom_capacity else self._seen.nbytes
+
+    def save(self, path):
+        """Write the configuration and the seen keys to ``path`` (``.npz``)."""
+        store = self._bits if self.bloom_capacity else self._seen
+        with open(path, 'wb') as fh:
+            np.savez(fh, store=store, config=np.array([
+                self.coordinates, self.coordinate_decimals, self.bloom_capacity or 0,
+                self.bloom_error, self.n_seen, self.n_duplicates], dtype=float))
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            coords, decimals, capacity, error, n_seen, n_dup = data['config']
+            dedup = cls(bool(coords), int(decimals), int(capacity) or None, float(error))
+            if dedup.bloom_capacity:
+                dedup._bits = data['store']
+            else:
+                dedup._seen = data['store']
+        dedup.n_seen, dedup.n_duplicates = int(n_seen), int(n_dup)
+        return dedup
@@ -1,42 +1,530 @@
+import copy
+import json
+import re
+from collections import Counter
+
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+from pandas.api.indexers import BaseIndexer
+
+from .data_cleaner import FORMATTED_FROM, OUTPUT_DATETIME_FORMAT
+from .quantile_sketch import QuantileSketch
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.2
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+
+
+# Categorical columns that are one-hot encoded for modelling
+CATEGORICAL_COLUMNS = ['weather', 'weather_severity_cat', 'route_id', 'time_of_day', 'day_type']
+# Numeric columns that get *_orig / *_winsor variants when winsorizing
+WINSOR_COLUMNS = ['passenger_count', 'delay_minutes']
+# Per-route delay history (route_history=True): windows over the route's
+# previous ROUTE_HISTORY_TRIPS trips and previous ROUTE_HISTORY_HOURS hours
+ROUTE_HISTORY_TRIPS = 10
+ROUTE_HISTORY_HOURS = 24
+ROUTE_HISTORY_QUANTILE = 0.9
+# compact=True: integer features take the smallest integer type holding their
+# values, float64 features float32 when every value stays within this relative error
+COMPACT_FLOAT_RTOL = 1e-6
+# Bumped when the saved fitted state (FeatureEngineer.get_state) changes meaning
+FEATURE_STATE_VERSION = 1
+
+# time_of_day buckets as [start, end) hours; every other hour is 'night'
+TIME_OF_DAY_BUCKETS = [('morning', 6, 12), ('afternoon', 12, 17), ('evening', 17, 22)]
+TIME_OF_DAY_LABELS = [label for label, _, _ in TIME_OF_DAY_BUCKETS] + ['night']
+
+# Weather severity labels; a label's position is its severity level
+SEVERITY_LABELS = ['light', 'moderate', 'heavy']
+# (level, substrings) tried in order on the stripped, lower-cased weather
+# text; sunny/clear/fair and anything unmatched are light
+SEVERITY_KEYWORDS = [
+    (2, ['heavy', 'storm', 'rainy', 'thunder']),
+    (1, ['moderate', 'moderate rain', 'showers']),
+    # treat cloudy/overcast as light-to-moderate
+    (1, ['cloud', 'clody', 'overcast']),
+]
+
+
+def _infer_datetime_format(values: pd.Series):
+    """Return the format pandas would infer for ``values`` (from its first non-null string)."""
+    non_null = values.dropna()
+    if non_null.empty or not isinstance(non_null.iloc[0], str):
+        return None
+    return guess_datetime_format(non_null.iloc[0])
+
+
+def _to_datetime(values: pd.Series, fmt):
+    if fmt is None:
+        return pd.to_datetime(values, errors='coerce', format='mixed')
+    return pd.to_datetime(values, errors='coerce', format=fmt)
+
+
+def _time_of_day(hours: pd.Series) -> pd.Series:
+    """Bucket hours of the day into TIME_OF_DAY_LABELS, as a categorical."""
+    h = hours.to_numpy(dtype=float, na_value=np.nan)
+    with np.errstate(invalid='ignore'):
+        conditions = [(h >= start) & (h < end) for _, start, end in TIME_OF_DAY_BUCKETS]
+    codes = np.select(conditions, range(len(TIME_OF_DAY_BUCKETS)), default=len(TIME_OF_DAY_BUCKETS))
+    return pd.Series(pd.Categorical.from_codes(codes, TIME_OF_DAY_LABELS), index=hours.index)
+
+
+def _severity_levels(weather: pd.Series) -> np.ndarray:
+    """Severity level (index into SEVERITY_LABELS) of every weather value.
+
+    The keywords are matched once per distinct value; rows take their
+    value's level by position.
+    """
+    codes, uniques = pd.factorize(weather)
+    uniques = pd.Series(np.asarray(uniques, dtype=object), dtype=object)
+    # non-text values are light
+    text = uniques.where(uniques.map(lambda w: isinstance(w, str))).str.strip().str.lower()
+    conditions = [text.str.contains('|'.join(map(re.escape, words)), na=False).to_numpy()
+                  for _, words in SEVERITY_KEYWORDS]
+    levels = np.select(conditions, [level for level, _ in SEVERITY_KEYWORDS], default=0)
+    # missing values (code -1) take the light level appended last
+    return np.append(levels, 0)[codes]
+
+
+def _sparse_dummies(cats: pd.DataFrame) -> pd.DataFrame:
+    """``pd.get_dummies(cats)`` as pandas sparse (``Sparse[uint8, 0]``) columns.
+
+    The indicators are written straight from the category codes into one CSR
+    block, so no dense n x categories array is ever built. Values outside a
+    column's categories (code -1) set no indicator, as with get_dummies.
+    """
+    n = len(cats)
+    blocks, columns = [], []
+    for c in cats.columns:
+        categories = cats[c].cat.categories
+        codes = cats[c].cat.codes.to_numpy()
+        rows = np.flatnonzero(codes >= 0)
+        blocks.append(sp.csr_matrix((np.ones(len(rows), dtype=np.uint8), (rows, codes[rows])),
+                                    shape=(n, len(categories))))
+        columns += [f'{c}_{v}' for v in categories]
+    return pd.DataFrame.sparse.from_spmatrix(sp.hstack(blocks, format='csc'), index=cats.index,
+                                             columns=columns)
+
+
+def one_hot_columns(columns) -> list:
+    """The one-hot indicators among ``columns``: bool or sparse ``<categorical column>_<value>``.
+
+    ``columns`` is a dtype Series (e.g. ``df.dtypes``), so numeric features
+    sharing a prefix (``weather_severity``) are not mistaken for indicators.
+    """
+    prefixes = tuple(f'{c}_' for c in CATEGORICAL_COLUMNS)
+    return [c for c, dtype in columns.items() if str(c).startswith(prefixes)
+            and (isinstance(dtype, pd.SparseDtype) or dtype == bool)]
+
+
+def route_history_columns(trips: int = ROUTE_HISTORY_TRIPS, hours: int = ROUTE_HISTORY_HOURS,
+                          q: float = ROUTE_HISTORY_QUANTILE) -> list:
+    """Names of the per-route delay history features."""
+    pct = f'q{round(q * 100)}'
+    return ['route_prev_delay', f'route_delay_mean_{trips}trips', f'route_delay_{pct}_{trips}trips',
+            f'route_delay_mean_{hours}h', f'route_delay_{pct}_{hours}h']
+
+
+class _WindowBounds(BaseIndexer):
+    """Precomputed rolling window bounds: the ``start`` and (exclusive) ``end`` arrays."""
+
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None,
+                          step=None):
+        return self.start, self.end
+
+
+def _route_order(route, when):
+    """Stable order of the rows by (route, scheduled time), missing times last.
+
+    Returns the order and, in that order, the route codes, the times as
+    int64 nanoseconds and the mask of rows with a time.
+    """
+    codes = pd.factorize(np.asarray(route, dtype=object))[0]
+    t = np.asarray(when, dtype='datetime64[ns]').view('i8')
+    timed = t != np.iinfo(np.int64).min
+    order = np.lexsort((np.where(timed, t, np.iinfo(np.int64).max), codes))
+    return order, codes[order], t[order], timed[order]
+
+
+def _route_delay_history(route, when, delay, trips: int = ROUTE_HISTORY_TRIPS,
+                         hours: int = ROUTE_HISTORY_HOURS,
+                         q: float = ROUTE_HISTORY_QUANTILE) -> pd.DataFrame:
+    """Delay of each trip's route before it: previous trip, last ``trips`` trips,
+    last ``hours`` hours.
+
+    One stable sort by (route, scheduled time) lines every route's trips up;
+    the window bounds of all routes are then computed at once and each
+    rolling aggregation moves along the sorted delays in a single pass. A
+    window ends before its trip, so a trip's own delay (and, for the hour
+    windows, that of trips of its route scheduled at the same time) is never
+    part of its features. Trips without a scheduled time come last in their
+    route and get no hour windows; features without any earlier delay are 0.
+    Returns one row per input row, in input order.
+    """
+    names = route_history_columns(trips, hours, q)
+    order, codes, t, timed = _route_order(route, when)
+    n = len(order)
+    values = pd.to_numeric(pd.Series(np.asarray(delay)), errors='coerce').to_numpy(float)[order]
+    out = np.full((n, len(names)), np.nan)
+    if n:
+        pos = np.arange(n)
+        first = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        group_start = np.repeat(first, np.diff(np.r_[first, n]))
+        out[:, 0] = np.where(pos > group_start, np.r_[np.nan, values[:-1]], np.nan)
+        bounds = _WindowBounds(start=np.maximum(pos - trips, group_start), end=pos)
+        window = pd.Series(values).rolling(bounds, min_periods=1)
+        out[:, 1] = window.mean().to_numpy()
+        out[:, 2] = window.quantile(q).to_numpy()
+        # hour windows: with the times ranked, (route, time rank) packs into one
+        # sorted int64 key and both bounds are binary searches in it
+        tt, cc = t[timed], codes[timed].astype(np.int64)
+        uniq = np.unique(tt)
+        rank = np.searchsorted(uniq, tt)
+        key = cc * len(uniq) + rank
+        since = np.searchsorted(uniq, tt - hours * 3_600_000_000_000)
+        bounds = _WindowBounds(start=np.searchsorted(key, cc * len(uniq) + since),
+                               end=np.searchsorted(key, key))
+        window = pd.Series(values[timed]).rolling(bounds, min_periods=1)
+        out[timed, 3] = window.mean().to_numpy()
+        out[timed, 4] = window.quantile(q).to_numpy()
+    result = np.empty_like(out)
+    result[order] = out
+    return pd.DataFrame(np.nan_to_num(result, nan=0.0), columns=names)
+
+
+def _history_tail(route, when, delay, trips: int = ROUTE_HISTORY_TRIPS,
+                  hours: int = ROUTE_HISTORY_HOURS) -> dict:
+    """The trips later rows' history windows can reach: per route, the last ``trips``
+    trips and those within ``hours`` of its latest one (JSON-serializable columns)."""
+    order, codes, t, timed = _route_order(route, when)
+    route = np.asarray(route, dtype=object)[order]
+    delay = pd.to_numeric(pd.Series(np.asarray(delay)), errors='coerce').to_numpy(float)[order]
+    by = pd.Series(np.where(timed, t, np.iinfo(np.int64).min)).groupby(codes, sort=False)
+    latest = by.transform('max').to_numpy()
+    recent = timed & (t >= latest - hours * 3_600_000_000_000)
+    keep = (by.cumcount(ascending=False).to_numpy() < trips) | recent
+    when = pd.to_datetime(t[keep].view('datetime64[ns]'))
+    return {
+        'route': route[keep].tolist(),
+        'when': [None if pd.isna(w) else w.isoformat() for w in when],
+        'delay': [None if np.isnan(d) else float(d) for d in delay[keep]],
+    }
+
+
+def _astype_lossless(values: pd.Series, dtype, rtol: float = 0.0) -> pd.Series:
+    """``values`` as ``dtype`` if that loses nothing (floats: within ``rtol``);
+    ``values`` otherwise."""
+    try:
+        # a float beyond the float32 range becomes inf, which the check below rejects
+        with np.errstate(over='ignore'):
+            cast = values.astype(dtype)
+    except (TypeError, ValueError):
+        # e.g. NaN into an int dtype
+        return values
+    if np.issubdtype(np.dtype(dtype), np.floating) and pd.api.types.is_numeric_dtype(values.dtype):
+        same = np.allclose(cast.to_numpy(dtype=float, na_value=np.nan),
+                           values.to_numpy(dtype=float, na_value=np.nan),
+                           rtol=rtol, atol=0, equal_nan=True)
+    else:
+        # ints and bools must round-trip exactly (no wrap-around, no truncation)
+        same = bool((cast.to_numpy() == values.to_numpy()).all())
+    return cast if same else values
+
+
+def _compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Downcast ``df``'s numeric columns in place (see COMPACT_FLOAT_RTOL).
+
+    Bool, categorical, text, datetime and sparse columns are kept as they are.
+    """
+    for c, dtype in df.dtypes.items():
+        if not isinstance(dtype, np.dtype):
+            continue
+        if dtype.kind in 'iu':
+            df[c] = pd.to_numeric(df[c], downcast='integer')
+        elif dtype == np.float64:
+            df[c] = _astype_lossless(df[c], np.float32, COMPACT_FLOAT_RTOL)
+    return df
+
+
+def _scheduled_datetimes(df: pd.DataFrame, fmt) -> pd.Series:
+    """``scheduled_time`` parsed once, for every temporal feature.
+
+    DataCleaner output still carries the parsed values (``_scheduled_dt``).
+    When ``scheduled_time`` is in the cleaner's date-time format they are
+    reused instead of parsing the strings again: truncated to the minute like
+    the written text, and time-only values (year 1900), which do not match
+    that format, as NaT.
+    """
+    parsed = df.get(FORMATTED_FROM['scheduled_time'])
+    if (fmt == OUTPUT_DATETIME_FORMAT and parsed is not None
+            and pd.api.types.is_datetime64_dtype(parsed.dtype)):
+        return parsed.dt.floor('min').mask(parsed.dt.year == 1900)
+    return _to_datetime(df['scheduled_time'], fmt)
+
+
+class FeatureStatistics:
+    """Accumulate the dataset-wide inputs of feature engineering.
+
+    Route frequencies, one-hot vocabularies and winsorization bounds depend on
+    the whole dataset. Feed ``update`` the output of
+    ``FeatureEngineer.run_row_local_features`` chunk by chunk and call
+    ``result`` once every chunk has been seen; the values are exact.
+    With ``sketch_error`` the winsorization bounds come from mergeable
+    quantile sketches (approximate, bounded memory) instead.
+    """
+
+    def __init__(self, lower_q: float = 0.01, upper_q: float = 0.99, sketch_error: float = None):
+        self.lower_q = lower_q
+        self.upper_q = upper_q
+        self.sketch_error = sketch_error
+        # format used to parse scheduled_time; taken from the first chunk that has one
+        self.datetime_format = None
+        self._datetime_format_seen = False
+        self._route_counts = Counter()
+        self._vocab = {}
+        self._winsor_values = {}
+
+    def observe_datetime_format(self, df: pd.DataFrame):
+        if not self._datetime_format_seen and 'scheduled_time' in df.columns:
+            if df['scheduled_time'].notna().any():
+                self.datetime_format = _infer_datetime_format(df['scheduled_time'])
+                self._datetime_format_seen = True
+        return self.datetime_format
+
+    def update(self, df: pd.DataFrame):
+        if 'route_id' in df.columns:
+            routes = df['route_id'].astype(str).str.strip()
+            self._route_counts.update(routes.value_counts().to_dict())
+        for c in CATEGORICAL_COLUMNS:
+            if c in df.columns:
+                self._vocab.setdefault(c, set()).update(df[c].astype(str).unique())
+        for c in WINSOR_COLUMNS:
+            if c in df.columns:
+                try:
+                    values = df[c].to_numpy(dtype=float, na_value=np.nan)
+                except (TypeError, ValueError):
+                    # non-numeric values: winsorization falls back to the raw column
+                    values = None
+                parts = self._winsor_values.setdefault(
+                    c, QuantileSketch(self.sketch_error) if self.sketch_error else [])
+                if values is None or parts is None:
+                    self._winsor_values[c] = None
+                elif isinstance(parts, QuantileSketch):
+                    parts.update(values)
+                else:
+                    parts.append(values)
+        return self
+
+    def merge(self, other: 'FeatureStatistics'):
+        if not self._datetime_format_seen:
+            self.datetime_format = other.datetime_format
+            self._datetime_format_seen = other._datetime_format_seen
+        self._route_counts.update(other._route_counts)
+        for c, values in other._vocab.items():
+            self._vocab.setdefault(c, set()).update(values)
+        for c, parts in other._winsor_values.items():
+            if c not in self._winsor_values:
+                # copied so later updates of either accumulator stay separate
+                if isinstance(parts, QuantileSketch):
+                    self._winsor_values[c] = copy.deepcopy(parts)
+                else:
+                    self._winsor_values[c] = parts and list(parts)
+                continue
+            mine = self._winsor_values[c]
+            if mine is None or parts is None:
+                self._winsor_values[c] = None
+            elif isinstance(mine, QuantileSketch):
+                mine.merge(parts)
+            else:
+                mine.extend(parts)
+        return self
+
+    def result(self) -> dict:
+        bounds = {}
+        for c, parts in self._winsor_values.items():
+            if parts is None:
+                bounds[c] = None
+                continue
+            if isinstance(parts, QuantileSketch):
+                bounds[c] = (parts.quantile(self.lower_q), parts.quantile(self.upper_q))
+                continue
+            values = pd.Series(np.concatenate(parts) if parts else [], dtype=float)
+            bounds[c] = (values.quantile(self.lower_q), values.quantile(self.upper_q))
+        return {
+            'datetime_format': self.datetime_format,
+            'route_counts': dict(self._route_counts),
+            # get_dummies orders the indicator columns by sorted category value
+            'vocabularies': {c: sorted(v) for c, v in self._vocab.items()},
+            'winsor_bounds': bounds,
+        }
 
 
 class FeatureEngineer:
-    def __init__(self, df: pd.DataFrame):
-        self.df = df.copy()
+    def __init__(self, df: pd.DataFrame, statistics: dict = None, copy: bool = True):
+        # copy=False adds the features to ``df`` itself (hand-off between stages
+        # without a defensive copy; the caller's frame is modified)
+        self.df = df.copy() if copy else df
+        # precomputed dataset-wide statistics (see FeatureStatistics); computed
+        # from this frame when not supplied
+        self.statistics = statistics
+        # options and column layout (order, numpy dtypes) of the last full run,
+        # reused by transform()
+        self.winsorize = False
+        self.sparse = False
+        self.route_history = False
+        self.columns = None
+        self.dtypes = {}
+        # with route_history: the latest trips of every route (the windows'
+        # reach), the past of the rows given to transform()
+        self.history = None
+
+    def fit(self, winsorize: bool = False, lower_q: float = 0.01, upper_q: float = 0.99,
+            sketch_error: float = None, sparse: bool = False, route_history: bool = False,
+            compact: bool = False):
+        """Engineer this frame and keep the state transform() needs; returns self.
+
+        The state is the statistics (datetime format, route frequency table,
+        one-hot vocabularies, winsor bounds), the options, the output column
+        layout and, with ``route_history``, the latest trips of every route;
+        ``get_state``/``save_state`` persist it as JSON.
+        """
+        self.run_full_feature_engineering(winsorize=winsorize, lower_q=lower_q, upper_q=upper_q,
+                                          sketch_error=sketch_error, sparse=sparse,
+                                          route_history=route_history, compact=compact)
+        return self
+
+    def transform(self, df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
+        """Features of new rows from the fitted state, in the fitted column layout.
+
+        Only ``df`` is read, so a small batch costs O(batch). Routes and
+        categories not seen when fitting get a zero frequency and no
+        indicator; fitted columns the batch cannot produce (the target, when
+        scoring) are NaN, and columns not in the layout are dropped. Route
+        history features look back over the fitted trips and the batch's own
+        earlier trips. Columns take their fitted dtype where that loses
+        nothing (a batch with nothing to clip would keep an int ``*_winsor``
+        column; a compact int8 column stays wider for a value beyond int8).
+        """
+        if self.statistics is None:
+            raise ValueError('feature engineer is not fitted; call fit() or load a state first')
+        df = df.copy() if copy else df
+        df = self.run_row_local_features(df, self.statistics['datetime_format'])
+        df = self.apply_statistics(df, self.statistics, winsorize=self.winsorize,
+                                   sparse=self.sparse)
+        if self.route_history:
+            df = self.add_route_history(df, self.history)
+        for c, dtype in self.dtypes.items():
+            if c in df.columns and df[c].dtype != dtype:
+                df[c] = _astype_lossless(df[c], dtype, COMPACT_FLOAT_RTOL)
+        return df if self.columns is None else df.reindex(columns=self.columns)
+
+    def get_state(self) -> dict:
+        """Fitted state needed to transform more rows the same way (JSON-serializable)."""
+        if self.statistics is None:
+            raise ValueError('feature engineer has no statistics yet; call fit() first')
+        return {
+            'version': FEATURE_STATE_VERSION,
+            'statistics': self.statistics,
+            'winsorize': self.winsorize,
+            'sparse': self.sparse,
+            'route_history': self.route_history,
+            'history': self.history,
+            'columns': self.columns,
+            'dtypes': {c: str(dtype) for c, dtype in self.dtypes.items()},
+        }
+
+    def save_state(self, path, **extra):
+        """Write ``get_state()`` (plus any ``extra`` keys) to ``path`` as JSON."""
+        state = self.get_state()
+        state.update(extra)
+        with open(path, 'w', encoding='utf-8') as fh:
+            json.dump(state, fh, indent=2)
+        return path
+
+    @staticmethod
+    def load_state(path):
+        """Read a state saved by ``save_state``; None if it is missing or from another version."""
+        try:
+            with open(path, encoding='utf-8') as fh:
+                state = json.load(fh)
+        except FileNotFoundError:
+            return None
+        if state.get('version') != FEATURE_STATE_VERSION:
+            return None
+        return state
 
-    def run_full_feature_engineering(self, winsorize: bool = False, lower_q: float = 0.01, upper_q: float = 0.99):
+    @classmethod
+    def from_state(cls, state: dict):
+        """A fitted engineer (no frame of its own) for ``transform``."""
+        engineer = cls(pd.DataFrame(), statistics=state['statistics'], copy=False)
+        engineer.winsorize = state.get('winsorize', False)
+        engineer.sparse = state.get('sparse', False)
+        engineer.route_history = state.get('route_history', False)
+        engineer.history = state.get('history')
+        engineer.columns = state.get('columns')
+        engineer.dtypes = {c: np.dtype(dtype) for c, dtype in state.get('dtypes', {}).items()}
+        return engineer
+
+    def run_full_feature_engineering(self, winsorize: bool = False, lower_q: float = 0.01,
+                                     upper_q: float = 0.99, sketch_error: float = None,
+                                     sparse: bool = False, route_history: bool = False,
+                                     compact: bool = False):
+        """Engineer every feature of this frame.
+
+        ``compact`` downcasts the numeric columns (int8/int16/... and float32,
+        see COMPACT_FLOAT_RTOL); the one-hot indicators are bools already.
+        """
         df = self.df
+        stats = self.statistics
+        if stats is None:
+            acc = FeatureStatistics(lower_q, upper_q, sketch_error=sketch_error)
+            fmt = acc.observe_datetime_format(df)
+            df = self.run_row_local_features(df, fmt)
+            stats = self.statistics = acc.update(df).result()
+        else:
+            df = self.run_row_local_features(df, stats['datetime_format'])
+        df = self.apply_statistics(df, stats, winsorize=winsorize, sparse=sparse)
+        if route_history:
+            df = self.add_route_history(df)
+            self.history = _history_tail(*self._route_history_inputs(df))
+        if compact:
+            df = _compact_dtypes(df)
+        self.df = df
+        self.winsorize, self.sparse, self.route_history = winsorize, sparse, route_history
+        self.columns = list(df.columns)
+        self.dtypes = {c: dtype for c, dtype in df.dtypes.items() if isinstance(dtype, np.dtype)}
+        return df
+
+    def run_row_local_features(self, df: pd.DataFrame, datetime_format=None):
+        """Features computed from the row alone (safe to run per chunk)."""
         # Example features: passenger_count (ensure numeric), hour of day if available
         if 'passenger_count' in df.columns:
             df['passenger_count'] = pd.to_numeric(df['passenger_count'], errors='coerce').fillna(0)
 
+        # scheduled_time parsed once and shared by the temporal features below
+        dt = None
+        if 'scheduled_time' in df.columns:
+            try:
+                dt = _scheduled_datetimes(df, datetime_format)
+            except Exception:
+                dt = None
+
         # scheduled_time -> hour
         if 'scheduled_time' in df.columns:
             try:
-                dt = pd.to_datetime(df['scheduled_time'], errors='coerce')
                 df['scheduled_hour'] = dt.dt.hour.fillna(0).astype(int)
             except Exception:
                 df['scheduled_hour'] = 0
 
         # time of day bucket
         if 'scheduled_hour' in df.columns:
-            def tod(h):
-                if 6 <= h < 12:
-                    return 'morning'
-                if 12 <= h < 17:
-                    return 'afternoon'
-                if 17 <= h < 22:
-                    return 'evening'
-                return 'night'
-
-            df['time_of_day'] = df['scheduled_hour'].apply(tod)
+            df['time_of_day'] = _time_of_day(df['scheduled_hour'])
 
         # Day type: weekday vs weekend and is_weekend flag
         if 'scheduled_time' in df.columns:
             try:
-                dt = pd.to_datetime(df['scheduled_time'], errors='coerce')
                 df['day_of_week'] = dt.dt.weekday  # 0=Mon..6=Sun
                 df['is_weekend'] = df['day_of_week'].isin([5, 6]).astype(int)
                 df['day_type'] = df['is_weekend'].map({0: 'weekday', 1: 'weekend'})
@@ -47,59 +535,94 @@ class FeatureEngineer:
 
         # Weather severity index (light=0, moderate=1, heavy=2) + categorical label
         if 'weather' in df.columns:
-            def severity_label(w):
-                if not isinstance(w, str):
-                    return ('light', 0)
-                s = w.strip().lower()
-                if any(x in s for x in ['heavy', 'storm', 'rainy', 'thunder']):
-                    return ('heavy', 2)
-                if any(x in s for x in ['moderate', 'moderate rain', 'showers']):
-                    return ('moderate', 1)
-                # treat cloudy/overcast as light-to-moderate
-                if any(x in s for x in ['cloud', 'clody', 'overcast']):
-                    return ('moderate', 1)
-                # sunny, clear, fair => light
-                if any(x in s for x in ['sun', 'sunny', 'clear', 'fair']):
-                    return ('light', 0)
-                # default fallback
-                return ('light', 0)
-
-            sev = df['weather'].apply(lambda w: severity_label(w))
-            df['weather_severity_cat'] = sev.apply(lambda t: t[0])
-            df['weather_severity'] = sev.apply(lambda t: t[1])
+            levels = _severity_levels(df['weather'])
+            df['weather_severity_cat'] = pd.Categorical.from_codes(levels, SEVERITY_LABELS)
+            df['weather_severity'] = levels.astype(int)
+        return df
+
+    def apply_statistics(self, df: pd.DataFrame, stats: dict, winsorize: bool = False,
+                         sparse: bool = False):
+        """Features that depend on dataset-wide statistics.
 
+        With ``sparse`` the one-hot indicators are pandas sparse uint8 columns
+        instead of dense bools. Either way they are model features only with
+        ModelBuilder(one_hot=True), which trains on sparse ones as a CSR matrix.
+        """
         # Route frequency: count occurrences of each route_id (simple proxy for route frequency)
         if 'route_id' in df.columns:
             try:
+                counts = stats['route_counts']
                 df['route_id_clean'] = df['route_id'].astype(str).str.strip()
-                df['route_frequency'] = df.groupby('route_id_clean')['route_id_clean'].transform('count')
+                df['route_frequency'] = df['route_id_clean'].map(counts).fillna(0).astype(int)
                 # normalized frequency (per-dataset scale)
-                maxf = df['route_frequency'].max() if df['route_frequency'].max() > 0 else 1
+                maxf = max(counts.values()) if counts and max(counts.values()) > 0 else 1
                 df['route_frequency_norm'] = df['route_frequency'] / maxf
             except Exception:
                 df['route_frequency'] = 0
                 df['route_frequency_norm'] = 0
 
         # One-hot a small set of categorical columns for modelling but keep originals
-        cat_cols = [c for c in ['weather', 'weather_severity_cat', 'route_id', 'time_of_day', 'day_type'] if c in df.columns]
+        cat_cols = [c for c in CATEGORICAL_COLUMNS if c in df.columns]
         if cat_cols:
-            dummies = pd.get_dummies(df[cat_cols].astype(str), dummy_na=False)
-            df = pd.concat([df, dummies], axis=1)
+            vocab = stats['vocabularies']
+            cats = pd.DataFrame({
+                c: pd.Categorical(df[c].astype(str), categories=vocab.get(c, [])) for c in cat_cols
+            }, index=df.index)
+            dummies = _sparse_dummies(cats) if sparse else pd.get_dummies(cats, dummy_na=False)
+            # the existing columns are taken over as they are, not copied
+            df = pd.concat([df, dummies], axis=1, copy=False)
 
         # Optional winsorization for numeric stability (applies to passenger_count and delay_minutes)
         if winsorize:
-            nums = [c for c in ['passenger_count', 'delay_minutes'] if c in df.columns]
+            nums = [c for c in WINSOR_COLUMNS if c in df.columns]
             for c in nums:
                 try:
-                    low = df[c].quantile(lower_q)
-                    high = df[c].quantile(upper_q)
+                    low, high = stats['winsor_bounds'][c]
                     df[c + '_orig'] = df[c]
                     df[c + '_winsor'] = df[c].clip(lower=low, upper=high)
                 except Exception:
                     df[c + '_orig'] = df.get(c)
                     df[c + '_winsor'] = df.get(c)
+        return df
 
-        self.df = df
+    def _route_history_inputs(self, df: pd.DataFrame):
+        """Route key, scheduled time and delay of every row, for the history windows."""
+        if 'route_id_clean' in df.columns:
+            route = df['route_id_clean']
+        else:
+            route = df['route_id'].astype(str).str.strip()
+        when = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+        if 'scheduled_time' in df.columns:
+            try:
+                when = _scheduled_datetimes(df, self.statistics['datetime_format'])
+            except Exception:
+                pass
+        delay = df.get('delay_minutes', pd.Series(np.nan, index=df.index))
+        return route, when, delay
+
+    def add_route_history(self, df: pd.DataFrame, history: dict = None):
+        """Per-route delay history features (see ``route_history_columns``), never
+        using a trip's own delay.
+
+        ``history`` (a fitted state's latest trips per route) is the past of
+        the rows in ``df``; without it only ``df``'s own trips count.
+        """
+        if 'route_id' not in df.columns and 'route_id_clean' not in df.columns:
+            return df
+        route, when, delay = self._route_history_inputs(df)
+        n_past = 0
+        if history:
+            n_past = len(history['route'])
+            past_when = pd.to_datetime(pd.Series(history['when'], dtype=object))
+            route = np.concatenate([np.asarray(history['route'], dtype=object),
+                                    route.to_numpy(dtype=object)])
+            when = np.concatenate([past_when.to_numpy('datetime64[ns]'),
+                                   when.to_numpy('datetime64[ns]')])
+            delay = pd.to_numeric(delay, errors='coerce').to_numpy(float, na_value=np.nan)
+            delay = np.concatenate([np.asarray(history['delay'], dtype=float), delay])
+        features = _route_delay_history(route, when, delay).iloc[n_past:]
+        for c in features.columns:
+            df[c] = features[c].to_numpy()
         return df
 
     def get_feature_list(self):
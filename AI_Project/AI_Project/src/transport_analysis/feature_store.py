@@ -0,0 +1,186 @@
+"""Content-addressed on-disk store of engineered frames.
+
+An engineered frame depends only on the cleaned frame, the FeatureEngineer
+options and the feature engineering code, so the three together name it:
+``FeatureStore.key`` hashes the cleaned frame's values, column names and
+dtypes, the options, and the source of the modules that compute features.
+``FeatureStore.fit`` returns the stored result for a known key and runs
+feature engineering (then stores its result) only for a new one, so an
+identical build never runs twice, whichever script asks for it.
+
+Frames are stored as Parquet (pickle when pyarrow is missing, or for frames
+with pandas sparse columns) next to the fitted feature state, and an index
+file keeps their sizes and last use. ``max_bytes`` bounds the store: the
+least recently used entries are evicted first. ``invalidate`` drops one
+entry or all of them.
+"""
+import hashlib
+import inspect
+import json
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from . import data_cleaner, feature_engineer, quantile_sketch
+from .data_loader import pa, save_data, DataLoader
+from .feature_engineer import FeatureEngineer
+
+# modules whose source determines the engineered frame (part of every key); feature
+# engineering parses times with data_cleaner's OUTPUT_DATETIME_FORMAT and FORMATTED_FROM
+CODE_MODULES = (feature_engineer, quantile_sketch, data_cleaner)
+INDEX_NAME = 'index.json'
+# size bound the project scripts give their store (<project>/.feature_store)
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# FeatureEngineer.fit() keywords and their defaults; spelled-out defaults key alike
+FIT_DEFAULTS = {name: p.default
+                for name, p in inspect.signature(FeatureEngineer.fit).parameters.items()
+                if name != 'self'}
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """Hash of the values, column names and dtypes of ``df`` (not its index)."""
+    h = hashlib.sha256()
+    h.update(json.dumps([[str(c), str(dt)] for c, dt in df.dtypes.items()]).encode())
+    if len(df.columns):
+        h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    h.update(str(len(df)).encode())
+    return h.hexdigest()
+
+
+def code_version() -> str:
+    """Hash of the source of CODE_MODULES."""
+    h = hashlib.sha256()
+    for module in CODE_MODULES:
+        h.update(Path(module.__file__).read_bytes())
+    return h.hexdigest()
+
+
+class FeatureStore:
+    """Engineered frames on disk under ``path``, keyed by what they were built from."""
+
+    def __init__(self, path, max_bytes: int = None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._code_version = code_version()
+
+    def key(self, df: pd.DataFrame, **options) -> str:
+        """Key of the frame FeatureEngineer(df).fit(**options) builds."""
+        unknown = set(options) - set(FIT_DEFAULTS)
+        if unknown:
+            raise TypeError(f'unknown FeatureEngineer.fit() options: {sorted(unknown)}')
+        h = hashlib.sha256()
+        h.update(frame_digest(df).encode())
+        h.update(json.dumps({**FIT_DEFAULTS, **options}, sort_keys=True, default=str).encode())
+        h.update(self._code_version.encode())
+        return h.hexdigest()[:32]
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self.path / INDEX_NAME, encoding='utf-8') as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+
+    def _write_index(self, index: dict):
+        with open(self.path / INDEX_NAME, 'w', encoding='utf-8') as fh:
+            json.dump(index, fh, indent=2)
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._read_index().get(key)
+        return entry is not None and (self.path / entry['file']).exists()
+
+    def __len__(self):
+        return len(self._read_index())
+
+    def size_bytes(self) -> int:
+        """Bytes taken by the stored entries."""
+        return sum(entry['bytes'] for entry in self._read_index().values())
+
+    def get(self, key: str):
+        """The stored FeatureEngineer (fitted, with its frame as ``df``), or None."""
+        index = self._read_index()
+        entry = index.get(key)
+        if entry is None or not (self.path / entry['file']).exists():
+            return None
+        if entry['file'].endswith('.pkl'):
+            df = pd.read_pickle(self.path / entry['file'])
+        else:
+            df = DataLoader(self.path / entry['file']).load_data()
+        state = FeatureEngineer.load_state(self.path / entry['state'])
+        engineer = FeatureEngineer.from_state(state)
+        engineer.df = df
+        entry['last_used'] = time.time()
+        self._write_index(index)
+        return engineer
+
+    def put(self, key: str, engineer: FeatureEngineer):
+        """Store a fitted engineer's frame and state under ``key``; evict old entries
+        beyond ``max_bytes``."""
+        df = engineer.df
+        sparse = any(isinstance(dtype, pd.SparseDtype) for dtype in df.dtypes)
+        file = f'{key}.pkl' if pa is None or sparse else f'{key}.parquet'
+        if file.endswith('.pkl'):
+            df.to_pickle(self.path / file)
+        else:
+            save_data(df, self.path / file)
+        state = f'{key}.state.json'
+        engineer.save_state(self.path / state)
+        index = self._read_index()
+        index[key] = {
+            'file': file,
+            'state': state,
+            'bytes': (self.path / file).stat().st_size + (self.path / state).stat().st_size,
+            'rows': len(df),
+            'created': time.time(),
+            'last_used': time.time(),
+        }
+        self._evict(index, keep=key)
+        self._write_index(index)
+        return key
+
+    def _evict(self, index: dict, keep: str = None):
+        if self.max_bytes is None:
+            return
+        total = sum(entry['bytes'] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= index[key]['bytes']
+            self._remove_files(index.pop(key))
+
+    def _remove_files(self, entry: dict):
+        for name in (entry['file'], entry['state']):
+            (self.path / name).unlink(missing_ok=True)
+
+    def invalidate(self, key: str = None) -> int:
+        """Drop the entry ``key`` (every entry when None); returns the number dropped."""
+        index = self._read_index()
+        keys = list(index) if key is None else [k for k in (key,) if k in index]
+        for k in keys:
+            self._remove_files(index.pop(k))
+        self._write_index(index)
+        return len(keys)
+
+    def fit(self, df: pd.DataFrame, copy: bool = True, **options) -> FeatureEngineer:
+        """``FeatureEngineer(df, copy=copy).fit(**options)``, or its stored result.
+
+        ``options`` are the fit() keywords (winsorize, lower_q, upper_q, ...).
+        The key is computed before engineering starts, so ``copy=False`` is
+        safe. A stored frame comes back as its file reads it (Parquet keeps
+        the dtypes; mixed-type text columns come back as strings).
+        """
+        key = self.key(df, **options)
+        engineer = self.get(key)
+        if engineer is not None:
+            self.hits += 1
+            return engineer
+        self.misses += 1
+        engineer = FeatureEngineer(df, copy=copy).fit(**options)
+        self.put(key, engineer)
+        return engineer
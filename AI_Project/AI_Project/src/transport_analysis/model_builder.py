@@ -1,21 +1,94 @@
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import train_test_split, cross_val_score, TimeSeriesSplit
 from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
 
+from .feature_engineer import one_hot_columns
+from .validation import ColumnRule
+
+# What the engineered frame must satisfy before any model is trained (checked
+# by scripts/rebuild_outputs.py with validation.check_frame): the target and
+# the core features are numeric, in range and complete.
+MODEL_INPUT_RULES = {
+    'delay_minutes': ColumnRule('number', -720, 720, max_null_rate=0.0),
+    'passenger_count': ColumnRule('number', 0, max_null_rate=0.0),
+    'latitude': ColumnRule('number', -90, 90, max_null_rate=0.0),
+    'longitude': ColumnRule('number', -180, 180, max_null_rate=0.0),
+}
+
+
+def _model_matrix(X):
+    """``X`` as the models are fitted on and predict from.
+
+    A frame holding pandas sparse columns (FeatureEngineer(sparse=True)
+    one-hot indicators) becomes a CSR matrix of its dense columns followed by
+    its sparse ones, without densifying the indicators (float32 when the
+    dense columns are, as with ModelBuilder(compact=True)); anything else is
+    returned as it is.
+    """
+    if not isinstance(X, pd.DataFrame):
+        return X
+    sparse_cols = [c for c, dtype in X.dtypes.items() if isinstance(dtype, pd.SparseDtype)]
+    if not sparse_cols:
+        return X
+    dense_cols = X.columns.difference(sparse_cols, sort=False)
+    dtype = np.float32 if all(X[c].dtype == np.float32 for c in dense_cols) else float
+    blocks = [sp.csr_matrix(X[dense_cols].to_numpy(dtype=dtype))] if len(dense_cols) else []
+    blocks.append(X[sparse_cols].sparse.to_coo())
+    return sp.hstack(blocks, format='csr', dtype=dtype)
+
+
+def _float32_frame(df: pd.DataFrame, columns) -> pd.DataFrame:
+    """``df[columns]`` as one Fortran-ordered float32 block, filled column by column.
+
+    The frame wraps a single contiguous (rows x features) float32 array, so
+    sklearn gets it without a conversion copy (RandomForest trains on float32
+    anyway) at half the memory of float64/int64 columns.
+    """
+    values = np.empty((len(df), len(columns)), dtype=np.float32, order='F')
+    for j, c in enumerate(columns):
+        values[:, j] = df[c].to_numpy(dtype=np.float32, na_value=np.nan)
+    return pd.DataFrame(values, index=df.index, columns=columns, copy=False)
+
 
 class ModelBuilder:
-    def __init__(self, engineered_df: pd.DataFrame):
-        self.df = engineered_df.copy()
+    def __init__(self, engineered_df: pd.DataFrame, copy: bool = True, compact: bool = False,
+                 one_hot: bool = False):
+        # copy=False keeps a reference to the caller's frame instead of a copy
+        self.df = engineered_df.copy() if copy else engineered_df
+        # compact=True: prepare_data hands over the features as one float32 matrix
+        self.compact = compact
+        # one_hot=True: the one-hot indicators are features too, after the numeric ones
+        self.one_hot = one_hot
         self.models = {}
         self.feature_importance = {}
         self._prepared_data = None  # cached (X_train, X_test, y_train, y_test, feature_names)
 
     def prepare_data(self, target_column='delay_minutes', test_size=0.2, random_state=42):
-        # Keep DataFrames to preserve column names for downstream uses
-        X = self.df.drop(columns=[target_column], errors='ignore').select_dtypes(include=[np.number])
+        # Keep DataFrames to preserve column names for downstream uses. The
+        # feature columns are picked from the dtypes and copied alone (not the
+        # whole frame with every one-hot column). The one-hot indicators,
+        # dense bools or sparse uint8 (FeatureEngineer(sparse=True)), are left
+        # out unless one_hot is set, then go last either way: both storage
+        # modes train on the same columns in the same order, with the sparse
+        # ones last as _model_matrix expects.
+        frame = self.df.iloc[:0]
+        one_hot = one_hot_columns(frame.dtypes)
+        numeric = frame.select_dtypes(include=[np.number]).columns
+        dense_cols = numeric.drop([target_column, *one_hot], errors='ignore').tolist()
+        sparse_cols = []
+        if self.one_hot:
+            sparse_cols = [c for c in one_hot if isinstance(frame[c].dtype, pd.SparseDtype)]
+            dense_cols += [c for c in one_hot if c not in sparse_cols]
+        if self.compact:
+            X = _float32_frame(self.df, dense_cols)
+            if sparse_cols:
+                X = pd.concat([X, self.df[sparse_cols]], axis=1, copy=False)
+        else:
+            X = self.df[dense_cols + sparse_cols]
         y = self.df[target_column] if target_column in self.df.columns else pd.Series(np.zeros(len(X)))
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
         feature_names = X.columns.tolist()
@@ -25,6 +98,7 @@ class ModelBuilder:
     def run_all_models(self, test_size=0.2, random_state=42):
         # Train a simple RandomForest and record metrics and feature importances
         X_train, X_test, y_train, y_test, feature_names = self.prepare_data(test_size=test_size, random_state=random_state)
+        X_train, X_test = _model_matrix(X_train), _model_matrix(X_test)
         rf = RandomForestRegressor(n_estimators=50, random_state=random_state)
         rf.fit(X_train, y_train)
         self.models['RandomForest'] = rf
@@ -90,8 +164,8 @@ class ModelBuilder:
                 # clone model to avoid refit side-effects
                 from sklearn.base import clone
                 m = clone(model)
-                m.fit(X_train, y_train)
-                preds = m.predict(X_test)
+                m.fit(_model_matrix(X_train), y_train)
+                preds = m.predict(_model_matrix(X_test))
                 scores.append(float(r2_score(y_test, preds)))
             except Exception:
                 scores.append(0.0)
@@ -208,8 +282,8 @@ class ModelBuilder:
 
         # fit and evaluate
         try:
-            model.fit(X_train, y_train)
-            preds = model.predict(X_test)
+            model.fit(_model_matrix(X_train), y_train)
+            preds = model.predict(_model_matrix(X_test))
             r2 = float(r2_score(y_test, preds))
             mae = float(mean_absolute_error(y_test, preds))
             rmse = float(mean_squared_error(y_test, preds, squared=False))
@@ -218,6 +292,13 @@ class ModelBuilder:
 
         return {'train_size': len(X_train), 'test_size': len(X_test), 'test_r2': r2, 'test_mae': mae, 'test_rmse': rmse}
 
+    def predict(self, model_name: str, X):
+        """Predictions of a trained model; sparse feature columns stay sparse."""
+        model = self.models.get(model_name)
+        if model is None:
+            raise ValueError(f"Model '{model_name}' not found")
+        return model.predict(_model_matrix(X))
+
     def save_model(self, model_name: str, path: str):
         """Save a trained model by name to a file using joblib."""
         import joblib
@@ -238,5 +319,5 @@ class ModelBuilder:
         if model is None:
             return {'cv_scores': [], 'cv_mean_r2': 0.0, 'cv_std_r2': 0.0}
         # use R^2 as scoring
-        scores = cross_val_score(model, X, y, cv=cv, scoring='r2')
+        scores = cross_val_score(model, _model_matrix(X), y, cv=cv, scoring='r2')
         return {'cv_scores': scores.tolist(), 'cv_mean_r2': float(scores.mean()), 'cv_std_r2': float(scores.std())}
@@ -0,0 +1,153 @@
+"""Mergeable quantile sketch (KLL) for medians and quantiles over chunks.
+
+A ``QuantileSketch`` keeps a bounded number of values however many it is fed:
+values are kept in levels, level ``h`` standing for ``2**h`` original values,
+and a level that grows past its capacity is sorted and every other value is
+promoted to the next level. Sketches built on separate chunks or workers
+merge into the sketch of the union. Until the first compaction the sketch
+holds every value and its quantiles are exact (they equal ``Series.quantile``).
+"""
+import copy
+import math
+
+import numpy as np
+
+# capacity ratio between consecutive levels (KLL's c)
+_LEVEL_RATIO = 2 / 3
+
+
+class QuantileSketch:
+    """KLL quantile sketch.
+
+    ``error`` is the target rank error (a quantile estimate is within about
+    ``error * n`` ranks of the true one); it sets the level capacity ``k``,
+    which can also be given directly. Memory is O(k) values. ``seed`` makes
+    compaction (and so the estimates) reproducible.
+    """
+
+    def __init__(self, error: float = 0.001, k: int = None, seed: int = 0):
+        self.k = k if k is not None else max(8, math.ceil(1.7 / error))
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def error(self):
+        """Approximate rank error of the estimates (0 while the sketch is exact)."""
+        return 0.0 if self.is_exact else 1.7 / self.k
+
+    @property
+    def is_exact(self):
+        return len(self.levels) == 1
+
+    def __len__(self):
+        return self.n
+
+    def update(self, values):
+        """Add ``values`` (array-like); NaN values are ignored, like pandas does."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self.n += len(values)
+            self._compress()
+        return self
+
+    def add_repeated(self, value: float, count: int):
+        """Add ``count`` copies of ``value`` using O(log count) stored values."""
+        if count <= 0 or np.isnan(value):
+            return self
+        if self.is_exact and len(self.levels[0]) + count <= self._capacity(0):
+            return self.update(np.full(count, value))
+        self.n += count
+        h = 0
+        while count:
+            if count & 1:
+                self._level(h)
+                self.levels[h] = np.append(self.levels[h], value)
+            count >>= 1
+            h += 1
+        self._compress()
+        return self
+
+    def merge(self, other: 'QuantileSketch'):
+        """Fold ``other`` into this sketch (sketch of the union of both inputs)."""
+        for h, values in enumerate(other.levels):
+            self._level(h)
+            self.levels[h] = np.concatenate([self.levels[h], values])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantile(self, q: float) -> float:
+        """Estimate the ``q`` quantile (NaN for an empty sketch)."""
+        if self.n == 0:
+            return float('nan')
+        if self.is_exact:
+            # every value is still held: same linear interpolation as pandas
+            return float(np.quantile(self.levels[0], q))
+        return _weighted_quantile(np.concatenate(self.levels), self._weights(), q)
+
+    def median(self) -> float:
+        if self.is_exact and self.n:
+            # np.median averages the middle pair exactly like Series.median
+            return float(np.median(self.levels[0]))
+        return self.quantile(0.5)
+
+    def median_abs_deviation(self, center: float = None) -> float:
+        """Median absolute deviation from ``center`` (default: the median).
+
+        Exact while the sketch is; otherwise the weighted median of the
+        deviations of the values held, an approximation of the same order as
+        the quantile estimates.
+        """
+        if self.n == 0:
+            return float('nan')
+        center = self.median() if center is None else center
+        if self.is_exact:
+            return float(np.median(np.abs(self.levels[0] - center)))
+        deviations = np.abs(np.concatenate(self.levels) - center)
+        return _weighted_quantile(deviations, self._weights(), 0.5)
+
+    def select(self, keep):
+        """Copy holding only the values the vectorized predicate ``keep`` accepts."""
+        out = copy.deepcopy(self)
+        for h, values in enumerate(out.levels):
+            mask = np.asarray(keep(values), dtype=bool)
+            out.n -= int((~mask).sum()) * 2 ** h
+            out.levels[h] = values[mask]
+        return out
+
+    def _weights(self):
+        return np.concatenate([np.full(len(v), 2 ** h) for h, v in enumerate(self.levels)])
+
+    def _level(self, h):
+        while len(self.levels) <= h:
+            self.levels.append(np.empty(0))
+
+    def _capacity(self, h):
+        depth = len(self.levels) - h - 1
+        return max(2, math.ceil(self.k * _LEVEL_RATIO ** depth))
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > self._capacity(h):
+                level = np.sort(level)
+                # an odd value out stays behind; the rest is halved at a random offset
+                keep = level[-1:] if len(level) % 2 else level[:0]
+                pairs = level[:len(level) - len(keep)]
+                promoted = pairs[self._rng.integers(2)::2]
+                self.levels[h] = keep
+                self._level(h + 1)
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+
+def _weighted_quantile(values, weights, q):
+    order = np.argsort(values, kind='stable')
+    values, cum = values[order], np.cumsum(weights[order])
+    # first value whose cumulative weight covers rank q * (n - 1) (0-based)
+    rank = q * (cum[-1] - 1)
+    return float(values[np.searchsorted(cum - 1, rank, side='left')])
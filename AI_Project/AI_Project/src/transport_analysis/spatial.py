@@ -0,0 +1,111 @@
+"""Spatial index over a stops reference table, for coordinate validation and snapping.
+
+Stops are stored as 3-D unit vectors in a KD-tree: the straight-line (chord)
+distance between unit vectors grows with the great-circle distance, so the
+tree's nearest neighbour is the nearest stop on the sphere, and whole
+columns of coordinates are matched in one batch query.
+"""
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from .data_loader import DataLoader
+
+# mean Earth radius, metres
+EARTH_RADIUS_M = 6_371_008.8
+
+
+def _unit_vectors(lat, lon) -> np.ndarray:
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord_to_metres(chord):
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(chord / 2, 1.0))
+
+
+class StopIndex:
+    """Nearest-stop lookup over ``stops`` (columns ``stop_id``, ``latitude``, ``longitude``).
+
+    ``snap`` matches coordinates to the nearest stop within ``tolerance_m``
+    metres. Coordinates outside the service area are out of bounds: the area
+    is ``bounds`` ``(min_lat, min_lon, max_lat, max_lon)`` if given, else the
+    stops' bounding box widened by ``margin_m`` metres.
+    """
+
+    def __init__(self, stops: pd.DataFrame, tolerance_m: float = 100.0, bounds=None,
+                 margin_m: float = 5000.0):
+        stops = stops.dropna(subset=['latitude', 'longitude'])
+        if stops.empty:
+            raise ValueError('stops table has no stop with coordinates')
+        if 'stop_id' in stops.columns:
+            self.stop_ids = stops['stop_id'].to_numpy()
+        else:
+            self.stop_ids = np.arange(len(stops))
+        self.latitude = stops['latitude'].to_numpy(dtype=float)
+        self.longitude = stops['longitude'].to_numpy(dtype=float)
+        self.tolerance_m = tolerance_m
+        if bounds is None:
+            dlat = np.degrees(margin_m / EARTH_RADIUS_M)
+            # a degree of longitude shrinks with the cosine of the latitude
+            widest = np.cos(np.radians(min(np.abs(self.latitude).max() + dlat, 89.0)))
+            dlon = np.degrees(margin_m / (EARTH_RADIUS_M * widest))
+            bounds = (self.latitude.min() - dlat, self.longitude.min() - dlon,
+                      self.latitude.max() + dlat, self.longitude.max() + dlon)
+        self.bounds = tuple(float(b) for b in bounds)
+        self._tree = cKDTree(_unit_vectors(self.latitude, self.longitude))
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Build the index from a stops file (CSV, Parquet or Feather, see DataLoader)."""
+        return cls(DataLoader(path).load_data(), **kwargs)
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def digest(self) -> str:
+        """Hash of the stops, the tolerance and the bounds: equal digests snap alike."""
+        h = hashlib.sha256()
+        stops = pd.DataFrame({'stop_id': self.stop_ids, 'latitude': self.latitude,
+                              'longitude': self.longitude})
+        h.update(pd.util.hash_pandas_object(stops, index=False).to_numpy().tobytes())
+        h.update(json.dumps([self.tolerance_m, self.bounds]).encode())
+        return h.hexdigest()
+
+    def out_of_bounds(self, lat, lon) -> np.ndarray:
+        """Rows with a latitude or a longitude outside the service area (missing
+        values never are)."""
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        with np.errstate(invalid='ignore'):
+            return (lat < min_lat) | (lat > max_lat) | (lon < min_lon) | (lon > max_lon)
+
+    def nearest(self, lat, lon):
+        """Position of the nearest stop and its distance in metres, for arrays of coordinates."""
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        chord, pos = self._tree.query(_unit_vectors(lat, lon))
+        return pos, _chord_to_metres(chord)
+
+    def snap(self, lat, lon) -> pd.DataFrame:
+        """Match coordinates to stops in one batch query.
+
+        Returns one row per input with ``stop`` (position of the stop snapped
+        to, -1 when none is within ``tolerance_m``), ``distance_m`` (to the
+        nearest stop) and ``out_of_bounds``. Rows with a missing or an
+        out-of-bounds coordinate are not queried (distance NaN).
+        """
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        out = self.out_of_bounds(lat, lon)
+        inside = ~(np.isnan(lat) | np.isnan(lon) | out)
+        stop = np.full(len(lat), -1)
+        distance = np.full(len(lat), np.nan)
+        rows = np.flatnonzero(inside)
+        if len(rows):
+            pos, dist = self.nearest(lat[rows], lon[rows])
+            distance[rows] = dist
+            close = dist <= self.tolerance_m
+            stop[rows[close]] = pos[close]
+        return pd.DataFrame({'stop': stop, 'distance_m': distance, 'out_of_bounds': out})
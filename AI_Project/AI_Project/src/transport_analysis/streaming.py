@@ -0,0 +1,341 @@
+"""Chunked (streaming) cleaning and feature engineering.
+
+Runs the same DataCleaner / FeatureEngineer steps as the in-memory path while
+holding only one chunk of rows at a time. Dataset-wide values (imputation
+medians, route frequencies, one-hot vocabularies, winsor bounds) are gathered
+in separate passes, so the written files match the in-memory output row for row.
+
+``clean_incremental`` cleans only the rows appended to a source file since its
+last run, using the cleaner state saved by that run.
+
+Both accept a ``TripDeduplicator``: repeated trips are then dropped before any
+statistics are gathered, whichever chunk (or run) they arrive in.
+"""
+import copy
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from .data_loader import DataLoader, detect_format, to_arrow_table
+from .cleaning_plan import CleaningStatistics, merge_steps, merge_step_reports
+from .data_cleaner import DataCleaner, cleaning_options, INPUT_RULES, OUTPUT_RULES
+from .deduplication import TripDeduplicator
+from .spatial import StopIndex
+from .feature_engineer import FeatureEngineer, FeatureStatistics
+from .utils import common_dtype, ValueCache
+from .validation import Validator
+
+# datetime columns are written with one fixed format so every chunk serializes alike
+CSV_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class _ChunkSpill:
+    """Spill processed chunks to disk, then write them as one file.
+
+    Some output dtypes depend on the whole column (an int column turns float as
+    soon as one row is NaN), so chunks are kept on disk until every chunk's
+    dtypes are known and cast to the common dtype on the way out.
+    """
+
+    def __init__(self, tmp_dir, name):
+        self.dir = Path(tmp_dir)
+        self.name = name
+        self.paths = []
+        self.dtypes = {}
+
+    def add(self, df: pd.DataFrame):
+        path = self.dir / f'{self.name}_{len(self.paths):06d}.pkl'
+        df.to_pickle(path)
+        self.paths.append(path)
+        for c, dt in df.dtypes.items():
+            self.dtypes.setdefault(c, set()).add(dt)
+
+    def __iter__(self):
+        for path in self.paths:
+            yield pd.read_pickle(path)
+
+    def _unified_chunks(self):
+        dtypes = {c: common_dtype(kinds) for c, kinds in self.dtypes.items()}
+        for df in self:
+            yield df.astype({c: dt for c, dt in dtypes.items() if df[c].dtype != dt})
+
+    def write(self, out_path, append: bool = False):
+        """Write all chunks to ``out_path`` as CSV, Parquet or Feather (by suffix).
+
+        With ``append`` the chunks are added after the rows already in the file
+        (columnar files are rewritten with the old rows first).
+        """
+        fmt = detect_format(out_path)
+        if fmt == 'csv':
+            for i, df in enumerate(self._unified_chunks()):
+                first = i == 0 and not append
+                df.to_csv(out_path, mode='w' if first else 'a', header=first, index=False,
+                          date_format=CSV_DATE_FORMAT)
+            return out_path
+        if append:
+            old = _ChunkSpill(self.dir, self.name + '_old')
+            for df in DataLoader(out_path).iter_chunks():
+                old.add(df)
+            old.paths.extend(self.paths)
+            for c, kinds in self.dtypes.items():
+                old.dtypes.setdefault(c, set()).update(kinds)
+            return old.write(out_path)
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # all-null chunks come out as Arrow null columns; unify to the widest type
+        schema = pa.unify_schemas([to_arrow_table(df).schema for df in self._unified_chunks()],
+                                  promote_options='permissive')
+        if fmt == 'parquet':
+            writer = pq.ParquetWriter(out_path, schema)
+        else:
+            writer = pa.ipc.new_file(out_path, schema)
+        with writer:
+            for df in self._unified_chunks():
+                writer.write_table(to_arrow_table(df).cast(schema))
+        return out_path
+
+
+def stream_clean_and_engineer(path, out_dir, chunksize: int = 100_000, winsorize: bool = True,
+                              lower_q: float = 0.01, upper_q: float = 0.99,
+                              cleaned_name: str = 'cleaned_transport_data.csv',
+                              engineered_name: str = 'engineered_transport_data.csv',
+                              value_cache: ValueCache = None, sketch_error: float = None,
+                              deduplicator: TripDeduplicator = None, delay_flagging: str = 'global',
+                              stops: StopIndex = None, validate: bool = False):
+    """Clean and engineer ``path`` chunk by chunk, writing the results into ``out_dir``.
+
+    Input and output formats (CSV, Parquet, Feather) follow the file suffixes.
+
+    Passes:
+      0. dtype scan so every chunk is read with the types a full read would infer
+      1. row-local cleaning only, to accumulate the cleaner's imputation statistics
+      2. full cleaning; cleaned chunks are spilled and feature statistics accumulated
+      3. feature engineering over the spilled cleaned chunks
+
+    Peak memory is one chunk (cleaned and engineered in place, without
+    defensive copies) plus the numeric columns the exact medians and
+    quantiles are taken from; with ``sketch_error`` those are summarized in
+    quantile sketches instead (bounded memory, approximate statistics).
+    Normalizer results are shared between chunks through ``value_cache`` (a
+    fresh ``ValueCache`` unless one is passed in, e.g. loaded from an
+    earlier run). With a ``deduplicator``, trips already seen (in an earlier
+    chunk, or by the deduplicator before the call) are dropped; passes 1
+    and 2 see the same rows. ``delay_flagging`` selects
+    per-route robust delay flags (see DataCleaner); their group medians and
+    MADs are gathered in pass 1 (sketched with ``sketch_error``). ``stops``
+    (a StopIndex) validates and snaps the coordinates of every chunk. With
+    ``validate`` the raw chunks are checked against the cleaner's
+    INPUT_RULES in pass 1 and the cleaned chunks against OUTPUT_RULES in
+    pass 2; a failure raises ValidationError before the next pass starts
+    and before anything is written. Returns a summary dict with the output
+    paths.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    loader = DataLoader(path)
+    dtypes = loader.infer_dtypes(chunksize)
+    if value_cache is None:
+        value_cache = ValueCache()
+
+    clean_acc = CleaningStatistics(sketch_error, delay_flagging)
+    # pass 1 drops repeats with a copy, so pass 2 starts from the same seen trips
+    first_pass_dedup = copy.deepcopy(deduplicator)
+    checks = Validator(INPUT_RULES, where=str(path)) if validate else None
+    for chunk in loader.iter_chunks(chunksize, dtype=dtypes):
+        if checks is not None:
+            checks.update(chunk)
+        cleaner = DataCleaner(chunk, value_cache=value_cache, copy=False,
+                              deduplicator=first_pass_dedup, delay_flagging=delay_flagging,
+                              stops=stops)
+        clean_acc.update(cleaner.run_row_local_steps(cleaner.df))
+    clean_stats = clean_acc.result()
+    del first_pass_dedup
+    if checks is not None:
+        checks.check()
+        checks = Validator(OUTPUT_RULES, where='cleaned data')
+
+    step_lists, reports = [], []
+    n_duplicates = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        cleaned_spill = _ChunkSpill(tmp, 'cleaned')
+        feature_acc = FeatureStatistics(lower_q, upper_q, sketch_error=sketch_error)
+        for chunk in loader.iter_chunks(chunksize, dtype=dtypes):
+            cleaner = DataCleaner(chunk, statistics=clean_stats, value_cache=value_cache,
+                                  copy=False, deduplicator=deduplicator,
+                                  delay_flagging=delay_flagging, stops=stops)
+            cleaned = cleaner.run_full_cleaning_pipeline()
+            step_lists.append(cleaner.cleaning_steps)
+            reports.append(cleaner.step_report)
+            n_duplicates += cleaner.duplicates_dropped
+            if checks is not None:
+                checks.update(cleaned)
+            cleaned_spill.add(cleaned)
+            fmt = feature_acc.observe_datetime_format(cleaned)
+            engineer = FeatureEngineer(cleaned, copy=False)
+            feature_acc.update(engineer.run_row_local_features(engineer.df, fmt))
+        feature_stats = feature_acc.result()
+        if checks is not None:
+            checks.check()
+
+        engineered_spill = _ChunkSpill(tmp, 'engineered')
+        n_rows = 0
+        for cleaned in cleaned_spill:
+            engineer = FeatureEngineer(cleaned, statistics=feature_stats, copy=False)
+            engineered_spill.add(engineer.run_full_feature_engineering(winsorize=winsorize))
+            n_rows += len(cleaned)
+
+        cleaned_path = cleaned_spill.write(out_dir / cleaned_name)
+        engineered_path = engineered_spill.write(out_dir / engineered_name)
+
+    return {
+        'cleaned_path': str(cleaned_path),
+        'engineered_path': str(engineered_path),
+        'n_rows': n_rows,
+        'duplicates_dropped': n_duplicates,
+        'cleaning_steps': merge_steps(step_lists),
+        'step_report': merge_step_reports(reports),
+        'cleaning_statistics': clean_stats,
+        'feature_statistics': feature_stats,
+    }
+
+
+def clean_incremental(path, cleaned_path, state_path, chunksize: int = 100_000,
+                      refresh: bool = False, deduplicator: TripDeduplicator = None,
+                      delay_flagging: str = 'global', stops: StopIndex = None,
+                      validate: bool = False):
+    """Clean only the rows appended to ``path`` since the last run.
+
+    The first run (or ``refresh=True``) cleans the whole file, writes
+    ``cleaned_path`` and saves the cleaner state (imputation medians, rules,
+    number of rows seen) to ``state_path``; the normalizer cache is kept next
+    to it. Later runs skip the rows already cleaned, clean the new ones with
+    the saved medians and append them to ``cleaned_path``.
+
+    The saved medians are not updated by appends. The summary's ``drift``
+    compares them with the same statistics over the new rows; when they
+    drift apart, run again with ``refresh=True`` to recompute them over the
+    full history and rewrite the cleaned file.
+
+    With a ``deduplicator`` repeated trips are dropped; the trips seen are
+    saved next to the state, so later runs also drop re-sent copies of trips
+    cleaned by earlier runs (the saved deduplicator then replaces the one
+    passed in). With a robust ``delay_flagging`` mode new rows are judged
+    against the saved per-group delay statistics. ``stops`` validates and
+    snaps coordinates (see DataCleaner). The state records these options:
+    a run with other ones (another flagging mode, stops table or trip key)
+    raises ValueError instead of reusing statistics that do not match them.
+    With ``validate`` the new rows are checked against the cleaner's
+    INPUT_RULES and OUTPUT_RULES; a failure raises ValidationError before
+    the cleaned file or the state are touched.
+    """
+    state_path = Path(state_path)
+    cache_path = state_path.with_suffix('.values.pkl')
+    trips_path = state_path.with_suffix('.trips.npz')
+    state = None
+    if not refresh and Path(cleaned_path).exists():
+        state = DataCleaner.load_state(state_path)
+    if state is not None and os.path.getsize(path) < state['source_size']:
+        raise ValueError(f'{path} is smaller than when it was last cleaned; '
+                         'only appends are supported, rerun with refresh=True')
+    if state is not None:
+        options = cleaning_options(delay_flagging, stops=stops, deduplicator=deduplicator)
+        changed = sorted(k for k, v in options.items() if state['options'].get(k) != v)
+        if changed:
+            raise ValueError(f'{state_path} was saved with other cleaning options '
+                             f'({", ".join(changed)}); its statistics do not apply, '
+                             'rerun with refresh=True')
+    value_cache = ValueCache() if state is None else ValueCache.load(cache_path)
+    if deduplicator is not None and state is not None and trips_path.exists():
+        deduplicator = TripDeduplicator.load(trips_path)
+    loader = DataLoader(path)
+    start = 0 if state is None else state['n_rows']
+    dtypes = loader.infer_dtypes(chunksize, start=start)
+    if state is not None:
+        if not dtypes:
+            return {'cleaned_path': str(cleaned_path), 'n_rows': start, 'n_new_rows': 0,
+                    'refreshed': False, 'duplicates_dropped': 0,
+                    'cleaning_steps': state['cleaning_steps'], 'step_report': [],
+                    'statistics': state['statistics'], 'drift': {}}
+        # keep the column types of the earlier rows unless the new rows need wider ones
+        saved = {c: pd.api.types.pandas_dtype(dt) for c, dt in state['dtypes'].items()}
+        dtypes = {c: common_dtype({saved.get(c, dt), dt}) for c, dt in dtypes.items()}
+
+    if state is None:
+        acc = CleaningStatistics(delay_flagging=delay_flagging)
+        first_pass_dedup = copy.deepcopy(deduplicator)
+        for chunk in loader.iter_chunks(chunksize, dtype=dtypes):
+            cleaner = DataCleaner(chunk, value_cache=value_cache, copy=False,
+                                  deduplicator=first_pass_dedup, delay_flagging=delay_flagging,
+                                  stops=stops)
+            acc.update(cleaner.run_row_local_steps(cleaner.df))
+        del first_pass_dedup
+        statistics = acc.result()
+        step_lists = []
+    else:
+        statistics = state['statistics']
+        step_lists = [state['cleaning_steps']]
+
+    new_acc = CleaningStatistics()
+    checks = None
+    if validate:
+        checks = (Validator(INPUT_RULES, where=str(path)),
+                  Validator(OUTPUT_RULES, where='cleaned data'))
+    reports = []
+    n_new = n_duplicates = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        spill = _ChunkSpill(tmp, 'cleaned')
+        for chunk in loader.iter_chunks(chunksize, dtype=dtypes, start=start):
+            if checks is not None:
+                checks[0].update(chunk)
+            cleaner = DataCleaner(chunk, statistics=statistics, value_cache=value_cache,
+                                  copy=False, deduplicator=deduplicator,
+                                  delay_flagging=delay_flagging, stops=stops)
+            # same steps as run_full_cleaning_pipeline, observing the new rows on the way
+            df = cleaner.run_row_local_steps(cleaner.df)
+            new_acc.update(df)
+            df = cleaner.apply_statistics(df, statistics)
+            df = cleaner.run_standardization_steps(df)
+            if checks is not None:
+                checks[1].update(df)
+            spill.add(df)
+            step_lists.append(cleaner.cleaning_steps)
+            reports.append(cleaner.step_report)
+            # rows of the source file, dropped duplicates included
+            n_new += len(chunk)
+            n_duplicates += cleaner.duplicates_dropped
+        if checks is not None:
+            for validator in checks:
+                validator.check()
+        spill.write(cleaned_path, append=state is not None)
+
+    cleaner.cleaning_steps = merge_steps(step_lists)
+    cleaner.save_state(state_path, n_rows=start + n_new, source_size=os.path.getsize(path),
+                       dtypes={c: str(dt) for c, dt in dtypes.items()})
+    value_cache.save(cache_path)
+    if deduplicator is not None:
+        deduplicator.save(trips_path)
+    return {
+        'cleaned_path': str(cleaned_path),
+        'n_rows': start + n_new,
+        'n_new_rows': n_new,
+        'refreshed': state is None,
+        'duplicates_dropped': n_duplicates,
+        'cleaning_steps': cleaner.cleaning_steps,
+        'step_report': merge_step_reports(reports),
+        'statistics': statistics,
+        'drift': _statistics_drift(statistics, new_acc.result()),
+    }
+
+
+def _statistics_drift(saved: dict, new: dict) -> dict:
+    """Saved medians next to the same medians over the newly cleaned rows."""
+    drift = {}
+    for key in ('passenger_count_median', 'delay_median'):
+        drift[key] = {'saved': saved[key], 'new_rows': new[key]}
+    for c, med in saved['fill_medians'].items():
+        if c in new['fill_medians']:
+            drift[f'fill_median[{c}]'] = {'saved': med, 'new_rows': new['fill_medians'][c]}
+    return drift
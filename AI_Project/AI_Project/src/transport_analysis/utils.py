@@ -1,4 +1,8 @@
+import pickle
+from pathlib import Path
+
 import numpy as np
+import pandas as pd
 
 
 def align_shap_with_features(shap_vals, X):
@@ -28,3 +32,150 @@ def align_shap_with_features(shap_vals, X):
         if a.shape[2] == n_samples and a.shape[1] != n_samples:
             return a.transpose(0, 2, 1)
     return a
+
+
+def common_dtype(dtypes):
+    """Return the dtype a column ends up with when frames with ``dtypes`` are concatenated.
+
+    Mirrors pandas: identical dtypes are kept, int/float widen to the common
+    numeric type and any other mix (bool, object, datetime) becomes object.
+    """
+    kinds = set(dtypes)
+    if len(kinds) == 1:
+        return kinds.pop()
+    if all(d.kind in 'iuf' for d in kinds):
+        return np.result_type(*kinds)
+    return np.dtype(object)
+
+
+def concat_chunks(frames):
+    """Concatenate row chunks of one frame into the frame a single run would produce.
+
+    A chunk's column can come out all-missing with a placeholder dtype (float
+    NaN where the other chunks hold datetimes), and categorical chunks may
+    have gained different categories; both are reconciled before joining.
+    """
+    frames = list(frames)
+    if len(frames) == 1:
+        return frames[0]
+    casts = [{} for _ in frames]
+    for c in frames[0].columns:
+        columns = [df[c] for df in frames]
+        if any(isinstance(col.dtype, pd.CategoricalDtype) for col in columns):
+            if all(isinstance(col.dtype, pd.CategoricalDtype) for col in columns):
+                # union in first-seen order, as categories added row by row would be
+                union = pd.api.types.union_categoricals(columns, sort_categories=False).categories
+                dtype = pd.CategoricalDtype(union)
+                for cast, col in zip(casts, columns):
+                    if col.dtype != dtype:
+                        cast[c] = dtype
+            continue
+        filled = {col.dtype for col in columns if col.notna().any()}
+        if filled:
+            dtype = common_dtype(filled)
+            for cast, col in zip(casts, columns):
+                # an all-missing chunk can only take a dtype that holds missing values
+                if col.dtype != dtype and (dtype.kind in 'mMO' or col.notna().any()):
+                    cast[c] = dtype
+    return pd.concat([df.astype(cast) if cast else df for df, cast in zip(frames, casts)])
+
+
+class ValueCache:
+    """Results of per-value functions, keyed by function name and input value.
+
+    Pass one to ``map_values`` (via ``table(name)``) to skip values seen in
+    earlier calls, e.g. across the chunks of a streaming run. ``save`` and
+    ``load`` keep it between runs.
+    """
+
+    def __init__(self, tables: dict = None):
+        self.tables = tables if tables is not None else {}
+
+    def table(self, name: str) -> dict:
+        return self.tables.setdefault(name, {})
+
+    def __len__(self):
+        return sum(len(t) for t in self.tables.values())
+
+    def save(self, path):
+        with open(path, 'wb') as fh:
+            pickle.dump(self.tables, fh)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved cache; a missing file gives an empty cache."""
+        if not Path(path).exists():
+            return cls()
+        with open(path, 'rb') as fh:
+            return cls(pickle.load(fh))
+
+
+def _object_array(items):
+    # element by element, so tuple / list results stay single objects
+    out = np.empty(len(items), dtype=object)
+    for i, v in enumerate(items):
+        out[i] = v
+    return out
+
+
+def _map_uniques(uniques, func, cache, many=None):
+    # ``many`` (if given) maps a whole list of values in one call
+    if cache is None:
+        return list(many(list(uniques))) if many is not None else [func(v) for v in uniques]
+    if many is None:
+        out = []
+        for v in uniques:
+            try:
+                out.append(cache[v])
+            except KeyError:
+                out.append(cache.setdefault(v, func(v)))
+        return out
+    new = [v for v in uniques if v not in cache]
+    for v, result in zip(new, many(new) if new else []):
+        cache.setdefault(v, result)
+    return [cache[v] for v in uniques]
+
+
+def map_values(values: pd.Series, func, cache: dict = None, many=None):
+    """Apply ``func`` to every value of ``values``, calling it once per distinct value.
+
+    The column is factorized, ``func`` runs on the distinct values (plus once
+    for missing values) and the results are mapped back, giving the same
+    result as ``values.apply(func)``. Categorical columns stay categorical.
+    ``cache`` is an optional dict of earlier ``func`` results by value (see
+    ``ValueCache``); new results are added to it. ``many``, a function mapping
+    a list of values to what ``func`` gives for each, is used for the distinct
+    values instead of calling ``func`` on each. Object columns mixing
+    value types (where 1, 1.0 and True would collapse into one value) fall
+    back to ``Series.apply``.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        cats = values.cat.categories
+        mapped = _object_array(_map_uniques(cats, func, cache, many) + [func(np.nan)])
+        new_codes, uniques = pd.factorize(mapped)
+        codes = values.cat.codes.to_numpy()
+        codes = np.where(codes < 0, len(cats), codes)
+        return pd.Series(pd.Categorical.from_codes(new_codes[codes], uniques),
+                         index=values.index, name=values.name)
+    if (values.dtype == object
+            and pd.api.types.infer_dtype(values, skipna=True) not in ('string', 'empty')):
+        return values.apply(func)
+    codes, uniques = pd.factorize(values)
+    missing = values.to_numpy()[codes < 0]
+    # code -1 (missing) picks the last slot, filled below
+    mapped = _object_array(_map_uniques(uniques, func, cache, many) + [None])
+    out = mapped[codes]
+    if len(missing):
+        # missing markers (None, NaN, NaT) may map differently: once per kind
+        by_kind = {}
+        for i, v in enumerate(missing):
+            by_kind.setdefault(type(v), []).append(i)
+        na_values = np.empty(len(missing), dtype=object)
+        for rows in by_kind.values():
+            fill = np.empty(len(rows), dtype=object)
+            fill.fill(func(missing[rows[0]]))
+            na_values[rows] = fill
+        out[codes < 0] = na_values
+    # infer the dtype like Series.apply
+    return pd.Series(out, index=values.index, name=values.name).infer_objects()
@@ -0,0 +1,158 @@
+"""Fast-fail checks of column presence, dtypes, value ranges and null rates.
+
+Every check is a whole-column operation, and the counts behind them (rows,
+missing values, invalid values) add up across chunks, so a huge file is
+validated while it streams by, or on its first rows only. The stages that
+take the rule sets (DataLoader.validate, DataCleaner(validate=True), the
+streaming modes, the rebuild script) abort with a ``ValidationError`` whose
+message lists every failed check, one line each.
+"""
+import numpy as np
+import pandas as pd
+
+
+class ValidationError(ValueError):
+    """Raised when data fails its rules; ``failures`` holds one dict per failed check."""
+
+    def __init__(self, failures, where: str = 'data'):
+        self.failures = failures
+        super().__init__(f'{where} failed {len(failures)} validation check(s):\n'
+                         + '\n'.join(f"  - {f['message']}" for f in failures))
+
+
+class ColumnRule:
+    """What a column must look like.
+
+    ``kind`` is ``'number'`` (values must parse as numbers), ``'bool'`` or None
+    (anything). Numbers outside ``[min, max]`` count as invalid, except the
+    ``sentinels`` the cleaner knows how to clear. A column fails when its share
+    of missing values exceeds ``max_null_rate``, or when the share of invalid
+    values among the present ones exceeds ``max_invalid_rate``.
+    """
+
+    def __init__(self, kind: str = None, min: float = None, max: float = None,
+                 required: bool = True, max_null_rate: float = None,
+                 max_invalid_rate: float = 0.0, sentinels=()):
+        if kind not in (None, 'number', 'bool'):
+            raise ValueError(f"unknown column kind {kind!r}; use 'number', 'bool' or None")
+        self.kind = kind
+        self.min = min
+        self.max = max
+        self.required = required
+        self.max_null_rate = max_null_rate
+        self.max_invalid_rate = max_invalid_rate
+        self.sentinels = list(sentinels)
+
+    def count(self, values: pd.Series):
+        """Missing and invalid values of ``values``."""
+        missing = values.isna().to_numpy()
+        if self.kind is None:
+            return int(missing.sum()), 0
+        if self.kind == 'bool':
+            if pd.api.types.is_bool_dtype(values.dtype):
+                return int(missing.sum()), 0
+            invalid = ~(missing | values.isin([True, False]).to_numpy())
+            return int(missing.sum()), int(invalid.sum())
+        if (pd.api.types.is_numeric_dtype(values.dtype)
+                and not pd.api.types.is_bool_dtype(values.dtype)):
+            numbers = values.to_numpy(dtype=float, na_value=np.nan)
+            invalid = np.zeros(len(values), dtype=bool)
+        else:
+            numbers = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+            # present, but not a number
+            invalid = np.isnan(numbers) & ~missing
+        if self.min is not None or self.max is not None:
+            lo = -np.inf if self.min is None else self.min
+            hi = np.inf if self.max is None else self.max
+            with np.errstate(invalid='ignore'):
+                outside = (numbers < lo) | (numbers > hi)
+            if self.sentinels:
+                outside &= ~np.isin(numbers, self.sentinels)
+            invalid |= outside
+        return int(missing.sum()), int(invalid.sum())
+
+    def describe(self):
+        if self.kind == 'number' and (self.min is not None or self.max is not None):
+            return f'non-numeric or outside [{self.min}, {self.max}]'
+        return 'non-numeric' if self.kind == 'number' else 'not boolean'
+
+
+class Validator:
+    """Accumulate the counts behind ``rules`` (column -> ColumnRule) over frames or chunks."""
+
+    def __init__(self, rules: dict, where: str = 'data'):
+        self.rules = rules
+        self.where = where
+        self.n_rows = 0
+        self.columns = None
+        self._counts = {c: [0, 0] for c in rules}
+
+    def observe_columns(self, columns):
+        """Record the column names (e.g. a file header); missing required columns
+        fail right away."""
+        self.columns = list(columns)
+        failures = self._missing_columns()
+        if failures:
+            raise ValidationError(failures, self.where)
+        return self
+
+    def update(self, df: pd.DataFrame):
+        if self.columns is None:
+            self.observe_columns(df.columns)
+        self.n_rows += len(df)
+        for c, rule in self.rules.items():
+            if c in df.columns:
+                missing, invalid = rule.count(df[c])
+                self._counts[c][0] += missing
+                self._counts[c][1] += invalid
+        return self
+
+    def _missing_columns(self):
+        return [{'column': c, 'check': 'presence', 'message': f'missing required column {c!r}'}
+                for c, rule in self.rules.items() if rule.required and c not in self.columns]
+
+    def failures(self) -> list:
+        """One dict per failed check (column, check, observed rate, limit, message)."""
+        failures = self._missing_columns() if self.columns is not None else []
+        if not self.n_rows:
+            return failures
+        for c, rule in self.rules.items():
+            if self.columns is None or c not in self.columns:
+                continue
+            missing, invalid = self._counts[c]
+            null_rate = missing / self.n_rows
+            if rule.max_null_rate is not None and null_rate > rule.max_null_rate:
+                failures.append({'column': c, 'check': 'null_rate', 'observed': null_rate,
+                                 'limit': rule.max_null_rate,
+                                 'message': f'{c}: {null_rate:.1%} missing '
+                                            f'(limit {rule.max_null_rate:.1%})'})
+            present = self.n_rows - missing
+            invalid_rate = invalid / present if present else 0.0
+            if rule.kind is not None and invalid_rate > rule.max_invalid_rate:
+                failures.append({'column': c, 'check': 'invalid_rate', 'observed': invalid_rate,
+                                 'limit': rule.max_invalid_rate,
+                                 'message': f'{c}: {invalid_rate:.1%} of values {rule.describe()} '
+                                            f'(limit {rule.max_invalid_rate:.1%})'})
+        return failures
+
+    def check(self):
+        """Raise ValidationError if any check failed; return self otherwise."""
+        failures = self.failures()
+        if failures:
+            raise ValidationError(failures, self.where)
+        return self
+
+
+def validate_frame(df: pd.DataFrame, rules: dict) -> list:
+    """Failed checks of ``df`` against ``rules`` (empty when it passes)."""
+    validator = Validator(rules)
+    validator.columns = list(df.columns)
+    return validator.update(df).failures()
+
+
+def check_frame(df: pd.DataFrame, rules: dict, where: str = 'data'):
+    """Raise ValidationError if ``df`` fails ``rules``."""
+    failures = validate_frame(df, rules)
+    if failures:
+        raise ValidationError(failures, where)
+    return df
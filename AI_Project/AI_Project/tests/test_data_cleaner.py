@@ -1,7 +1,10 @@
 import pandas as pd
 import numpy as np
 import re
-from transport_analysis.data_cleaner import DataCleaner
+import pytest
+from transport_analysis.data_cleaner import (DataCleaner, _parse_time, _parse_times, _trim_value,
+                                             _trim_values, _format_dt_for_output,
+                                             _format_times_for_output)
 
 
 def test_weather_normalization_and_nan_string():
@@ -79,6 +82,18 @@ def test_fill_undefined_from_raw_and_time_am_pm():
     assert out['weather'].iloc[1] == 'Sunny'
 
 
+def test_fill_back_restores_raw_values_per_column():
+    df = pd.DataFrame({'scheduled_time': ['1/1/2025 00:00', 'soon', 'n/a'],
+                       'route_id': pd.Categorical(['R03', 'unknown ', None])})
+    out = DataCleaner(df).run_full_cleaning_pipeline()
+    # unparseable raw times come back stripped, placeholders stay missing
+    assert out['scheduled_time'].iloc[1] == 'soon'
+    assert pd.isna(out['scheduled_time'].iloc[2])
+    # raw route ids are restored verbatim (stripped), adding the category
+    assert out['route_id'].tolist()[:2] == ['Route-3', 'unknown']
+    assert out['route_id'].iloc[2] == 'Unknown'
+
+
 def test_rollover_alignment_and_flagging():
     # Case where actual_time is after midnight (time-only) and scheduled_time is late evening
     df = pd.DataFrame({
@@ -102,3 +117,166 @@ def test_rollover_alignment_and_flagging():
     out2 = cleaner2.run_full_cleaning_pipeline()
     assert bool(out2['delay_flagged'].iloc[0]) is True
     assert pd.isna(out2['delay_minutes'].iloc[0])
+
+
+def test_time_only_alignment_picks_nearest_day():
+    df = pd.DataFrame({
+        # scheduled time-only, actual dated (symmetric case); exactly 12h either way -> same day
+        'scheduled_time': ['1/2/2025 06:00', '00:10', '1/2/2025 00:00', '12:00'],
+        'actual_time': ['5:30', '1/3/2025 23:50', '12:00', '1/2/2025 00:00'],
+    })
+    out = DataCleaner(df).run_full_cleaning_pipeline()
+    assert out['delay_minutes'].iloc[0] == -30.0
+    # scheduled 00:10 placed on the next day (1/4) is 20 minutes after actual
+    assert out['delay_minutes'].iloc[1] == -20.0
+    assert out['delay_minutes'].iloc[2] == 720.0
+    assert out['delay_minutes'].iloc[3] == -720.0
+    assert out['delay_computed'].all()
+    assert not out['delay_flagged'].any()
+
+
+def test_vectorized_time_parsing_matches_row_parser():
+    values = pd.Series(['1/1/2025 00:00', '1/2/2025 11:00 PM', '1/2/2025 1:05pm',
+                        '1/3/2025 10:00:59', '1/3/2025 10:00:61', '00:20', ' 2:05PM ',
+                        '12:14 AM', '0150', '224', '2460', '2/30/2025 1:00', 'late', None, 1245])
+    expected = values.apply(_parse_time)
+    pd.testing.assert_series_equal(_parse_times(values), expected)
+    assert _parse_times(pd.Series([None, np.nan])).isna().all()
+
+
+def test_trimming_normalizes_unicode_only_where_needed():
+    values = [' Sunny ', 'ｒａｉｎ', '\u00a0Cloudy\u3000', 'caf\u0065\u0301', ' none ', 'nan', '',
+              12, None]
+    expected = ['Sunny', 'rain', 'Cloudy', 'caf\u00e9', np.nan, np.nan, np.nan, '12', np.nan]
+    for out in ([_trim_value(v) for v in values], _trim_values(values)):
+        assert [v if isinstance(v, str) else 'NaN' for v in out] == \
+            [v if isinstance(v, str) else 'NaN' for v in expected]
+
+
+def test_vectorized_time_formatting_matches_row_formatter():
+    values = pd.Series(pd.to_datetime(['2025-01-01 00:00', '2025-01-02 12:30',
+                                       '2025-01-02 23:59:59', '1900-01-01 09:05',
+                                       '1900-01-01 12:00', '1899-12-31 18:00',
+                                       '1969-12-31 23:59', None], format='mixed'))
+    out = _format_times_for_output(values)
+    pd.testing.assert_series_equal(out, values.apply(_format_dt_for_output))
+    assert out.iloc[:5].tolist() == ['2025-01-01 12:00 AM', '2025-01-02 12:30 PM',
+                                     '2025-01-02 11:59 PM', '9:05 AM', '12:00 PM']
+
+
+def test_parallel_cleaning_matches_single_process():
+    df = pd.DataFrame({
+        'route_id': ['3', 'R03', None, '05', 'r7', 'Route-4', '3', 'nan'],
+        'scheduled_time': ['garbage', 'soon', '1/1/2025 1:00', '2:05PM', '1/2/2025 23:00', None,
+                           '7:30', '1/4/2025 8:15'],
+        'actual_time': ['1:22', '224', '14:10', '5:00', '12:14 AM', '1/10/2025 00:00', None,
+                        '0150'],
+        'weather': [None, None, 'rain', 'clody', 'SUN', 'nan', 'storm', 'sunny'],
+        'passenger_count': [250, -5, 30, None, 12, 40, -1, 7],
+        'latitude': [999, 24.6, 0, 25.1, None, 24.9, 25.3, 24.7],
+        'note': [None, None, None, 'x', 'y', None, 'z', 'x'],
+    })
+    single = DataCleaner(df)
+    expected = single.run_full_cleaning_pipeline()
+    # chunks of 2: the first chunk has no parsed time and an all-missing note
+    parallel = DataCleaner(df)
+    out = parallel.run_full_cleaning_pipeline(n_jobs=2, chunksize=2)
+    pd.testing.assert_frame_equal(out, expected)
+    assert parallel.cleaning_steps == single.cleaning_steps
+    assert parallel.statistics == single.statistics
+
+
+def test_per_route_robust_delay_flagging():
+    rng = np.random.default_rng(0)
+    # route A runs ~1 minute late, route B 60 +/- 20 minutes; a 30-minute delay is only unusual on A
+    delays = np.concatenate([rng.normal(1, 1, 40), [30], rng.normal(60, 20, 40), [30]]).round()
+    sched = pd.Timestamp('2025-01-01 08:00') + pd.to_timedelta(np.arange(82), unit='h')
+    actual = sched + pd.to_timedelta(delays, unit='min')
+    df = pd.DataFrame({'route_id': ['A'] * 41 + ['B'] * 41,
+                       'scheduled_time': sched.strftime('%m/%d/%Y %H:%M'),
+                       'actual_time': actual.strftime('%m/%d/%Y %H:%M')})
+    assert not DataCleaner(df).run_full_cleaning_pipeline()['delay_flagged'].any()
+    cleaner = DataCleaner(df, delay_flagging='route')
+    out = cleaner.run_full_cleaning_pipeline()
+    assert out.index[out['delay_flagged']].tolist() == [40]
+    assert np.isnan(out.loc[40, 'delay_minutes']) and not out.loc[40, 'delay_imputed']
+    assert 'flagged_delay_outliers' in cleaner.cleaning_steps
+    groups = cleaner.statistics['delay_groups']
+    assert groups['keys'] == [['A'], ['B']] and groups['count'] == [41, 41]
+    parallel = DataCleaner(df, delay_flagging='route')
+    parallel = parallel.run_full_cleaning_pipeline(n_jobs=2, chunksize=30)
+    pd.testing.assert_frame_equal(parallel, out)
+    with pytest.raises(ValueError):
+        DataCleaner(df, delay_flagging='weekly')
+
+
+def test_delay_median_leaves_out_robust_outliers():
+    # route A: delays 0..19 and a 600-minute outlier; a keyless trip; a trip without an actual time
+    delays = np.append(np.arange(20), 600)
+    sched = pd.Timestamp('2025-01-01 08:00') + pd.to_timedelta(np.arange(23), unit='h')
+    actual = sched[:22] + pd.to_timedelta(np.append(delays, 5), unit='min')
+    actual = actual.strftime('%m/%d/%Y %H:%M')
+    df = pd.DataFrame({'route_id': ['A'] * 21 + [None, 'A'],
+                       'scheduled_time': sched.strftime('%m/%d/%Y %H:%M'),
+                       'actual_time': list(actual) + [None]})
+    expected = float(np.median(np.append(np.arange(20), 5)))
+    for kwargs in ({}, {'n_jobs': 2, 'chunksize': 8}, {'sketch_error': 0.01}):
+        cleaner = DataCleaner(df, delay_flagging='route')
+        out = cleaner.run_full_cleaning_pipeline(**kwargs)
+        assert out['delay_flagged'].tolist() == [False] * 20 + [True, False, False]
+        assert cleaner.statistics['delay_median'] == expected
+        assert out.loc[22, 'delay_minutes'] == expected and out.loc[22, 'delay_imputed']
+
+
+def test_cleaning_summary_reports_each_step():
+    df = pd.DataFrame({
+        'route_id': ['R03', ' 7 ', None],
+        'scheduled_time': ['1/1/2025 10:00', '10:00', 'bad'],
+        'actual_time': ['1/1/2025 10:05', '10:20', None],
+        'weather': ['clody', None, 'SUN'],
+        'passenger_count': [10, -5, 30],
+        'latitude': [999, 24.6, 24.7],
+    })
+    cleaner = DataCleaner(df, profile_memory=True)
+    cleaner.run_full_cleaning_pipeline()
+    report = {e['step']: e for e in cleaner.get_cleaning_summary()['step_report']}
+    # trimming and the weather / route normalizers run as one fused pass
+    assert 'trim+normalize_weather+normalize_route_id' in report
+    assert report['coordinate_sentinels']['rows_affected'] == 1
+    assert report['fix_negative_passengers']['rows_affected'] == 1
+    assert report['compute_delays']['rows_affected'] == 2
+    assert all(e['seconds'] >= 0 and e['peak_memory_delta'] is not None for e in report.values())
+
+
+def test_cleaning_steps_can_be_skipped():
+    df = pd.DataFrame({'weather': [' clody '], 'latitude': [999.0]})
+    cleaner = DataCleaner(df, skip_steps=['normalize_weather', 'coordinate_sentinels',
+                                          'fill_from_raw'])
+    out = cleaner.run_full_cleaning_pipeline()
+    assert out['weather'].iloc[0] == 'clody'
+    assert out['latitude'].iloc[0] == 999.0
+    assert 'normalized_weather' not in cleaner.cleaning_steps
+    with pytest.raises(ValueError):
+        DataCleaner(df, skip_steps=['delay_columns'])
+    with pytest.raises(ValueError):
+        DataCleaner(df, skip_steps=['no_such_step'])
+
+
+def test_copy_free_cleaning_matches_default():
+    df = pd.DataFrame({
+        'route_id': ['R03', 'unknown', None, 'Bus9'],
+        'scheduled_time': ['1/1/2025 10:00', 'soon', None, '0930'],
+        'actual_time': ['1/1/2025 10:05', '10:20', 'late', None],
+        'weather': ['clody', 'unknown', None, 'hail'],
+        'passenger_count': [10, 'abc', -5, 30],
+        'latitude': [999, 24.6, 'north', 24.7],
+    })
+    expected = DataCleaner(df).run_full_cleaning_pipeline()
+    frame = df.copy()
+    cleaner = DataCleaner(frame, copy=False)
+    out = cleaner.run_full_cleaning_pipeline()
+    # cleaned in place; only the fill-back candidates of the raw data are kept
+    assert out is frame
+    assert cleaner.raw_df is None
+    assert sum(len(pos) for pos, _ in cleaner.raw_cells.values()) < df.size
+    pd.testing.assert_frame_equal(out, expected)
@@ -0,0 +1,99 @@
+import pandas as pd
+import numpy as np
+import pytest
+from transport_analysis.data_loader import (DataLoader, save_data, find_dataset, TRANSPORT_SCHEMA,
+                                            DATASET_NAME)
+from transport_analysis.data_cleaner import DataCleaner
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyarrow = None
+
+requires_pyarrow = pytest.mark.skipif(pyarrow is None, reason='pyarrow not installed')
+
+
+def _frame():
+    return pd.DataFrame({
+        'route_id': ['Route-3', 'Route-4', None, 'Route-3'],
+        'scheduled_time': pd.to_datetime(['2025-01-01 00:00', '2025-01-01 01:00', None,
+                                          '2025-01-02 08:30']),
+        'passenger_count': [10, 20, 30, 40],
+        'latitude': [24.5, np.nan, 25.0, 24.9],
+        'delay_flagged': [False, True, False, False],
+    })
+
+
+@requires_pyarrow
+@pytest.mark.parametrize('suffix', ['parquet', 'feather'])
+def test_columnar_round_trip_preserves_dtypes(tmp_path, suffix):
+    df = _frame()
+    path = tmp_path / f'data.{suffix}'
+    save_data(df, path)
+    pd.testing.assert_frame_equal(DataLoader(path).load_data(), df)
+
+
+@requires_pyarrow
+def test_column_projection_and_numeric_columns(tmp_path):
+    path = tmp_path / 'data.parquet'
+    save_data(_frame(), path)
+    loader = DataLoader(path)
+    assert loader.get_numeric_columns() == ['passenger_count', 'latitude']
+    out = loader.load_data(columns=['passenger_count', 'latitude'])
+    assert out.columns.tolist() == ['passenger_count', 'latitude']
+
+
+@requires_pyarrow
+def test_parquet_chunks_continue_row_labels(tmp_path):
+    path = tmp_path / 'data.parquet'
+    save_data(_frame(), path)
+    chunks = list(DataLoader(path).iter_chunks(chunksize=3))
+    assert [c.index.tolist() for c in chunks] == [[0, 1, 2], [3]]
+
+
+@requires_pyarrow
+def test_mixed_object_column_stored_as_strings(tmp_path):
+    df = pd.DataFrame({'latitude': [24.5, 'x', None]})
+    path = tmp_path / 'mixed.parquet'
+    save_data(df, path)
+    assert DataLoader(path).load_data()['latitude'].tolist() == ['24.5', 'x', None]
+
+
+def test_declared_schema_dtypes_and_coercion(tmp_path):
+    path = tmp_path / 'dirty.csv'
+    pd.DataFrame({
+        'route_id': ['3', 'R03', 'Route-4', None],
+        'scheduled_time': ['1/1/2025 0:00', '1/1/2025 1:00', '1/1/2025 2:00', '1/1/2025 3:00'],
+        'actual_time': ['0150', '224', '1:30', None],
+        'weather': ['SUN', 'clody', None, 'SUN'],
+        'passenger_count': ['250', 'abc', '20.7', '-5'],
+        'latitude': [24.5, 999, None, 'x'],
+        'longitude': [32.6, 0, 31.2, 32.0],
+    }).to_csv(path, index=False)
+    df = DataLoader(path, schema=TRANSPORT_SCHEMA).load_data()
+    assert isinstance(df['route_id'].dtype, pd.CategoricalDtype)
+    assert isinstance(df['weather'].dtype, pd.CategoricalDtype)
+    assert df['actual_time'].tolist()[:2] == ['0150', '224']
+    assert str(df['passenger_count'].dtype) == 'Int32'
+    assert df['passenger_count'].tolist() == [250, pd.NA, 21, -5]
+    assert df['latitude'].dtype == np.float32
+    assert df['latitude'].isna().tolist() == [False, False, True, True]
+
+    out = DataCleaner(df).run_full_cleaning_pipeline()
+    assert out['route_id'].tolist() == ['Route-3', 'Route-3', 'Route-4', 'Unknown']
+    assert out['weather'].tolist() == ['Sunny', 'Cloudy', 'Unknown', 'Sunny']
+    # negative -> median of [250, 21]; the malformed value -> column median (135.5)
+    assert out['passenger_count'].tolist() == [250, 136, 21, 136]
+
+
+def test_find_dataset_prefers_project_root(tmp_path, monkeypatch):
+    root, cwd = tmp_path / 'project', tmp_path / 'cwd'
+    root.mkdir()
+    cwd.mkdir()
+    monkeypatch.chdir(cwd)
+    with pytest.raises(FileNotFoundError):
+        find_dataset(root)
+    (cwd / DATASET_NAME).write_text('route_id\n')
+    assert find_dataset(root) == (cwd / DATASET_NAME).resolve()
+    (root / DATASET_NAME).write_text('route_id\n')
+    assert find_dataset(root) == (root / DATASET_NAME).resolve()
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from transport_analysis.deduplication import TripDeduplicator
+from transport_analysis.data_cleaner import DataCleaner
+from transport_analysis.streaming import stream_clean_and_engineer
+
+
+def _trips():
+    return pd.DataFrame({
+        # the repeats differ in how route and time are written
+        'route_id': ['R03', 'Route-4', ' 3 ', 'Route-4', None, None, '3'],
+        'scheduled_time': ['1/1/2025 10:00', '1/1/2025 11:00', '1/1/2025 10:00 AM',
+                           '1/1/2025 11:00', '1/1/2025 12:00', '1/1/2025 12:00', 'garbage'],
+        'actual_time': ['1/1/2025 10:05', '1/1/2025 11:10', '1/1/2025 10:07', '1/1/2025 11:10',
+                        None, None, '10:00'],
+        'passenger_count': [10, 20, 1000, 20, 5, 5, 7],
+    })
+
+
+def test_repeated_trips_are_dropped_before_statistics():
+    cleaner = DataCleaner(_trips(), deduplicator=TripDeduplicator())
+    out = cleaner.run_full_cleaning_pipeline()
+    # rows 2 and 3 repeat rows 0 and 1; rows without a route or a parsed time are kept
+    assert out.index.tolist() == [0, 1, 4, 5, 6]
+    assert cleaner.get_cleaning_summary()['duplicates_dropped'] == 2
+    assert 'dropped_duplicate_trips' in cleaner.cleaning_steps
+    # the re-sent 1000 does not pull the median up
+    expected = DataCleaner(_trips().drop(index=[2, 3])).run_full_cleaning_pipeline()
+    pd.testing.assert_frame_equal(out, expected)
+    parallel = DataCleaner(_trips(), deduplicator=TripDeduplicator())
+    pd.testing.assert_frame_equal(parallel.run_full_cleaning_pipeline(n_jobs=2, chunksize=2),
+                                  expected)
+
+
+def test_seen_trips_carry_over_chunks_and_runs(tmp_path):
+    rng = np.random.default_rng(0)
+    minutes = rng.integers(0, 3000, 5000)
+    keys = pd.DataFrame({'route_id': rng.choice(['Route-1', 'Route-2'], 5000),
+                         '_scheduled_dt': pd.to_datetime(minutes * 60, unit='s')})
+    expected = keys.duplicated().to_numpy()
+    for dedup in (TripDeduplicator(), TripDeduplicator(bloom_capacity=10_000)):
+        marked = np.concatenate([dedup.duplicated(keys.iloc[i:i + 700])
+                                 for i in range(0, 5000, 700)])
+        np.testing.assert_array_equal(marked, expected)
+        loaded = TripDeduplicator.load(dedup.save(tmp_path / 'trips.npz'))
+        assert loaded.duplicated(keys.iloc[:100]).all()
+        assert loaded.n_seen == dedup.n_seen == (~expected).sum()
+
+
+def test_streaming_deduplication_matches_in_memory(tmp_path):
+    path = tmp_path / 'trips.csv'
+    _trips().to_csv(path, index=False)
+    summary = stream_clean_and_engineer(path, tmp_path / 'out', chunksize=2,
+                                        deduplicator=TripDeduplicator())
+    cleaner = DataCleaner(pd.read_csv(path), deduplicator=TripDeduplicator())
+    cleaned = cleaner.run_full_cleaning_pipeline()
+    assert summary['duplicates_dropped'] == 2 and summary['n_rows'] == len(cleaned)
+    pd.testing.assert_series_equal(pd.read_csv(summary['cleaned_path'])['passenger_count'],
+                                   cleaned['passenger_count'].reset_index(drop=True))
+
+
+def test_time_only_trips_are_keyed_on_their_resolved_day():
+    trips = pd.DataFrame({
+        'route_id': ['R1', 'R1', 'R1', 'R1', 'R2', 'R2'],
+        'scheduled_time': ['8:00', '8:00', '8:00', '8:00', '9:00', '9:00'],
+        # one trip a day at the same clock time, and a re-send of the first one
+        'actual_time': ['1/1/2025 8:05', '1/2/2025 8:03', '1/3/2025 8:10', '1/1/2025 8:06',
+                        '9:05', '9:05'],
+        'passenger_count': [10, 20, 30, 10, 5, 5],
+    })
+    cleaner = DataCleaner(trips, deduplicator=TripDeduplicator())
+    out = cleaner.run_full_cleaning_pipeline()
+    # without any date (rows 4 and 5) a trip cannot be told from another day's
+    assert out.index.tolist() == [0, 1, 2, 4, 5]
+    assert cleaner.duplicates_dropped == 1
@@ -1,6 +1,9 @@
 import pandas as pd
 import numpy as np
+import transport_analysis.feature_engineer as feature_engineer
 from transport_analysis.feature_engineer import FeatureEngineer
+from transport_analysis.data_cleaner import DataCleaner
+from transport_analysis.model_builder import ModelBuilder, _model_matrix
 
 
 def test_feature_engineer_creates_expected_columns():
@@ -44,3 +47,165 @@ def test_feature_engineer_creates_expected_columns():
     assert out['is_weekend'].tolist() == expected_is_weekend.tolist()
     assert all(out.loc[out['is_weekend'] == 1, 'day_type'].eq('weekend'))
     assert all(out.loc[out['is_weekend'] == 0, 'day_type'].eq('weekday'))
+
+
+def test_temporal_features_parse_scheduled_time_once(monkeypatch):
+    raw = pd.DataFrame({
+        'route_id': ['R1', 'R2', 'R1', 'R2'],
+        'scheduled_time': ['1/3/2025 8:00', '1/4/2025 13:45', '1/5/2025 21:10', '9:30'],
+        'actual_time': ['8:05', '13:50', '21:30', '9:35'],
+        'weather': ['Sunny', 'Rainy', 'Cloudy', 'Sunny'],
+        'passenger_count': [10, 20, 30, 40],
+    })
+    cleaned = DataCleaner(raw).run_full_cleaning_pipeline()
+    # the same frame with the helper columns as text, as read back from a CSV
+    text = cleaned.astype({'_scheduled_dt': str, '_actual_dt': str})
+    expected = FeatureEngineer(text).run_full_feature_engineering()
+
+    calls = []
+    parse = feature_engineer._to_datetime
+    monkeypatch.setattr(feature_engineer, '_to_datetime', lambda *a: calls.append(a) or parse(*a))
+    out = FeatureEngineer(cleaned).run_full_feature_engineering()
+    # the cleaner's parsed column is reused: no string parsing at all
+    assert calls == []
+    pd.testing.assert_frame_equal(out.drop(columns=['_scheduled_dt', '_actual_dt']),
+                                  expected.drop(columns=['_scheduled_dt', '_actual_dt']))
+    assert out['scheduled_hour'].tolist() == [8, 13, 21, 0]
+    assert out['is_weekend'].tolist() == [0, 1, 1, 0]
+    # otherwise the strings are parsed once for every temporal feature
+    FeatureEngineer(text).run_full_feature_engineering()
+    assert len(calls) == 1
+
+
+def test_categorical_features_are_vectorized_categoricals():
+    df = pd.DataFrame({
+        'scheduled_hour': [0, 5, 6, 11, 12, 16, 17, 21, 22, np.nan],
+        'weather': [' Thunder storm', 'Clody', 'MODERATE', 'overcast', 'clear', None, 7, 'Rainy',
+                    'fog', 'Showers'],
+    })
+    out = FeatureEngineer(df).run_row_local_features(df.copy())
+    assert out['time_of_day'].tolist() == ['night', 'night', 'morning', 'morning', 'afternoon',
+                                           'afternoon', 'evening', 'evening', 'night', 'night']
+    assert out['weather_severity'].tolist() == [2, 1, 1, 1, 0, 0, 0, 2, 0, 1]
+    assert out['weather_severity_cat'].tolist() == ['heavy', 'moderate', 'moderate', 'moderate',
+                                                    'light', 'light', 'light', 'heavy', 'light',
+                                                    'moderate']
+    # fixed categories, so chunks concatenate without falling back to object
+    assert list(out['time_of_day'].cat.categories) == ['morning', 'afternoon', 'evening', 'night']
+    assert list(out['weather_severity_cat'].cat.categories) == ['light', 'moderate', 'heavy']
+
+
+def test_sparse_one_hot_matches_dense_and_trains_without_densifying():
+    rng = np.random.default_rng(0)
+    n = 200
+    df = pd.DataFrame({
+        'route_id': [f'R{i}' for i in rng.integers(0, 60, n)],
+        'weather': rng.choice(['sunny', 'rainy', 'cloudy'], n),
+        'passenger_count': rng.integers(0, 80, n),
+        'delay_minutes': rng.normal(5, 3, n),
+    })
+    dense = FeatureEngineer(df).run_full_feature_engineering()
+    sparse = FeatureEngineer(df).run_full_feature_engineering(sparse=True)
+    assert list(sparse.columns) == list(dense.columns)
+    one_hot = [c for c in sparse.columns if isinstance(sparse[c].dtype, pd.SparseDtype)]
+    assert len(one_hot) == dense.dtypes.eq(bool).sum() > 60
+    pd.testing.assert_frame_equal(sparse[one_hot].sparse.to_dense(),
+                                  dense[one_hot].astype(np.uint8))
+    pd.testing.assert_frame_equal(sparse.drop(columns=one_hot), dense.drop(columns=one_hot))
+    # opted in, the indicators are model features, handed to the models as a CSR matrix
+    mb = ModelBuilder(sparse, one_hot=True)
+    mb.run_all_models()
+    X_test, feature_names = mb._prepared_data[1], mb._prepared_data[-1]
+    assert feature_names[-len(one_hot):] == one_hot
+    assert X_test[one_hot].dtypes.map(lambda t: isinstance(t, pd.SparseDtype)).all()
+    assert _model_matrix(X_test).format == 'csr'
+    assert mb.predict('LinearRegression', X_test).shape == (len(X_test),)
+    # a storage mode: the dense bool indicators are the same features, in the same order
+    assert ModelBuilder(dense, one_hot=True).prepare_data()[-1] == feature_names
+    # by default neither mode trains on them
+    baseline = feature_names[:-len(one_hot)]
+    assert ModelBuilder(dense).prepare_data()[-1] == baseline
+    assert ModelBuilder(sparse).prepare_data()[-1] == baseline
+
+
+def test_fitted_state_transforms_new_batches_alone(tmp_path):
+    history = pd.DataFrame({
+        'scheduled_time': [f'2025-12-{d:02d} {h:02d}:00:00'
+                           for d, h in zip(range(1, 21), range(4, 24))],
+        'weather': ['sunny', 'rainy', 'cloudy', 'storm'] * 5,
+        'route_id': ['R1', 'R2', 'R3', 'R1', 'R2'] * 4,
+        'passenger_count': range(0, 100, 5),
+        'delay_minutes': np.linspace(-5, 60, 20),
+    })
+    engineer = FeatureEngineer(history).fit(winsorize=True, lower_q=0.1, upper_q=0.9)
+    full = engineer.df
+    path = engineer.save_state(tmp_path / 'feature_state.json')
+    fitted = FeatureEngineer.from_state(FeatureEngineer.load_state(path))
+    # a batch alone gets the features (and dtypes) of the full run
+    pd.testing.assert_frame_equal(fitted.transform(history.iloc[[2, 7]]), full.iloc[[2, 7]])
+    # new trips: unseen route and weather, no target yet
+    batch = pd.DataFrame({'scheduled_time': ['2025-12-30 09:00:00'], 'weather': ['hail'],
+                          'route_id': ['R9'], 'passenger_count': [500]})
+    out = fitted.transform(batch)
+    assert list(out.columns) == list(full.columns)
+    assert out.loc[0, 'route_frequency'] == 0 and not out.filter(like='route_id_R').any(axis=None)
+    assert out.loc[0, 'passenger_count_winsor'] == full['passenger_count_winsor'].max()
+    assert out[['delay_minutes', 'delay_minutes_winsor']].isna().all(axis=None)
+    assert FeatureEngineer.load_state(tmp_path / 'missing.json') is None
+
+
+def test_route_history_uses_only_earlier_trips():
+    df = pd.DataFrame({
+        # R1 out of order, two R1 trips at 10:00, one R1 trip without a time
+        'route_id': ['R1', 'R2', 'R1', 'R1', 'R1', 'R1', ' R2'],
+        'scheduled_time': ['2025-12-01 12:00:00', '2025-12-01 08:00:00', '2025-12-01 10:00:00',
+                           '2025-12-01 10:00:00', '2025-12-02 11:00:00', None,
+                           '2025-12-01 09:00:00'],
+        'delay_minutes': [30.0, 7.0, 10.0, 20.0, 40.0, 50.0, 9.0],
+    })
+    out = FeatureEngineer(df).run_full_feature_engineering(route_history=True)
+    # R1 in time order: 10 (10:00), 20 (10:00), 30 (12:00), 40 (next day 11:00), 50 (no time)
+    assert out['route_prev_delay'].tolist() == [20, 0, 0, 10, 30, 40, 7]
+    assert out['route_delay_mean_10trips'].tolist() == [15, 0, 0, 10, 20, 25, 7]
+    # the hour windows skip trips at the same time and trips more than 24h back
+    assert out['route_delay_mean_24h'].tolist() == [15, 0, 0, 0, 30, 0, 7]
+    # changing a trip's own delay never changes its features
+    history = feature_engineer.route_history_columns()
+    own_delay = df['delay_minutes'].where(df.index != 4, -99)
+    changed = FeatureEngineer(df.assign(delay_minutes=own_delay)) \
+        .run_full_feature_engineering(route_history=True)
+    pd.testing.assert_series_equal(changed.loc[4, history], out.loc[4, history])
+    # a fitted engineer continues each route's history in new batches
+    engineer = FeatureEngineer(df.iloc[:5]).fit(route_history=True)
+    batch = pd.DataFrame({'route_id': ['R1'], 'scheduled_time': ['2025-12-02 12:00:00']})
+    out = engineer.transform(batch)
+    # 12:00 the day before is still in the 24h window
+    assert out.loc[0, 'route_prev_delay'] == 40 and out.loc[0, 'route_delay_mean_24h'] == 35
+    assert out.loc[0, 'route_delay_mean_10trips'] == 25
+
+
+def test_compact_mode_downcasts_within_tolerance():
+    df = pd.DataFrame({
+        'scheduled_time': ['2025-12-22 08:00:00', '2025-12-21 15:30:00', '2025-12-20 20:00:00',
+                           '2025-12-19 09:10:00'],
+        'weather': ['sunny', 'rainy', 'cloudy', 'sunny'],
+        'route_id': ['R1', 'R1', 'R2', 'R3'],
+        'passenger_count': [10, 300, 25, 0],
+        'delay_minutes': [1.5, 0.1, 12.25, 1e300],
+    })
+    full = FeatureEngineer(df).run_full_feature_engineering(winsorize=True)
+    engineer = FeatureEngineer(df).fit(winsorize=True, compact=True)
+    out = engineer.df
+    small = ['scheduled_hour', 'day_of_week', 'is_weekend', 'weather_severity']
+    assert out[small].dtypes.eq(np.int8).all()
+    assert out['passenger_count'].dtype == np.int16
+    assert out['route_frequency_norm'].dtype == np.float32
+    # 1e300 does not fit float32: the column stays float64
+    assert out['delay_minutes'].dtype == np.float64
+    for c in full.select_dtypes(include=[np.number]).columns:
+        np.testing.assert_allclose(out[c].to_numpy(float), full[c].to_numpy(float), rtol=1e-6)
+    # a batch keeps the compact dtypes unless a value does not fit them
+    batch = engineer.transform(df.assign(passenger_count=[1, 2, 3, 4]))
+    assert batch['passenger_count'].dtype == np.int16 and batch['scheduled_hour'].dtype == np.int8
+    batch = engineer.transform(df.assign(passenger_count=[1, 2, 3, 10 ** 6]))
+    assert batch['passenger_count'].tolist()[-1] == 10 ** 6
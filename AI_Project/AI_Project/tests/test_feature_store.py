@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+import transport_analysis.feature_store as feature_store
+import transport_analysis.data_cleaner as data_cleaner
+from transport_analysis.feature_engineer import FeatureEngineer
+from transport_analysis.feature_store import FeatureStore
+
+
+def _cleaned(n=40):
+    return pd.DataFrame({
+        'route_id': [f'R{i % 4}' for i in range(n)],
+        'scheduled_time': [f'2025-12-{1 + i % 28:02d} {i % 24:02d}:00:00' for i in range(n)],
+        'weather': ['sunny', 'rainy'] * (n // 2),
+        'passenger_count': range(n),
+        'delay_minutes': [float(i % 7) for i in range(n)],
+    })
+
+
+def test_identical_builds_run_once(tmp_path, monkeypatch):
+    store = FeatureStore(tmp_path)
+    fits = []
+    fit = FeatureEngineer.fit
+    monkeypatch.setattr(FeatureEngineer, 'fit',
+                        lambda self, **kw: fits.append(kw) or fit(self, **kw))
+    built = store.fit(_cleaned(), winsorize=True)
+    # spelled-out defaults and a new store on the same directory hit the stored entry
+    again = FeatureStore(tmp_path).fit(_cleaned(), winsorize=True, lower_q=0.01)
+    assert len(fits) == 1 and store.misses == 1
+    pd.testing.assert_frame_equal(again.df, built.df)
+    assert again.columns == built.columns
+    assert again.transform(_cleaned().iloc[:3]).shape == (3, len(built.columns))
+    # other options, data or feature code are other builds
+    store.fit(_cleaned(), winsorize=False)
+    store.fit(_cleaned().assign(passenger_count=lambda d: d.passenger_count + 1), winsorize=True)
+    monkeypatch.setattr(feature_store, 'code_version', lambda: 'changed')
+    FeatureStore(tmp_path).fit(_cleaned(), winsorize=True)
+    assert len(fits) == 4 and len(store) == 4
+    # feature parsing follows the cleaner's output formats, so its code is part of the key
+    assert data_cleaner in feature_store.CODE_MODULES
+    with pytest.raises(TypeError, match='winsorise'):
+        store.key(_cleaned(), winsorise=True)
+
+
+def test_invalidation_and_size_eviction(tmp_path):
+    store = FeatureStore(tmp_path)
+    keys = [store.key(_cleaned(n), winsorize=True) for n in (20, 40, 60)]
+    for n in (20, 40, 60):
+        store.fit(_cleaned(n), winsorize=True)
+    assert all(k in store for k in keys)
+    # reading the first entry makes the second the least recently used
+    store.get(keys[0])
+    sizes = {k: entry['bytes'] for k, entry in store._read_index().items()}
+    small = FeatureStore(tmp_path, max_bytes=sizes[keys[0]] + sizes[keys[2]])
+    small.put(keys[2], small.get(keys[2]))
+    assert [k in store for k in keys] == [True, False, True]
+    assert small.size_bytes() <= small.max_bytes
+    assert store.invalidate(keys[0]) == 1 and keys[0] not in store
+    assert store.invalidate() == 1 and len(store) == 0
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['index.json']
@@ -50,3 +50,24 @@ def test_save_and_load_model(tmp_path):
     loaded = ModelBuilder.load_model(str(model_path))
     assert hasattr(loaded, 'predict')
     os.remove(saved)
+
+
+def test_compact_prepare_data_hands_over_one_float32_matrix():
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame({'f1': rng.normal(size=200),
+                       'hour': rng.integers(0, 24, 200).astype(np.int8),
+                       'count': rng.integers(0, 500, 200),
+                       'flag': rng.integers(0, 2, 200).astype(bool)})
+    df['delay_minutes'] = 2 * df['f1'] + df['hour'] + rng.normal(size=200)
+    mb = ModelBuilder(df, compact=True)
+    X_train, X_test, y_train, y_test, feature_names = mb.prepare_data()
+    assert feature_names == ['f1', 'hour', 'count']
+    assert X_train._mgr.nblocks == 1 and (X_train.dtypes == np.float32).all()
+    values = np.asarray(X_train)
+    assert values.dtype == np.float32 and values.flags.f_contiguous
+    # RandomForest trains on float32 anyway: the same forest either way
+    mb.run_all_models()
+    dense = ModelBuilder(df)
+    dense.run_all_models()
+    np.testing.assert_array_equal(mb.models['RandomForest'].predict(X_test),
+                                  dense.models['RandomForest'].predict(dense._prepared_data[1]))
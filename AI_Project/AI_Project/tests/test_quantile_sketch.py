@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+from transport_analysis.quantile_sketch import QuantileSketch
+from transport_analysis.data_cleaner import DataCleaner, CleaningStatistics
+
+
+def _rank_bounds(values, estimate):
+    values = np.sort(values)
+    lo = np.searchsorted(values, estimate, side='left')
+    hi = np.searchsorted(values, estimate, side='right')
+    return lo, hi
+
+
+def test_small_sketch_is_exact():
+    values = np.random.default_rng(1).normal(size=500)
+    sketch = QuantileSketch(error=0.001).update(values)
+    assert sketch.is_exact
+    assert sketch.median() == pd.Series(values).median()
+    assert sketch.quantile(0.99) == pd.Series(values).quantile(0.99)
+
+
+def test_merged_sketches_stay_within_error():
+    rng = np.random.default_rng(2)
+    chunks = [rng.exponential(size=20_000) for _ in range(10)]
+    merged = QuantileSketch(error=0.01)
+    for chunk in chunks:
+        merged.merge(QuantileSketch(error=0.01).update(chunk))
+    values = np.concatenate(chunks)
+    assert len(merged) == len(values) and not merged.is_exact
+    for q in (0.01, 0.5, 0.99):
+        lo, hi = _rank_bounds(values, merged.quantile(q))
+        target = q * (len(values) - 1)
+        assert lo - 0.01 * len(values) <= target <= hi + 0.01 * len(values)
+
+
+def test_add_repeated_matches_update():
+    sketch = QuantileSketch(error=0.01).update(np.arange(100.0))
+    sketch.add_repeated(7.0, 10_000)
+    assert len(sketch) == 10_100
+    assert sketch.median() == 7.0
+
+
+def test_sketch_statistics_close_to_exact():
+    rng = np.random.default_rng(3)
+    n = 50_000
+    df = pd.DataFrame({
+        'passenger_count': rng.integers(-5, 80, n).astype(float),
+        'latitude': rng.normal(40, 1, n),
+        'delay_minutes': rng.normal(5, 3, n),
+    })
+    rows = DataCleaner(df).run_row_local_steps(df.copy())
+    exact = CleaningStatistics().update(rows).result()
+    approx = CleaningStatistics(sketch_error=0.001).update(rows).result()
+    assert approx['passenger_count_median'] == exact['passenger_count_median']
+    assert abs(approx['fill_medians']['latitude'] - exact['fill_medians']['latitude']) < 0.01
+    assert abs(approx['delay_median'] - exact['delay_median']) < 0.05
+
+
+def test_median_abs_deviation():
+    rng = np.random.default_rng(4)
+    values = rng.normal(size=500)
+    exact = QuantileSketch(error=0.001).update(values)
+    assert exact.median_abs_deviation() == np.median(np.abs(values - np.median(values)))
+    big = rng.normal(size=100_000)
+    sketch = QuantileSketch(error=0.01).update(big)
+    # MAD of a standard normal is about 0.6745
+    assert abs(sketch.median_abs_deviation() - 0.6745) < 0.03
+
+
+def test_select_keeps_accepted_values():
+    values = np.random.default_rng(4).normal(size=20_000)
+    sketch = QuantileSketch(0.01).update(values)
+    kept = sketch.select(lambda v: v > 0)
+    assert len(sketch) == 20_000 and abs(len(kept) - (values > 0).sum()) < 0.02 * len(values)
+    lo, hi = _rank_bounds(values[values > 0], kept.median())
+    assert abs((lo + hi) / 2 - len(kept) / 2) <= 0.02 * len(values)
+    small = QuantileSketch().update([1.0, 5.0, 9.0])
+    assert small.select(lambda v: v < 6).median() == 3.0
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from transport_analysis.spatial import StopIndex, EARTH_RADIUS_M
+from transport_analysis.data_cleaner import DataCleaner
+
+
+def _stops():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'stop_id': [f'S{i}' for i in range(200)],
+                         'latitude': rng.uniform(24.5, 25.5, 200),
+                         'longitude': rng.uniform(31.5, 32.8, 200)})
+
+
+def test_nearest_stop_matches_great_circle_distance():
+    stops = _stops()
+    index = StopIndex(stops)
+    rng = np.random.default_rng(1)
+    lat, lon = rng.uniform(24.4, 25.6, 500), rng.uniform(31.4, 32.9, 500)
+    pos, dist = index.nearest(lat, lon)
+    # haversine distance to every stop
+    p1, p2 = np.radians(lat)[:, None], np.radians(stops['latitude'].to_numpy())[None]
+    dlon = np.radians(stops['longitude'].to_numpy())[None] - np.radians(lon)[:, None]
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dlon / 2) ** 2
+    brute = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+    np.testing.assert_array_equal(pos, brute.argmin(axis=1))
+    np.testing.assert_allclose(dist, brute.min(axis=1), rtol=1e-6)
+
+
+def test_coordinates_are_snapped_and_out_of_bounds_flagged():
+    stops = _stops()
+    df = pd.DataFrame({
+        # near stop S3, near nothing, out of bounds, latitude out of bounds without a longitude
+        'latitude': [stops.latitude[3] + 0.0003, 25.0, 40.0, 40.0],
+        'longitude': [stops.longitude[3], 32.0, 32.0, None],
+        'passenger_count': [10, 20, 30, 40],
+    })
+    index = StopIndex(stops, tolerance_m=100)
+    far = index.nearest([25.0], [32.0])[1][0]
+    assert far > 100
+    cleaner = DataCleaner(df, stops=index)
+    out = cleaner.run_full_cleaning_pipeline()
+    assert out.loc[0, 'snapped_stop_id'] == 'S3' and out['snapped_stop_id'][1:].isna().all()
+    assert out.loc[0, 'latitude'] == round(stops.latitude[3], 8)
+    assert out.loc[1, 'latitude'] == 25.0
+    assert round(out.loc[1, 'stop_distance_m'], 3) == round(far, 3)
+    assert out['coordinate_flagged'].tolist() == [False, False, True, True]
+    # flagged coordinates stay missing: not kept, not moved to the median point
+    assert out.loc[2:, ['latitude', 'longitude']].isna().all().all()
+    assert out.loc[:1, ['latitude', 'longitude']].notna().all().all()
+    assert {'flagged_out_of_bounds_coordinates',
+            'snapped_coordinates_to_stops'} <= set(cleaner.cleaning_steps)
+    parallel = DataCleaner(df, stops=index).run_full_cleaning_pipeline(n_jobs=2, chunksize=2)
+    pd.testing.assert_frame_equal(parallel, out)
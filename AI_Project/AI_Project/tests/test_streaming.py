@@ -0,0 +1,100 @@
+import json
+import pandas as pd
+from transport_analysis.data_loader import DataLoader
+from transport_analysis.data_cleaner import DataCleaner
+from transport_analysis.feature_engineer import FeatureEngineer
+import pytest
+from transport_analysis.streaming import stream_clean_and_engineer, clean_incremental
+from transport_analysis.deduplication import TripDeduplicator
+
+
+def _write_dirty_csv(path):
+    df = pd.DataFrame({
+        'route_id': ['3', 'R03', 'Route-4', None, '05', 'r7', 'Route-4', '3', 'nan', 'R12'],
+        'scheduled_time': ['1/1/2025 0:00', '1/1/2025 1:00', '2:05PM', None, '1/2/2025 23:00',
+                           '1/3/2025 10:00 PM', '7:30', 'garbage', '1/4/2025 8:15',
+                           '1/5/2025 9:00'],
+        'actual_time': ['1:22', '224', '14:10', '5:00', '12:14 AM', '1/10/2025 00:00', None,
+                        '0150', '8:20', '915'],
+        'weather': ['SUN', 'clody', None, 'rain', 'Heavy Rain', 'nan', 'sunny', 'storm', 'cloudy',
+                    'SUN'],
+        'passenger_count': [250, -5, 30, None, 12, 40, -1, 7, 300, 55],
+        'latitude': [999, 24.6, 0, 25.1, None, 24.9, 25.3, 24.7, 999, 25.0],
+        'longitude': [None, 32.6, 999, 31.2, 32.5, 0, 32.1, 31.9, 32.2, 32.0],
+    })
+    df.to_csv(path, index=False)
+
+
+def test_iter_chunks_matches_load_data(tmp_path):
+    path = tmp_path / 'dirty.csv'
+    _write_dirty_csv(path)
+    loader = DataLoader(path)
+    chunks = list(loader.iter_chunks(chunksize=3, dtype=loader.infer_dtypes(chunksize=3)))
+    assert [len(c) for c in chunks] == [3, 3, 3, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks), loader.load_data())
+
+
+def test_streaming_output_matches_in_memory(tmp_path):
+    path = tmp_path / 'dirty.csv'
+    _write_dirty_csv(path)
+    cleaner = DataCleaner(DataLoader(path).load_data())
+    cleaned = cleaner.run_full_cleaning_pipeline()
+    engineered = FeatureEngineer(cleaned).run_full_feature_engineering(winsorize=True)
+
+    summary = stream_clean_and_engineer(path, tmp_path / 'out', chunksize=3, winsorize=True)
+    assert summary['n_rows'] == len(cleaned)
+    assert summary['cleaning_steps'] == cleaner.cleaning_steps
+    expected_cleaned = cleaned.to_csv(index=False, date_format='%Y-%m-%d %H:%M:%S')
+    expected_engineered = engineered.to_csv(index=False, date_format='%Y-%m-%d %H:%M:%S')
+    with open(summary['cleaned_path']) as f:
+        assert f.read() == expected_cleaned
+    with open(summary['engineered_path']) as f:
+        assert f.read() == expected_engineered
+
+
+def test_incremental_cleaning_appends_new_rows(tmp_path):
+    path = tmp_path / 'dirty.csv'
+    _write_dirty_csv(path)
+    full = pd.read_csv(path)
+    full.iloc[:6].to_csv(path, index=False)
+    out, state = tmp_path / 'cleaned.csv', tmp_path / 'state.json'
+
+    first = clean_incremental(path, out, state, chunksize=4)
+    assert first['refreshed'] and first['n_rows'] == 6
+
+    full.to_csv(path, index=False)
+    second = clean_incremental(path, out, state, chunksize=4)
+    assert not second['refreshed'] and second['n_new_rows'] == 4
+    assert 'passenger_count_median' in second['drift']
+    # same as cleaning everything with the statistics saved by the first run
+    expected = DataCleaner(DataLoader(path).load_data(), statistics=first['statistics'])
+    expected = expected.run_full_cleaning_pipeline()
+    with open(out) as f:
+        assert f.read() == expected.to_csv(index=False, date_format='%Y-%m-%d %H:%M:%S')
+
+    assert clean_incremental(path, out, state)['n_new_rows'] == 0
+    refreshed = clean_incremental(path, out, state, refresh=True)
+    assert refreshed['refreshed'] and refreshed['n_rows'] == 10
+
+    full.iloc[:3].to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        clean_incremental(path, out, state)
+
+
+def test_incremental_cleaning_rejects_state_from_other_options(tmp_path):
+    path = tmp_path / 'dirty.csv'
+    _write_dirty_csv(path)
+    out, state = tmp_path / 'cleaned.csv', tmp_path / 'state.json'
+    clean_incremental(path, out, state, delay_flagging='global')
+    for options in ({'delay_flagging': 'route'}, {'deduplicator': TripDeduplicator()}):
+        with pytest.raises(ValueError, match='other cleaning options'):
+            clean_incremental(path, out, state, **options)
+    # a state saved by a cleaner that skipped a step
+    saved = json.loads(state.read_text())
+    saved['options']['skip_steps'] = ['fill_from_raw']
+    state.write_text(json.dumps(saved))
+    with pytest.raises(ValueError, match='other cleaning options'):
+        clean_incremental(path, out, state)
+    refreshed = clean_incremental(path, out, state, refresh=True, delay_flagging='route')
+    assert refreshed['refreshed'] and 'delay_groups' in refreshed['statistics']
+    assert clean_incremental(path, out, state, delay_flagging='route')['n_new_rows'] == 0
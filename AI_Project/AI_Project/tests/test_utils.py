@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+from transport_analysis.utils import map_values, ValueCache
+
+
+def test_map_values_matches_apply():
+    calls = []
+
+    def upper(v):
+        calls.append(v)
+        return v.upper() if isinstance(v, str) else 'missing'
+
+    s = pd.Series(['a', 'b', None, 'a', np.nan, 'b'] * 50)
+    out = map_values(s, upper)
+    n_mapped = len(calls)
+    pd.testing.assert_series_equal(out, s.apply(upper))
+    # once per distinct value plus once per missing marker (None, NaN)
+    assert n_mapped == 4
+
+
+def test_map_values_mixed_types_fall_back_to_apply():
+    s = pd.Series([1, 1.0, True, '1'])
+    pd.testing.assert_series_equal(map_values(s, repr), s.apply(repr))
+
+
+def test_map_values_keeps_tuple_results():
+    s = pd.Series(['a', 'b', 'a'])
+    assert map_values(s, lambda v: (v, 1)).tolist() == [('a', 1), ('b', 1), ('a', 1)]
+
+
+def test_map_values_uses_list_function():
+    calls = []
+
+    def norm(v):
+        calls.append(v)
+        return str(v).strip()
+
+    def many(values):
+        return [str(v).strip() for v in values]
+
+    s = pd.Series([' x', 'y ', ' x', None])
+    assert map_values(s, norm, many=many).tolist() == ['x', 'y', 'x', 'None']
+    # only the missing marker is mapped on its own
+    assert calls == [None]
+    cache = {'y ': 'cached'}
+    assert map_values(s, norm, cache, many).tolist() == ['x', 'cached', 'x', 'None']
+    assert cache[' x'] == 'x'
+
+
+def test_value_cache_reused_and_persisted(tmp_path):
+    calls = []
+
+    def norm(v):
+        calls.append(v)
+        return str(v).strip()
+
+    cache = ValueCache()
+    s = pd.Series([' x', 'y ', ' x'])
+    map_values(s, norm, cache.table('norm'))
+    assert len(calls) == 2
+    path = cache.save(tmp_path / 'cache.pkl')
+    loaded = ValueCache.load(path)
+    out = map_values(s, norm, loaded.table('norm'))
+    assert len(calls) == 2
+    assert out.tolist() == ['x', 'y', 'x']
+    assert len(ValueCache.load(tmp_path / 'missing.pkl')) == 0
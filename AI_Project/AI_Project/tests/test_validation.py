@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+from transport_analysis.validation import ColumnRule, ValidationError, Validator, validate_frame
+from transport_analysis.data_cleaner import DataCleaner
+from transport_analysis.data_loader import DataLoader
+from transport_analysis.streaming import stream_clean_and_engineer
+
+
+def _raw():
+    return pd.DataFrame({
+        'route_id': ['R1', 'Route-2', '3', None],
+        'scheduled_time': ['1/1/2025 10:00', '1/1/2025 11:00', '1/1/2025 12:00', '1/1/2025 13:00'],
+        'actual_time': ['1/1/2025 10:05', None, '12:20', '13:01'],
+        'passenger_count': [10, -5, 30, None],
+        'latitude': [24.5, 999, 25.0, 0],
+        'longitude': [32.1, 32.2, 32.3, 32.4],
+    })
+
+
+def test_rules_count_missing_and_invalid_values():
+    rules = {
+        'n': ColumnRule('number', 0, 10, max_null_rate=0.25, sentinels=[999]),
+        'flag': ColumnRule('bool'),
+        'text': ColumnRule(required=False),
+        'other': ColumnRule(),
+    }
+    df = pd.DataFrame({'n': [1, 'x', 999, 11, None], 'flag': [True, False, True, 'yes', None]})
+    failures = {(f['column'], f['check']): f for f in validate_frame(df, rules)}
+    assert set(failures) == {('other', 'presence'), ('flag', 'invalid_rate'), ('n', 'invalid_rate')}
+    # 'x' and 11 are invalid, the 999 sentinel is not; one missing of five is within the limit
+    assert failures[('n', 'invalid_rate')]['observed'] == 0.5
+    assert failures[('flag', 'invalid_rate')]['observed'] == 0.25
+    # the counts add up over chunks
+    validator = Validator(rules)
+    validator.columns = list(df.columns) + ['other']
+    for i in range(0, 5, 2):
+        validator.update(df.iloc[i:i + 2])
+    assert validator.n_rows == 5 and validator._counts['n'] == [1, 2]
+
+
+def test_loader_fails_on_header_before_reading_rows(tmp_path):
+    path = tmp_path / 'trips.csv'
+    _raw().drop(columns='route_id').to_csv(path, index=False)
+    with pytest.raises(ValidationError, match="missing required column 'route_id'") as err:
+        DataLoader(path).validate({'route_id': ColumnRule(),
+                                   'latitude': ColumnRule('number', -90, 90)})
+    assert len(err.value.failures) == 1
+    # only the first rows are checked with max_rows
+    rules = {'latitude': ColumnRule('number', -90, 90)}
+    assert DataLoader(path).validate(rules, chunksize=1, max_rows=1).n_rows == 1
+    with pytest.raises(ValidationError, match='latitude: 25.0% of values'):
+        DataLoader(path).validate(rules, chunksize=1)
+
+
+def test_cleaner_checks_input_and_output(tmp_path):
+    cleaner = DataCleaner(_raw(), validate=True)
+    out = cleaner.run_full_cleaning_pipeline()
+    steps = [e['step'] for e in cleaner.get_cleaning_summary()['step_report']
+             if e['phase'] == 'validation']
+    assert steps == ['validate_input', 'validate_output']
+    pd.testing.assert_frame_equal(out, DataCleaner(_raw()).run_full_cleaning_pipeline())
+    bad = _raw().assign(passenger_count=['many', None, None, None])
+    with pytest.raises(ValidationError, match='passenger_count: 75.0% missing'):
+        DataCleaner(bad, validate=True).run_full_cleaning_pipeline(n_jobs=2)
+    path = tmp_path / 'bad.csv'
+    bad.to_csv(path, index=False)
+    with pytest.raises(ValidationError, match='passenger_count'):
+        stream_clean_and_engineer(path, tmp_path / 'out', chunksize=2, validate=True)
+    assert not (tmp_path / 'out' / 'cleaned_transport_data.csv').exists()